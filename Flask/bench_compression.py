@@ -0,0 +1,80 @@
+#
+# Peak memory and bytes on the wire of a large JSON response, plain and compressed.
+#
+# run: python bench_compression.py [--rows 10000]
+#
+# Builds --rows payment records like GET /v1/api/payment/<customer_id> returns and sends
+# them four ways inside a request context:
+#
+#   jsonify            no compression
+#   jsonify + gzip     what the after_request hook does: the whole body, then compressed
+#   stream_json gzip   rows encoded and compressed as the response is written
+#   stream_json br     the same with brotli (only if the brotli module is installed)
+#
+# Peak is the tracemalloc peak while producing and writing the body, on top of the rows.
+#
+
+import argparse
+import time
+import tracemalloc
+from decimal import Decimal
+
+from flask import Flask, jsonify
+
+# compression puts the repo root, where response_encoding.py lives, on sys.path
+from compression import install_compression, stream_json
+import response_encoding
+from response_encoding import compressed
+
+
+def payment_rows(rows):
+    return [{
+        'customer_id': f'customer{i % 500:04d}',
+        'payment_id': f'2024-01-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:{i % 60:02d}.{i:06d}Z',
+        'email': f'customer{i % 500:04d}@example.com',
+        'amount': Decimal(f'{10 + i % 9000}.{i % 100:02d}'),
+        'currency': ('USD', 'EUR', 'INR', 'GBP', 'JPY')[i % 5],
+        'payment_method': 'paypal',
+        'status': 'Completed',
+        'paypal_payment_id': f'PAYID-M{i:012d}X',
+        'time_bucket': f'2024-01-{1 + i % 28:02d}T{i % 24:02d}#{i % 4}',
+    } for i in range(rows)]
+
+
+def jsonify_gzip(obj):
+    data = jsonify(obj).get_data()
+    return [b''.join(compressed([data], (), 'gzip'))]
+
+
+def measure(app, label, accept_encoding, build):
+    with app.test_request_context(headers={'Accept-Encoding': accept_encoding}):
+        tracemalloc.start()
+        start = time.perf_counter()
+        # a WSGI server writes each piece and drops it
+        wire = sum(len(piece) for piece in build())
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{label:<18} {peak / 2 ** 20:>9.2f} MB {wire / 2 ** 20:>9.2f} MB {elapsed * 1000:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='large response memory and size')
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    install_compression(app, {})
+    obj = {'customer_id': 'customer0001', 'payments': payment_rows(args.rows)}
+
+    print(f"{args.rows} rows")
+    print(f"{'body':<18} {'peak':>12} {'on the wire':>12} {'time':>11}")
+    measure(app, 'jsonify', '', lambda: [jsonify(obj).get_data()])
+    measure(app, 'jsonify + gzip', 'gzip', lambda: jsonify_gzip(obj))
+    measure(app, 'stream_json gzip', 'gzip', lambda: stream_json(obj).response)
+    if response_encoding.brotli is not None:
+        measure(app, 'stream_json br', 'br', lambda: stream_json(obj).response)
+
+
+if __name__ == '__main__':
+    main()
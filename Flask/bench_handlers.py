@@ -0,0 +1,276 @@
+#
+# CPU time and allocations of every route of the Flask app, with zero-latency stand-ins
+# for storage and PayPal, checked against a stored baseline.
+#
+# run: python bench_handlers.py [--threshold 0.25] [--memory-threshold 0.10] [--only name] [--update]
+#
+# Each case sends one request through the app's test client, so the whole Flask request
+# cycle is measured: routing, before/after_request hooks (compression included), body
+# parsing and validation, the view and encoding the response, streamed bodies read to
+# the end. Storage is a Storage subclass answering from dicts built up front, PayPal a
+# session whose post() returns canned responses. Per case it reports:
+#
+#   us/call   best of --rounds timeit runs, divided by the calls per run
+#   peak KiB  tracemalloc peak of one call above what was allocated before it
+#
+# The results are compared with bench_handlers_baseline.json. A case slower than the
+# baseline by more than --threshold, or with a peak above it by more than
+# --memory-threshold, is reported and the script exits 1. Times only compare on the same
+# machine and Python: refresh the baseline there with --update after an intended change.
+#
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+from decimal import Decimal
+from types import SimpleNamespace
+
+import paymentApp
+from rate_limit import RateLimiter
+from storage import Storage
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_handlers_baseline.json')
+
+CUSTOMER_ID = 'customer0001'
+LONG_HISTORY_CUSTOMER_ID = 'customer0002'
+EMAIL = 'customer0001@example.com'
+
+
+def customer_items(count):
+    return {f'customer{i:04d}': {'customer_id': f'customer{i:04d}', 'email': f'customer{i:04d}@example.com',
+                                 'version': Decimal(3)} for i in range(1, count + 1)}
+
+
+def payment_items(customer_id, count):
+    return [{
+        'customer_id': customer_id,
+        'payment_id': f'2024-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}.{i:06d}Z',
+        'email': f'{customer_id}@example.com',
+        'amount': Decimal(f'{10 + i % 900}.{i % 100:02d}'),
+        'currency': ('USD', 'EUR', 'INR', 'GBP', 'JPY')[i % 5],
+        'payment_method': 'paypal',
+        'status': 'Completed',
+        'paypal_payment_id': f'PAYID-M{i:012d}X',
+        'time_bucket': f'2024-01-01T{i // 3600 % 24:02d}#0',
+    } for i in range(count)]
+
+
+class StubStorage(Storage):
+    # answers from dicts and keeps no state, so every call does the same work
+
+    def __init__(self):
+        self.customers = customer_items(1000)
+        self.by_email = {item['email']: [item] for item in self.customers.values()}
+        self.histories = {CUSTOMER_ID: payment_items(CUSTOMER_ID, 100),
+                          LONG_HISTORY_CUSTOMER_ID: payment_items(LONG_HISTORY_CUSTOMER_ID, 1000)}
+        self.summaries = {CUSTOMER_ID: {
+            'customer_id': CUSTOMER_ID, 'payment_count': Decimal(12), 'count_USD': Decimal(10),
+            'total_USD': Decimal('1250.50'), 'count_EUR': Decimal(2), 'total_EUR': Decimal('99.00'),
+            'last_payment_at': '2024-01-01T00:00:11.000011Z'}}
+
+    def claim_email(self, customer_id, email):
+        return True
+
+    def release_email(self, customer_id, email):
+        pass
+
+    def put_customer(self, customer_id, email):
+        return self.customers.get(customer_id, {})
+
+    def get_customer(self, customer_id):
+        return self.customers.get(customer_id)
+
+    def get_customers(self, customer_ids):
+        return {customer_id: self.customers[customer_id] for customer_id in customer_ids
+                if customer_id in self.customers}, []
+
+    def customers_by_email(self, email):
+        return self.by_email.get(email, [])
+
+    def put_payments(self, records, notifications=()):
+        pass
+
+    def payment_history(self, customer_id, customer_item):
+        return self.histories.get(customer_id, [])
+
+    def add_payout(self, customer_id, payment_id, amount, currency):
+        pass
+
+    def get_payout_summary(self, customer_id):
+        return self.summaries.get(customer_id, {})
+
+    def check(self):
+        pass
+
+
+class StubResponse:
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def stub_post(url, **kwargs):
+    if url.endswith('/v1/oauth2/token'):
+        return StubResponse(200, {'access_token': 'A21AAbench', 'token_type': 'Bearer', 'expires_in': 32400})
+    return StubResponse(201, {'id': 'PAYID-MBENCH0001', 'intent': 'authorize', 'state': 'created'})
+
+
+# name, test client request, expected status
+CASES = [
+    ('ready', {'method': 'GET', 'path': '/v1/api/ready'}, 200),
+    ('add_customer', {'method': 'POST', 'path': '/v1/api/customer/add',
+                      'json': {'customer_id': CUSTOMER_ID, 'email': EMAIL}}, 200),
+    ('add_customer_invalid', {'method': 'POST', 'path': '/v1/api/customer/add',
+                              'json': {'customer_id': 'c#1', 'email': 'x'}}, 400),
+    ('get_customer_by_email', {'method': 'GET', 'path': '/v1/api/customer', 'query_string': {'email': EMAIL}}, 200),
+    ('get_customer', {'method': 'GET', 'path': f'/v1/api/customer/{CUSTOMER_ID}'}, 200),
+    ('get_customer_not_modified', {'method': 'GET', 'path': f'/v1/api/customer/{CUSTOMER_ID}',
+                                   'headers': {'If-None-Match': '"v3"'}}, 304),
+    ('batch_get_customers_100', {'method': 'POST', 'path': '/v1/api/customers:batchGet',
+                                 'json': {'customer_ids': [f'customer{i:04d}' for i in range(1, 101)]}}, 200),
+    ('batch_get_customers_1000_gzip', {'method': 'POST', 'path': '/v1/api/customers:batchGet',
+                                       'json': {'customer_ids': [f'customer{i:04d}' for i in range(1, 1001)]},
+                                       'headers': {'Accept-Encoding': 'gzip'}}, 200),
+    ('get_payout_summary', {'method': 'GET', 'path': f'/v1/api/customer/{CUSTOMER_ID}/summary'}, 200),
+    ('process_payment', {'method': 'POST', 'path': '/v1/api/payments', 'json': {
+        'customer_id': CUSTOMER_ID, 'email': EMAIL, 'amount': 125.5, 'currency': 'USD'}}, 200),
+    ('process_payment_invalid', {'method': 'POST', 'path': '/v1/api/payments', 'json': {
+        'customer_id': CUSTOMER_ID, 'email': EMAIL, 'amount': 0, 'currency': 'usd'}}, 400),
+    ('get_payment_history_100', {'method': 'GET', 'path': f'/v1/api/payment/{CUSTOMER_ID}'}, 200),
+    ('get_payment_history_1000_gzip', {'method': 'GET', 'path': f'/v1/api/payment/{LONG_HISTORY_CUSTOMER_ID}',
+                                       'headers': {'Accept-Encoding': 'gzip'}}, 200),
+    ('not_found', {'method': 'GET', 'path': '/v1/api/unknown'}, 404),
+]
+
+
+def request_call(client, request):
+    def call():
+        response = client.open(**request)
+        # streamed bodies are only produced when read
+        response.get_data()
+        response.close()
+        return response.status_code
+    return call
+
+
+def time_per_call(calls, rounds):
+    # Rounds go over all cases in turn and each case keeps its best round, so a burst of
+    # load on the host slows one round of a case rather than all of them.
+    timers = {name: timeit.Timer(call) for name, call in calls.items()}
+    numbers = {name: timer.autorange()[0] for name, timer in timers.items()}
+    best = {}
+    for _ in range(rounds):
+        for name, timer in timers.items():
+            elapsed = timer.timeit(numbers[name]) / numbers[name]
+            best[name] = min(best.get(name, elapsed), elapsed)
+    return best
+
+
+def peak_per_call(call, calls=5):
+    # the smallest of a few calls, the first ones may still fill caches
+    peaks = []
+    tracemalloc.start()
+    for _ in range(calls):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        call()
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return min(peaks)
+
+
+def run_cases(cases, rounds):
+    client = paymentApp.paymentApp.test_client()
+    calls = {name: request_call(client, request) for name, request, _ in cases}
+    # views log, keep the formatting but not the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, _, expected in cases:
+            got = calls[name]()
+            if got != expected:
+                raise SystemExit(f'{name}: expected {expected}, got {got}, the stand-ins are out of date')
+        times = time_per_call(calls, rounds)
+        return {name: {'us_per_call': round(times[name] * 1e6, 2),
+                       'peak_kib': round(peak_per_call(calls[name]) / 1024, 1)}
+                for name, _, _ in cases}
+
+
+def change(value, base):
+    return f'{(value - base) / base * 100:+6.1f}%' if base else '       '
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    # print the results next to the baseline, return the regressions
+    regressions = []
+    cases = baseline.get('cases', {})
+    print(f"{'case':<40} {'us/call':>9} {'':>7} {'peak KiB':>9} {'':>7}")
+    for name, result in results.items():
+        base = cases.get(name)
+        if base is None:
+            print(f"{name:<40} {result['us_per_call']:>9.2f} {'new':>7} {result['peak_kib']:>9.1f}")
+            continue
+        print(f"{name:<40} {result['us_per_call']:>9.2f} {change(result['us_per_call'], base['us_per_call'])} "
+              f"{result['peak_kib']:>9.1f} {change(result['peak_kib'], base['peak_kib'])}")
+        if result['us_per_call'] > base['us_per_call'] * (1 + threshold):
+            regressions.append(f"{name}: {result['us_per_call']} us per call, baseline {base['us_per_call']}")
+        if result['peak_kib'] > base['peak_kib'] * (1 + memory_threshold):
+            regressions.append(f"{name}: peak {result['peak_kib']} KiB, baseline {base['peak_kib']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flask route microbenchmarks against a stored baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--memory-threshold', type=float, default=0.10, help='allowed growth of the peak')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--only', help='run the cases whose name contains this')
+    parser.add_argument('--update', action='store_true', help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    # no AWS or PayPal access, a fixed configuration: one provider, no journal, no rate limits
+    paymentApp.PAYPAL_SANDBOX_URL = 'https://api.sandbox.paypal.com'
+    paymentApp.PAYPAL_CLIENT_ID = paymentApp.PAYPAL_SECRET = 'bench'
+    paymentApp.storage = StubStorage()
+    http = SimpleNamespace(post=stub_post)
+    paymentApp.get_http = lambda: http
+    os.environ.pop('DISBURSEMENT_JOURNAL_DIR', None)
+    paymentApp.payment_router = paymentApp.build_payment_router({'PAYMENT_PROVIDERS': 'paypal'})
+    paymentApp.rate_limiter = RateLimiter.from_env(paymentApp.paymentApp, {})
+    paymentApp.CUSTOMER_CACHE_TTL = 0
+
+    cases = [case for case in CASES if not args.only or args.only in case[0]]
+    results = run_cases(cases, args.rounds)
+
+    python = platform.python_version()
+    if args.update:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': python, 'machine': platform.machine(), 'cases': results}, f, indent=1)
+            f.write('\n')
+        print(f'wrote {len(results)} cases to {args.baseline}')
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline.get('python', python) != python:
+        print(f"baseline is from Python {baseline['python']}, this is {python}")
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    if regressions:
+        print(f'\n{len(regressions)} over the thresholds:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
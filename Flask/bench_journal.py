@@ -0,0 +1,126 @@
+#
+# Throughput of the disbursement journal (journal.py) on the local disk.
+#
+# run: python bench_journal.py [--dir /tmp/bench-journal] [--records 20000] [--threads 1,4,16]
+#
+# For each thread count, appends payment-sized records until --records are on disk and
+# prints appends per second and per-append latency. Next to it, the same load written
+# with one write() + fsync() per record, which is what a journal without group commit
+# would cost. A final run drains the journal with a no-op writer to show how fast the
+# flusher reads segments back.
+#
+
+import argparse
+import os
+import shutil
+import statistics
+import threading
+import time
+
+from journal import Journal
+
+
+def payment_record(thread, i):
+    return {
+        'customer_id': f'bench-{thread}',
+        'payment_id': f'2024-01-01T00:00:00.{i:06d}Z',
+        'email': f'bench-{thread}@example.com',
+        'amount': '10.50',
+        'payment_method': 'paypal',
+        'status': 'Completed',
+        'currency': 'USD',
+        'time_bucket': '2024-01-01T00#0',
+        'paypal_payment_id': f'PAYID-BENCH-{thread}-{i}'
+    }
+
+
+def run_threads(threads, records, append):
+    per_thread = records // threads
+    latencies = [[] for _ in range(threads)]
+
+    def loop(t):
+        for i in range(per_thread):
+            start = time.perf_counter()
+            append(t, i)
+            latencies[t].append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=loop, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    samples = sorted(sum(latencies, []))
+    return per_thread * threads / elapsed, statistics.fmean(samples), samples[int(len(samples) * 0.99)]
+
+
+def bench_journal(directory, threads, records):
+    shutil.rmtree(directory, ignore_errors=True)
+    journal = Journal(directory)
+    result = run_threads(threads, records, lambda t, i: journal.append(payment_record(t, i)))
+    journal.close(timeout=0)
+    return result
+
+
+def bench_fsync_each(directory, threads, records):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    fd = os.open(os.path.join(directory, 'fsync-each.log'), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    lock = threading.Lock()
+
+    def append(t, i):
+        data = repr(payment_record(t, i)).encode() + b'\n'
+        with lock:
+            os.write(fd, data)
+            os.fsync(fd)
+
+    try:
+        return run_threads(threads, records, append)
+    finally:
+        os.close(fd)
+
+
+def bench_drain(directory, records):
+    shutil.rmtree(directory, ignore_errors=True)
+    journal = Journal(directory)
+    for i in range(records):
+        journal.append(payment_record(0, i))
+    journal.close()
+
+    journal = Journal(directory)
+    drained = [0]
+    done = threading.Event()
+
+    def write_batch(batch):
+        drained[0] += len(batch)
+        if drained[0] >= records:
+            done.set()
+
+    start = time.perf_counter()
+    journal.start_flusher(write_batch)
+    done.wait(60)
+    elapsed = time.perf_counter() - start
+    journal.close()
+    return drained[0] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='disbursement journal throughput')
+    parser.add_argument('--dir', default='/tmp/bench-journal')
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--threads', default='1,4,16')
+    args = parser.parse_args()
+
+    print(f"{'threads':>7}  {'mode':<12} {'appends/s':>10} {'mean us':>9} {'p99 us':>9}")
+    for threads in [int(t) for t in args.threads.split(',')]:
+        for mode, bench in (('journal', bench_journal), ('fsync each', bench_fsync_each)):
+            rate, mean, p99 = bench(args.dir, threads, args.records)
+            print(f"{threads:>7}  {mode:<12} {rate:>10.0f} {mean * 1e6:>9.1f} {p99 * 1e6:>9.1f}")
+
+    print(f"drain: {bench_drain(args.dir, args.records):.0f} records/s read back by the flusher")
+    shutil.rmtree(args.dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#
+# Simulation of payment routing (providers.py) against fake providers.
+#
+# run: python bench_providers.py [--payments 100000] [--seed 1]
+#
+# Three fake providers with different latency profiles (lognormal around a median):
+#
+#   steady    250 ms, 0.5% errors throughout
+#   fast      120 ms, 0.5% errors, but degrades to 900 ms and 40% errors for the middle third
+#   slowpoke  600 ms, 0.1% errors
+#
+# The simulated errors are refused calls, which fail over to the next provider.
+# Payments arrive every 10 ms of simulated time. The simulation drives the router's
+# choose() and record() on a simulated clock, so nothing sleeps. It compares the
+# router with always using the first provider and with round robin:
+# mean and p99 latency seen by the payer (failovers included) and the share of
+# payments that failed on every provider. Then it times choose() in real time.
+#
+
+import argparse
+import math
+import random
+import statistics
+import time
+
+from providers import Provider, Router
+
+
+class SimulatedProvider(Provider):
+
+    def __init__(self, name, phases):
+        # phases: [(until fraction of the run, median seconds, error rate)]
+        super().__init__()
+        self.name = name
+        self.phases = phases
+
+    def call(self, rng, progress):
+        for until, median, error_rate in self.phases:
+            if progress < until:
+                break
+        latency = median * math.exp(rng.gauss(0, 0.25))
+        return latency, rng.random() < error_rate
+
+
+def make_providers():
+    return [
+        SimulatedProvider('steady', [(1.0, 0.250, 0.005)]),
+        SimulatedProvider('fast', [(1 / 3, 0.120, 0.005), (2 / 3, 0.900, 0.40), (1.0, 0.120, 0.005)]),
+        SimulatedProvider('slowpoke', [(1.0, 0.600, 0.001)]),
+    ]
+
+
+def simulate(strategy, payments, seed):
+    rng = random.Random(seed)
+    clock = [0.0]
+    providers = make_providers()
+    router = Router(providers, clock=lambda: clock[0])
+    latencies = []
+    failed = 0
+
+    for i in range(payments):
+        clock[0] = i * 0.010
+        progress = i / payments
+        if strategy == 'router':
+            candidates = router.choose('USD')
+        elif strategy == 'first':
+            candidates = [providers[1]]
+        else:
+            candidates = [providers[i % len(providers)]]
+
+        total = 0.0
+        for provider in candidates:
+            latency, error = provider.call(rng, progress)
+            total += latency
+            router.record(provider.name, latency, error)
+            if not error:
+                break
+        else:
+            failed += 1
+        latencies.append(total)
+
+    latencies.sort()
+    return statistics.fmean(latencies), latencies[int(len(latencies) * 0.99)], failed / payments
+
+
+def time_choose(calls):
+    router = Router(make_providers())
+    for provider in router.providers:
+        router.record(provider.name, 0.2, False)
+    start = time.perf_counter()
+    for _ in range(calls):
+        router.choose('USD')
+    cached = (time.perf_counter() - start) / calls
+
+    # worst case: every call re-sorts because a provider reported in between
+    start = time.perf_counter()
+    for _ in range(calls):
+        router.record('steady', 0.2, False)
+        router.choose('USD')
+    resorted = (time.perf_counter() - start) / calls
+    return cached, resorted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='payment provider routing simulation')
+    parser.add_argument('--payments', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'strategy':<12} {'mean ms':>8} {'p99 ms':>8} {'failed %':>9}")
+    for strategy in ('router', 'first', 'round-robin'):
+        mean, p99, failed = simulate(strategy, args.payments, args.seed)
+        print(f"{strategy:<12} {mean * 1000:>8.1f} {p99 * 1000:>8.1f} {failed * 100:>9.3f}")
+
+    cached, resorted = time_choose(200000)
+    print(f"choose(): {cached * 1e6:.2f} us cached, {resorted * 1e6:.2f} us with record() + re-sort")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#
+# Overhead and cross-process accuracy of the rate limiter.
+#
+# run: python bench_rate_limit.py [--calls 1000000] [--processes 4] [--duration 2]
+#
+# 1. time per RateLimiter.check() in one process, for an allowed request and for a
+#    rejected one, next to an empty function call for scale.
+# 2. several forked processes hammer one key and route for --duration seconds, the
+#    way gunicorn workers share the mmap. Admitted requests must come out at
+#    burst + rate * duration whatever the number of processes.
+#
+
+import argparse
+import multiprocessing
+import os
+import time
+from rate_limit import RateLimiter, plans_from_env
+
+ROUTES = ['add_customer', 'get_customer', 'process_payment']
+
+
+def time_per_call(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def hammer(limiter, duration, admitted):
+    count = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        if limiter.check('shared', 'get_customer') == 0:
+            count += 1
+    with admitted.get_lock():
+        admitted.value += count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rate limiter overhead')
+    parser.add_argument('--calls', type=int, default=1000000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=2.0)
+    args = parser.parse_args()
+
+    # huge limits so every call takes the allowed path
+    open_plans = plans_from_env({'BASIC_PLAN_RATE_LIMIT': '1e12', 'BASIC_PLAN_BURST_LIMIT': '1e12',
+                                 'BASIC_PLAN_QUOTA_LIMIT': '1e15'})
+    limiter = RateLimiter({'key': 'basic', 'closed': 'standard'}, open_plans, ROUTES)
+    for _ in range(100):
+        limiter.check('closed', 'get_customer')
+
+    print(f"empty call:        {time_per_call(lambda: None, args.calls):7.0f} ns")
+    print(f"check() allowed:   {time_per_call(lambda: limiter.check('key', 'get_customer'), args.calls):7.0f} ns")
+    print(f"check() rejected:  {time_per_call(lambda: limiter.check('closed', 'get_customer'), args.calls):7.0f} ns")
+    print(f"check() no plan:   {time_per_call(lambda: limiter.check('nokey', 'get_customer'), args.calls):7.0f} ns")
+
+    plans = plans_from_env({})
+    limiter = RateLimiter({'shared': 'basic'}, plans, ROUTES)
+    admitted = multiprocessing.Value('q', 0)
+    ctx = multiprocessing.get_context('fork')
+    procs = [ctx.Process(target=hammer, args=(limiter, args.duration, admitted)) for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    basic = plans['basic']
+    expected = basic['burst_limit'] + basic['rate_limit'] * args.duration
+    print(f"{args.processes} processes x {args.duration}s on one basic key: {admitted.value} admitted, "
+          f"expected {expected:.0f} (burst {basic['burst_limit']:.0f} + {basic['rate_limit']:.0f}/s), "
+          f"{os.cpu_count()} cpus")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#
+# Latency of the storage operations paymentApp runs per request, per backend.
+#
+# run: python bench_storage.py [--backend sqlite|dynamodb] [--path bench.db] [--customers 1000] [--payments 5000]
+#
+# Times the same sequence against either backend: customer registration (email claim +
+# versioned put), single customer reads, a 100 id batch read, payment writes one per
+# transaction versus one batch, the same with an outbox notification (PAYMENT_NOTIFICATIONS=1),
+# payout summary updates and a payment history read.
+# The dynamodb backend talks to the real tables of the configured AWS account, so point
+# it at a test account. The sqlite file is deleted first unless --keep is given.
+#
+
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import boto3
+
+from outbox import payment_notification
+from storage import DynamoDBStorage, SQLiteStorage
+
+
+def timed(label, fn, calls):
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    print(f"{label:<28} {calls:>7} calls  mean {statistics.fmean(samples) * 1e6:>9.1f} us  "
+          f"p50 {samples[len(samples) // 2] * 1e6:>9.1f} us  p99 {samples[int(len(samples) * 0.99)] * 1e6:>9.1f} us")
+
+
+def payment_record(customer_id, i, start):
+    payment_id = (start + timedelta(microseconds=i)).isoformat() + "Z"
+    return {
+        'customer_id': customer_id,
+        'payment_id': payment_id,
+        'email': f'{customer_id}@example.com',
+        'amount': Decimal('10.50'),
+        'currency': 'USD',
+        'payment_method': 'paypal',
+        'status': 'PAYMENT_SUCCESS',
+        'paypal_payment_id': f'PAYID-BENCH-{i}',
+        'time_bucket': payment_id[:13] + '#0'
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='storage backend latency')
+    parser.add_argument('--backend', choices=('sqlite', 'dynamodb'), default='sqlite')
+    parser.add_argument('--path', default='bench.db')
+    parser.add_argument('--keep', action='store_true')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--payments', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite':
+        if not args.keep:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(args.path + suffix):
+                    os.remove(args.path + suffix)
+        storage = SQLiteStorage(args.path)
+    else:
+        dynamodb = boto3.resource('dynamodb')
+        storage = DynamoDBStorage(lambda: dynamodb)
+
+    ids = [f'bench-{i}' for i in range(args.customers)]
+    start = datetime.utcnow()
+
+    def register(i):
+        storage.claim_email(ids[i], f'{ids[i]}@example.com')
+        storage.put_customer(ids[i], f'{ids[i]}@example.com')
+
+    timed('add customer', register, len(ids))
+    timed('get customer', lambda i: storage.get_customer(ids[i % len(ids)]), args.customers)
+    timed('batch get 100 customers', lambda i: storage.get_customers(ids[:100]), max(args.customers // 100, 10))
+
+    timed('put payment (one each)', lambda i: storage.put_payment(payment_record(ids[0], i, start)), args.payments)
+    offset = args.payments
+
+    def put_with_notification(i):
+        record = payment_record(ids[2], offset + i, start)
+        storage.put_payment(record, payment_notification(record))
+
+    timed('put payment + notification', put_with_notification, args.payments)
+    batch = 100
+    offset = 2 * args.payments
+    timed(f'put payments ({batch} per batch)',
+          lambda i: storage.put_payments([payment_record(ids[1], offset + i * batch + j, start) for j in range(batch)]),
+          max(args.payments // batch, 10))
+
+    timed('add payout', lambda i: storage.add_payout(ids[i % len(ids)], f'{i}', Decimal('10.50'), 'USD'), args.payments)
+    timed('payment history', lambda i: storage.payment_history(ids[0], {}), 20)
+
+
+if __name__ == '__main__':
+    main()
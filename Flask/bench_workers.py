@@ -0,0 +1,117 @@
+#
+# Throughput of paymentApp under gunicorn for increasing worker counts on one host.
+#
+# run: python bench_workers.py [--workers 1,2,4] [--threads 4] [--clients 16] [--duration 5]
+#
+# Each run starts gunicorn with gunicorn.conf.py, waits for /v1/api/ready and then
+# drives the readiness endpoint from several client processes over keep-alive
+# connections, so the number reflects the serving stack and not DynamoDB or PayPal.
+#
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+HOST = "127.0.0.1"
+PORT = 8765
+PATH = "/v1/api/ready"
+
+
+def client_loop(duration, results):
+    conn = http.client.HTTPConnection(HOST, PORT)
+    done = 0
+    errors = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        try:
+            conn.request("GET", PATH)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status == 200:
+                done += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(HOST, PORT)
+    results.put((done, errors))
+
+
+def wait_ready(timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(HOST, PORT, timeout=1)
+            conn.request("GET", PATH)
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run(workers, threads, clients, duration):
+    env = dict(os.environ)
+    env.setdefault("PAYPAL_SANDBOX_URL", "https://api.sandbox.paypal.com")
+    env.setdefault("PAYPAL_CLIENT_ID", "bench")
+    env.setdefault("PAYPAL_SECRET", "bench")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+    env["PAYMENT_APP_BIND"] = f"{HOST}:{PORT}"
+    env["PAYMENT_APP_WORKERS"] = str(workers)
+    env["PAYMENT_APP_THREADS"] = str(threads)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--access-logfile", "/dev/null", "--error-logfile", "/dev/null",
+         "paymentApp:paymentApp"],
+        cwd=here, env=env)
+    try:
+        if not wait_ready():
+            raise RuntimeError(f"gunicorn with {workers} workers did not become ready")
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client_loop, args=(duration, results))
+                 for _ in range(clients)]
+        for p in procs:
+            p.start()
+        totals = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    done = sum(t[0] for t in totals)
+    errors = sum(t[1] for t in totals)
+    return done / duration, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=f"1,2,4,{multiprocessing.cpu_count()}")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    worker_counts = sorted({int(w) for w in args.workers.split(",")})
+    print(f"cores: {multiprocessing.cpu_count()}, threads/worker: {args.threads}, "
+          f"client processes: {args.clients}, {args.duration}s per run")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'errors':>7}")
+    base = None
+    for workers in worker_counts:
+        rps, errors = run(workers, args.threads, args.clients, args.duration)
+        base = base or rps
+        print(f"{workers:>8} {rps:>10.0f} {rps / base:>7.2f}x {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#
+# Response compression and streamed JSON bodies for the Flask app.
+#
+#   RESPONSE_COMPRESSION=0                 turn compression off (on by default)
+#   RESPONSE_COMPRESSION_MIN_BYTES=1024    smaller bodies are sent as they are
+#
+# The encoding is negotiated from Accept-Encoding by response_encoding.py at the repo
+# root, which also holds the row at a time JSON encoder and the streaming compressor
+# shared with the lambda. Compressed responses carry Content-Encoding and
+# Vary: Accept-Encoding, and a strong ETag becomes weak, since the bytes differ from the
+# uncompressed representation.
+#
+# install_compression() registers an after_request hook that compresses ordinary
+# responses (jsonify). List endpoints use stream_json() instead: the JSON is produced a
+# row at a time, passed through the compressor as it goes and sent with chunked transfer
+# encoding, so neither the whole JSON text nor the whole compressed body is ever held in
+# memory. The rows themselves are read from storage before the response starts, so a
+# storage error still gets a proper 500. See bench_compression.py for the numbers.
+#
+
+import json
+import os
+import sys
+from flask import Response, current_app, request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from response_encoding import accepted_encoding, batched, compressed, json_chunks, read_head
+
+
+def jsonify_encoder():
+    # the encoder of jsonify: sorted keys, compact
+    return json.JSONEncoder(default=current_app.json.default, sort_keys=True, separators=(',', ':'))
+
+
+def stream_json(obj, status=200, min_bytes=None):
+    """
+    a streamed JSON response of obj, compressed when the client accepts it and the body
+    reaches min_bytes. Only the first min_bytes are buffered to make that decision.
+    """
+    config = current_app.config
+    min_bytes = config.get('RESPONSE_COMPRESSION_MIN_BYTES', 1024) if min_bytes is None else min_bytes
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding')) \
+        if config.get('RESPONSE_COMPRESSION') else None
+    chunks = (chunk.encode() for chunk in json_chunks(obj, jsonify_encoder()))
+
+    head, done = read_head(chunks, min_bytes)
+    if done:
+        # small enough to send in one piece
+        return Response(b''.join(head), status=status, mimetype='application/json')
+
+    if encoding is None:
+        response = Response(batched(head, chunks), status=status, mimetype='application/json')
+    else:
+        response = Response(compressed(head, chunks, encoding), status=status,
+                            mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def install_compression(app, environ=os.environ):
+    app.config['RESPONSE_COMPRESSION'] = environ.get('RESPONSE_COMPRESSION', '1') != '0'
+    app.config['RESPONSE_COMPRESSION_MIN_BYTES'] = int(environ.get('RESPONSE_COMPRESSION_MIN_BYTES', 1024))
+    if not app.config['RESPONSE_COMPRESSION']:
+        return False
+
+    @app.after_request
+    def compress_response(response):
+        # streamed responses compress themselves (stream_json), 304s and error pages are left alone
+        if response.status_code != 200 or response.is_streamed or response.direct_passthrough or \
+                'Content-Encoding' in response.headers:
+            return response
+        data = response.get_data()
+        if len(data) < app.config['RESPONSE_COMPRESSION_MIN_BYTES']:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        response.set_data(b''.join(compressed([data], (), encoding)))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return True
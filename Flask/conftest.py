@@ -0,0 +1,10 @@
+#
+# The modules shared with the lambda (validation.py, response_encoding.py and money.py
+# at the repo root) are imported by the tests before paymentApp has put the repo root on
+# sys.path.
+#
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,57 @@
+#
+# Production serving config for paymentApp.
+#
+# run: gunicorn -c gunicorn.conf.py paymentApp:paymentApp
+#
+# Graceful reload:
+#   kill -HUP <master pid>   re-reads this config and replaces the workers one by one.
+#                            Because the app is preloaded, HUP does not pick up new
+#                            application code.
+#   kill -USR2 <master pid>  starts a new master with the new code next to the old one,
+#                            then kill -WINCH and -QUIT the old master once the new
+#                            workers pass /v1/api/ready.
+#
+
+import multiprocessing
+import os
+
+bind = os.getenv("PAYMENT_APP_BIND", "0.0.0.0:8000")
+
+# Requests mostly wait on DynamoDB and PayPal, so each worker process runs a few
+# threads and the process count follows the core count.
+workers = int(os.getenv("PAYMENT_APP_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("PAYMENT_APP_THREADS", 4))
+
+# Import the app once in the master so workers fork with the code already loaded.
+# No clients are created at import time, see post_fork below.
+preload_app = True
+
+# PayPal sandbox sometimes takes longer than a few seconds, same as the lambda timeout
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+# recycle workers now and then to cap slow leaks, staggered so they don't restart together
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # per-worker DynamoDB and PayPal client pools, created after the fork
+    from paymentApp import init_worker_clients, open_journal
+    init_worker_clients()
+    server.log.info(f"worker {worker.pid}: client pool initialised")
+    # claim a disbursement journal slot and start draining it, replaying whatever a
+    # crashed worker left there without waiting for a payment, see journal.py
+    if open_journal() is not None:
+        server.log.info(f"worker {worker.pid}: disbursement journal opened")
+
+
+def worker_exit(server, worker):
+    # let the disbursement journal drain what it can, see journal.py
+    from paymentApp import close_journal
+    close_journal()
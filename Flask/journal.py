@@ -0,0 +1,362 @@
+#
+# Local write-ahead journal of Disbursements writes for the Flask app.
+#
+# Once PayPal has authorized a payment its record must not be lost, but a DynamoDB
+# outage used to turn it into a 500 after the money moved. With
+# DISBURSEMENT_JOURNAL_DIR set, process_payment appends the record here instead and
+# answers as soon as it is on disk. A background thread of the worker drains the
+# journal into storage with batched writes (BatchWriteItem on DynamoDB), retrying with
+# backoff for as long as the backend is down.
+#
+# A batch that still fails after DISBURSEMENT_JOURNAL_MAX_ATTEMPTS tries is written one
+# record at a time, so a single bad record cannot hold up the journal. Records that
+# fail while others go through are moved to the slot's dead-letter file
+# (dead-letter.ndjson, one {"record", "error"} per line) for inspection and redrive,
+# like the dead letter queue of the lambda's SQS journal. When no record goes through,
+# the backend is down: nothing is dead-lettered and the batch is retried as before.
+#
+#   DISBURSEMENT_JOURNAL_DIR            journal root, unset turns the journal off
+#   DISBURSEMENT_JOURNAL_SEGMENT_MB     size of one segment file, default 16
+#   DISBURSEMENT_JOURNAL_MAX_ATTEMPTS   tries of a batch before its records are tried
+#                                       one by one, default 8
+#
+# Layout: every worker process claims its own slot directory (slot-0, slot-1, ...)
+# with flock, so gunicorn workers never share a file and a slot left behind by a dead
+# worker is picked up, and replayed, by the next one that starts. A slot holds
+# preallocated segment files written through mmap, records framed as
+# <length, crc32, JSON>, and a checkpoint file with the position drained so far.
+# A torn record at the end of a segment fails its crc and ends the segment. close()
+# stops a flusher that is still retrying once its drain timeout is over, and a flusher
+# stuck in a storage call keeps the slot locked until the process exits, so two
+# processes never drain the same slot.
+#
+# Appends are group committed: a writer copies its record into the map and then
+# waits for an msync covering it. Whoever gets to msync first syncs every record
+# appended so far, so concurrent requests share one disk flush instead of paying one
+# each. Replay may write a record twice (crash between the batch write and the
+# checkpoint), which is harmless because puts of the same key are idempotent.
+#
+
+import fcntl
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+import zlib
+
+RECORD_HEADER = struct.Struct('<II')
+
+# records drained per storage call, DynamoDB batch_writer splits them into BatchWriteItem calls of 25
+FLUSH_BATCH = 500
+FLUSH_IDLE_WAIT = 0.05
+FLUSH_BACKOFF_CAP = 5.0
+FLUSH_MAX_ATTEMPTS = 8
+# failures in a row, with nothing written, that end a one-by-one pass as an outage
+ISOLATE_OUTAGE_FAILURES = 3
+MAX_SLOTS = 1024
+CLOSE_DRAIN_TIMEOUT = 5.0
+# how long close() waits for the flusher to stop once told to, see close()
+CLOSE_STOP_TIMEOUT = 1.0
+DEAD_LETTER_FILE = 'dead-letter.ndjson'
+
+
+class JournalError(Exception):
+    pass
+
+
+def segment_name(seq):
+    return f'{seq:016d}.seg'
+
+
+def read_records(path, offset, end=None):
+    """
+    yield (record, offset after it) for the valid records of a segment from offset,
+    stopping at the first empty or torn one, or at end.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read() if end is None else f.read(end - offset)
+    pos = 0
+    while pos + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        if length == 0 or start + length > len(data):
+            return
+        payload = data[start:start + length]
+        if zlib.crc32(payload) != crc:
+            return
+        pos = start + length
+        yield json.loads(payload), offset + pos
+
+
+class Journal:
+
+    def __init__(self, root, segment_size=16 * 1024 * 1024, max_attempts=FLUSH_MAX_ATTEMPTS):
+        self.segment_size = segment_size
+        self.max_attempts = max_attempts
+        self.path, self.lock_file = self._claim_slot(root)
+
+        # drained position (segment, offset) from the last run, if any
+        self.checkpoint = self._read_checkpoint()
+
+        # appends always go to a fresh segment, older ones are only read back by the flusher
+        existing = self._segments()
+        self.seq = (existing[-1] + 1) if existing else 0
+        if not existing or self.checkpoint[0] > existing[-1]:
+            self.checkpoint = (self.seq, 0)
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.appended = threading.Condition(self.lock)
+        self.unsynced_maps = []
+        self.map = self._open_segment(self.seq)
+        self.offset = 0
+        self.synced = (self.seq, 0)
+
+        self.flushed = 0
+        self.dead_lettered = 0
+        self.closed = False
+        # set by close() once the drain timeout is over, ends the flusher even mid-retry
+        self.stopping = threading.Event()
+        self.flusher = None
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        root = environ.get('DISBURSEMENT_JOURNAL_DIR', '')
+        if not root:
+            return None
+        return cls(root, int(float(environ.get('DISBURSEMENT_JOURNAL_SEGMENT_MB', 16)) * 1024 * 1024),
+                   int(environ.get('DISBURSEMENT_JOURNAL_MAX_ATTEMPTS', FLUSH_MAX_ATTEMPTS)))
+
+    def _claim_slot(self, root):
+        for slot in range(MAX_SLOTS):
+            path = os.path.join(root, f'slot-{slot}')
+            os.makedirs(path, exist_ok=True)
+            lock_file = open(os.path.join(path, 'lock'), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            return path, lock_file
+        raise JournalError(f"no free journal slot under {root}")
+
+    def _segments(self):
+        return sorted(int(name[:-len('.seg')]) for name in os.listdir(self.path) if name.endswith('.seg'))
+
+    def _open_segment(self, seq):
+        path = os.path.join(self.path, segment_name(seq))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            os.ftruncate(fd, self.segment_size)
+            os.fsync(fd)
+            segment = mmap.mmap(fd, self.segment_size)
+        finally:
+            os.close(fd)
+        # make the new file itself survive a crash
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return segment
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, 'checkpoint')) as f:
+                seq, offset = f.read().split()
+            return int(seq), int(offset)
+        except (OSError, ValueError):
+            return (0, 0)
+
+    def _write_checkpoint(self, position):
+        # not fsynced: a lost checkpoint only means some records are written again
+        tmp = os.path.join(self.path, 'checkpoint.tmp')
+        with open(tmp, 'w') as f:
+            f.write(f'{position[0]} {position[1]}')
+        os.replace(tmp, os.path.join(self.path, 'checkpoint'))
+
+    def append(self, record):
+        """
+        add record to the journal and return once it is on disk.
+        """
+        payload = json.dumps(record, default=str, separators=(',', ':')).encode()
+        size = RECORD_HEADER.size + len(payload)
+        if size > self.segment_size:
+            raise JournalError(f"record of {size} bytes does not fit a segment")
+
+        with self.lock:
+            if self.closed:
+                raise JournalError("journal is closed")
+            if self.offset + size > self.segment_size:
+                # the old map stays open until a sync has flushed it
+                self.unsynced_maps.append(self.map)
+                self.seq += 1
+                self.map = self._open_segment(self.seq)
+                self.offset = 0
+            RECORD_HEADER.pack_into(self.map, self.offset, len(payload), zlib.crc32(payload))
+            self.map[self.offset + RECORD_HEADER.size:self.offset + size] = payload
+            self.offset += size
+            position = (self.seq, self.offset)
+
+        self._sync(position)
+
+    def _sync(self, position):
+        # group commit, see the header
+        with self.sync_lock:
+            if self.synced >= position:
+                return
+            with self.lock:
+                target = (self.seq, self.offset)
+                current = self.map
+                rotated = self.unsynced_maps
+                self.unsynced_maps = []
+            for segment in rotated:
+                segment.flush()
+                segment.close()
+            # msync only the pages written since the last sync, not the whole segment
+            start = self.synced[1] if self.synced[0] == target[0] else 0
+            start -= start % mmap.PAGESIZE
+            current.flush(start, target[1] - start)
+            with self.lock:
+                self.synced = target
+                self.appended.notify()
+
+    def start_flusher(self, write_batch):
+        """
+        drain the journal in a daemon thread with write_batch(records), which raises when
+        the records could not be stored. Records left over from a previous run go first.
+        """
+        self.flusher = threading.Thread(target=self._flush_loop, args=(write_batch,),
+                                        name='disbursement-journal', daemon=True)
+        self.flusher.start()
+
+    def _pending(self):
+        # (records, position after them) not drained yet, at most FLUSH_BATCH. Only what
+        # is synced: the flusher never gets ahead of the disk. Segments of earlier runs
+        # are synced as a whole.
+        with self.lock:
+            synced = self.synced
+        records = []
+        seq, offset = self.checkpoint
+        while seq <= synced[0]:
+            end = synced[1] if seq == synced[0] else None
+            path = os.path.join(self.path, segment_name(seq))
+            if os.path.exists(path) and (end is None or end > offset):
+                for record, offset in read_records(path, offset, end):
+                    records.append(record)
+                    if len(records) >= FLUSH_BATCH:
+                        return records, (seq, offset)
+            if seq == synced[0]:
+                break
+            seq, offset = seq + 1, 0
+        return records, (seq, offset)
+
+    def _flush_loop(self, write_batch):
+        failures = 0
+        while not self.stopping.is_set():
+            records, position = self._pending()
+            if records:
+                # duplicate keys are not allowed in one BatchWriteItem
+                batch = list({(r.get('customer_id'), r.get('payment_id')): r for r in records}.values())
+                try:
+                    write_batch(batch)
+                except Exception as e:
+                    failures += 1
+                    if failures % self.max_attempts or not self._isolate(batch, write_batch):
+                        delay = random.uniform(0, min(FLUSH_BACKOFF_CAP, 0.1 * 2 ** failures))
+                        print(f"disbursement journal: {len(batch)} records not written ({e}), "
+                              f"retrying in {delay:.2f}s")
+                        if self.stopping.wait(delay):
+                            return
+                        continue
+                failures = 0
+                self.flushed += len(records)
+            if position != self.checkpoint:
+                self._advance(position)
+            if records:
+                continue
+            with self.lock:
+                if self.closed:
+                    return
+                self.appended.wait(FLUSH_IDLE_WAIT)
+
+    def _isolate(self, batch, write_batch):
+        # True once every record of batch is written or dead-lettered, False when the
+        # backend looks down (see the header)
+        written = 0
+        failed = []
+        for record in batch:
+            try:
+                write_batch([record])
+                written += 1
+            except Exception as e:
+                failed.append((record, e))
+                if not written and len(failed) >= ISOLATE_OUTAGE_FAILURES:
+                    return False
+        if not written:
+            return False
+        if failed:
+            self._dead_letter(failed)
+        return True
+
+    def _dead_letter(self, failed):
+        with open(os.path.join(self.path, DEAD_LETTER_FILE), 'a') as f:
+            for record, error in failed:
+                print(f"disbursement journal: dead-lettered payment {record.get('payment_id')} "
+                      f"of {record.get('customer_id')} ({error})")
+                f.write(json.dumps({'record': record, 'error': str(error)}, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_lettered += len(failed)
+
+    def _advance(self, position):
+        self.checkpoint = position
+        self._write_checkpoint(position)
+        with self.lock:
+            active = self.seq
+        for seq in self._segments():
+            if seq < position[0] and seq < active:
+                os.remove(os.path.join(self.path, segment_name(seq)))
+
+    def backlog(self):
+        """
+        number of records appended but not yet written to storage.
+        """
+        records = 0
+        seq, offset = self.checkpoint
+        for segment in self._segments():
+            if segment < seq:
+                continue
+            path = os.path.join(self.path, segment_name(segment))
+            records += sum(1 for _ in read_records(path, offset if segment == seq else 0))
+        return records
+
+    def close(self, timeout=CLOSE_DRAIN_TIMEOUT):
+        """
+        stop taking records, give the flusher up to timeout seconds to drain and release
+        the slot. Whatever is left is replayed by the next process claiming the slot.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.appended.notify()
+        if self.flusher is not None:
+            self.flusher.join(timeout)
+            # still retrying an outage: stop it, it checks between tries
+            self.stopping.set()
+            self.flusher.join(CLOSE_STOP_TIMEOUT)
+        with self.sync_lock, self.lock:
+            for segment in self.unsynced_maps + [self.map]:
+                segment.flush()
+                segment.close()
+            self.unsynced_maps = []
+        if self.flusher is not None and self.flusher.is_alive():
+            # stuck in a storage call: releasing the slot now would let another process
+            # drain and checkpoint it alongside this thread. The lock goes with the process.
+            print(f"disbursement journal: flusher still running, {self.path} stays locked")
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
@@ -0,0 +1,208 @@
+#
+# Payment notifications through a transactional outbox.
+#
+# With PAYMENT_NOTIFICATIONS=1 paymentApp stores a notification for every payment
+# atomically with its Disbursements record (see Storage.put_payments): one DynamoDB
+# transaction or SQLite transaction, both or neither, and only when the record is new.
+# Payees are notified of exactly the payments that were recorded, a journal replay of
+# a stored payment adds no second notification, and the request never waits on SNS or
+# a webhook. This script is the dispatcher: a separate process that drains the outbox
+# in batches, sends them to the sink and retries failures with exponential backoff.
+# Notifications still failing after MAX_ATTEMPTS are parked.
+#
+# run: python outbox.py [--once] [--interval 1]
+#
+#   NOTIFICATION_SINK=local     NOTIFICATION_LOCAL_PATH (default notifications.ndjson), one
+#                               JSON line per notification, for development and tests
+#   NOTIFICATION_SINK=sns       NOTIFICATION_TOPIC_ARN, SNS PublishBatch, 10 per call
+#   NOTIFICATION_SINK=webhook   NOTIFICATION_WEBHOOK_URL, POST of up to 100 per call
+#
+# Storage is picked with STORAGE_BACKEND like the app. Delivery is at least once: a
+# dispatcher that dies between sending and completing a batch sends it again. Every
+# notification therefore carries a stable id built from the payment's key, sent as the
+# SNS message deduplication id (FIFO topics) and the webhook Idempotency-Key, so
+# receivers can drop duplicates.
+# Run one dispatcher per outbox.
+#
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+
+import boto3
+import requests
+
+from storage import DISBURSEMENT_SHARD_SEPARATOR, StorageError, storage_from_env
+
+OUTBOX_FETCH = 100
+MAX_ATTEMPTS = 8
+RETRY_BASE = 2.0
+RETRY_CAP = 600.0
+
+
+def payment_notification(payment_record):
+    """
+    outbox notification of a stored payment record.
+    """
+    # the record may be written to a shard of a hot payee, 'customer_id#<n>'
+    customer_id = payment_record['customer_id'].partition(DISBURSEMENT_SHARD_SEPARATOR)[0]
+    amount = payment_record['amount']
+    currency = payment_record['currency']
+    return {
+        'notification_id': f"{payment_record['customer_id']}|{payment_record['payment_id']}",
+        'customer_id': customer_id,
+        'email': payment_record['email'],
+        'payment_id': payment_record['payment_id'],
+        'amount': str(amount),
+        'currency': currency,
+        'subject': 'Payment processed',
+        'message': f"Payment of {amount} {currency} has been processed via "
+                   f"{payment_record['payment_method']} for payee {customer_id}.",
+        'next_attempt_at': 0
+    }
+
+
+def message_body(notification):
+    # what receivers get, the outbox bookkeeping stays out
+    return {k: v for k, v in notification.items() if k not in ('attempts', 'next_attempt_at')}
+
+
+def dedupe_id(notification):
+    # SNS ids allow [A-Za-z0-9_-] up to 80 characters
+    return hashlib.sha256(notification['notification_id'].encode()).hexdigest()[:64]
+
+
+class LocalSink:
+    batch_size = 100
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, notifications):
+        with open(self.path, 'a') as f:
+            for notification in notifications:
+                f.write(json.dumps(message_body(notification), separators=(',', ':')) + '\n')
+        return set()
+
+
+class SnsSink:
+    batch_size = 10
+
+    def __init__(self, topic_arn, client=None):
+        self.topic_arn = topic_arn
+        self.fifo = topic_arn.endswith('.fifo')
+        self.client = client or boto3.client('sns')
+
+    def send(self, notifications):
+        entries = []
+        by_id = {}
+        for notification in notifications:
+            entry_id = dedupe_id(notification)
+            by_id[entry_id] = notification['notification_id']
+            entry = {'Id': entry_id, 'Subject': notification['subject'],
+                     'Message': json.dumps(message_body(notification))}
+            if self.fifo:
+                entry['MessageDeduplicationId'] = entry_id
+                entry['MessageGroupId'] = notification['customer_id']
+            entries.append(entry)
+        resp = self.client.publish_batch(TopicArn=self.topic_arn, PublishBatchRequestEntries=entries)
+        return {by_id[failed['Id']] for failed in resp.get('Failed', [])}
+
+
+class WebhookSink:
+    batch_size = 100
+
+    def __init__(self, url, session=None):
+        self.url = url
+        self.session = session or requests.Session()
+
+    def send(self, notifications):
+        ids = sorted(n['notification_id'] for n in notifications)
+        resp = self.session.post(
+            self.url, json={'notifications': [message_body(n) for n in notifications]},
+            headers={'Idempotency-Key': hashlib.sha256('\n'.join(ids).encode()).hexdigest()}, timeout=10)
+        if resp.status_code // 100 != 2:
+            return set(ids)
+        return set()
+
+
+def sink_from_env(environ=os.environ):
+    sink = environ.get('NOTIFICATION_SINK', 'local')
+    if sink == 'local':
+        return LocalSink(environ.get('NOTIFICATION_LOCAL_PATH', 'notifications.ndjson'))
+    if sink == 'sns':
+        return SnsSink(environ['NOTIFICATION_TOPIC_ARN'])
+    if sink == 'webhook':
+        return WebhookSink(environ['NOTIFICATION_WEBHOOK_URL'])
+    raise ValueError(f"NOTIFICATION_SINK must be local, sns or webhook, not {sink}")
+
+
+def retry_delay(attempts):
+    # full jitter, attempts counts the failures so far
+    return random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempts))
+
+
+def dispatch_once(storage, sink, now=None):
+    """
+    send every due notification once. Returns (sent, failed).
+    """
+    now = time.time() if now is None else now
+    pending = storage.pending_notifications(OUTBOX_FETCH, now)
+    # ids are unique in the outbox, but a batch must not name one twice either
+    pending = list({n['notification_id']: n for n in pending}.values())
+
+    sent = []
+    failed = []
+    for i in range(0, len(pending), sink.batch_size):
+        batch = pending[i:i + sink.batch_size]
+        try:
+            failed_ids = sink.send(batch)
+        except Exception as e:
+            print(f"notification batch of {len(batch)} failed: {e}")
+            failed_ids = {n['notification_id'] for n in batch}
+        for notification in batch:
+            (failed if notification['notification_id'] in failed_ids else sent).append(notification)
+
+    if sent:
+        storage.complete_notifications([n['notification_id'] for n in sent])
+    for notification in failed:
+        attempts = notification.get('attempts', 0) + 1
+        if attempts >= MAX_ATTEMPTS:
+            print(f"notification {notification['notification_id']} parked after {attempts} attempts")
+            storage.reschedule_notification(notification['notification_id'], attempts, None)
+        else:
+            storage.reschedule_notification(notification['notification_id'], attempts, now + retry_delay(attempts))
+    return len(sent), len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='payment notification dispatcher')
+    parser.add_argument('--once', action='store_true', help='drain what is due and exit')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls of an empty outbox')
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb')
+    storage = storage_from_env(lambda: dynamodb)
+    sink = sink_from_env()
+
+    while True:
+        try:
+            sent, failed = dispatch_once(storage, sink)
+        except StorageError as e:
+            # the outbox keeps everything, try again later
+            print(f"notification outbox unavailable: {e}")
+            sent, failed = 0, 0
+        if sent or failed:
+            print(f"notifications: {sent} sent, {failed} failed")
+        if args.once and sent + failed < OUTBOX_FETCH:
+            return
+        # a full fetch means more is due, poll again right away
+        if sent + failed < OUTBOX_FETCH:
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
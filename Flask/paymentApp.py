@@ -1,10 +1,29 @@
 import boto3
-from botocore.exceptions import ClientError
-from datetime import datetime
+from datetime import datetime, timezone
+from decimal import Decimal
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
+import hashlib
+import json
+import math
 import os
+import random
 import requests
+import sys
+import threading
+import time
+# validation.py, response_encoding.py, money.py and the schemas are shared with the
+# lambda and live at the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rate_limit import RateLimiter
+from journal import Journal, JournalError
+from outbox import payment_notification
+from providers import PayPalProvider, ProviderError, Router, currencies_from_env
+from storage import EMAIL_MARKER_PREFIX, DISBURSEMENT_SHARD_SEPARATOR, StorageError, storage_from_env
+from validation import load_validators
+from compression import install_compression, stream_json
+from money import minor_units_decimal, minor_units_str, to_minor_units
+from profiling import install_profiling
 
 # pip install python-dotenv
 # Load environment variables from .env file
@@ -17,30 +36,247 @@ PAYPAL_CLIENT_ID   = os.getenv("PAYPAL_CLIENT_ID")
 PAYPAL_SECRET      = os.getenv("PAYPAL_SECRET")
 PAYPAL_SANDBOX_URL = os.getenv("PAYPAL_SANDBOX_URL")
 
+# Request bodies are checked against the API Gateway models (schemas/*.json), compiled
+# once here. There is no API Gateway in front of this app to do it (see validation.py).
+request_validators = load_validators()
+validate_customer_request = request_validators['customer_request']
+validate_payments_request = request_validators['payments_request']
+validate_customers_batch_get = request_validators['customers_batch_get']
+
+
+def invalid_request(errors):
+    # same message as API Gateway's request validator, plus every field error
+    return jsonify({"error": "Invalid request body", "errors": errors}), 400
+
+# Hot payees (Customers.disbursement_shards > 1) spread their Disbursements writes over
+# customer_id, customer_id#1, ... customer_id#N-1, same as the lambda.
+# GET /v1/api/payment/<customer_id> reads all shards back.
+
+
+def disbursement_partition_key(customer_id, customer_item):
+    shards = int((customer_item or {}).get('disbursement_shards', 1))
+    shard = random.randrange(shards) if shards > 1 else 0
+    if shard == 0:
+        return customer_id
+    return f"{customer_id}{DISBURSEMENT_SHARD_SEPARATOR}{shard}"
+
+
+# time-bucket-index partition key of a new payment, '<hour or day>#<shard>' like the
+# lambda writes it. The lambda's GET /v1/api/payments?from=&to= queries the index.
+TIME_BUCKET_LENGTHS = {'hour': len('2024-01-01T00'), 'day': len('2024-01-01')}
+DISBURSEMENT_TIME_BUCKET = os.getenv("DISBURSEMENT_TIME_BUCKET", "hour")
+DISBURSEMENT_TIME_BUCKET_SHARDS = max(int(os.getenv("DISBURSEMENT_TIME_BUCKET_SHARDS", 1)), 1)
+
+
+def payment_time_bucket(payment_id):
+    bucket = payment_id[:TIME_BUCKET_LENGTHS[DISBURSEMENT_TIME_BUCKET]]
+    return f"{bucket}#{random.randrange(DISBURSEMENT_TIME_BUCKET_SHARDS)}"
+
+
+# customer reads carry an ETag built from the record's version (add_customer bumps it,
+# a hash of the record for older ones), answer If-None-Match with 304 and may be reused
+# by clients and shared caches for CUSTOMER_MAX_AGE seconds before they revalidate
+CUSTOMER_MAX_AGE = int(os.getenv("CUSTOMER_MAX_AGE", 60))
+
+
+def customer_etag(customer):
+    if 'version' in customer:
+        return f"v{int(customer['version'])}"
+    return hashlib.sha256(json.dumps(customer, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+# Per-worker cache of Customers items, CUSTOMER_CACHE_TTL seconds (0, the default, turns
+# it off). add_customer evicts what it writes, other workers keep their copy until it expires.
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", 0))
+CUSTOMER_CACHE_MAX_ITEMS = 10000
+_customer_cache = {}
+
+
+def cached_customer(customer_id):
+    entry = _customer_cache.get(customer_id)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    return entry[1]
+
+
+def cache_customer(item):
+    if CUSTOMER_CACHE_TTL <= 0:
+        return
+    if len(_customer_cache) >= CUSTOMER_CACHE_MAX_ITEMS:
+        _customer_cache.pop(next(iter(_customer_cache)), None)
+    _customer_cache[item['customer_id']] = (time.monotonic() + CUSTOMER_CACHE_TTL, item)
+
+
+# Per-worker client pool. gunicorn preloads this module in the master process
+# and forks the workers (see gunicorn.conf.py), so no boto3 or HTTP client may be
+# created at import time. The post_fork hook calls init_worker_clients() and each
+# worker thread then lazily builds its own DynamoDB resource and PayPal session,
+# which keeps sockets from being shared across processes (boto3 resources are not
+# thread safe either). Under the dev server and in tests the pool is not set up and
+# every call gets a fresh resource, same as before.
+_worker_clients = None
+
+
+def init_worker_clients():
+    global _worker_clients
+    _worker_clients = threading.local()
+
+
+def get_dynamodb():
+    if _worker_clients is None:
+        return boto3.resource('dynamodb')
+    if not hasattr(_worker_clients, 'dynamodb'):
+        _worker_clients.dynamodb = boto3.session.Session().resource('dynamodb')
+    return _worker_clients.dynamodb
+
+
+# STORAGE_BACKEND=dynamodb (default) or sqlite, see storage.py
+storage = storage_from_env(get_dynamodb)
+
+
+# PAYMENT_NOTIFICATIONS=1 stores a payee notification with every payment record, sent
+# later by the outbox dispatcher (python outbox.py), so requests never wait on it
+PAYMENT_NOTIFICATIONS = os.getenv('PAYMENT_NOTIFICATIONS', '') == '1'
+
+
+# the journal flusher's write: the records, then the payout summaries they add to, so a
+# journaled payment makes no storage call on the request path at all. A summary that
+# fails, or is added twice when a batch is replayed, is fixed by rebuild_payout_summaries.py
+def store_payments(payment_records):
+    notifications = [payment_notification(r) for r in payment_records] if PAYMENT_NOTIFICATIONS else []
+    storage.put_payments(payment_records, notifications)
+    for record in payment_records:
+        record_payout_summary(record['customer_id'].split(DISBURSEMENT_SHARD_SEPARATOR, 1)[0],
+                              record['payment_id'], Decimal(record['amount']), record['currency'])
+
+
+# Write-ahead journal of payment records (see journal.py), off unless
+# DISBURSEMENT_JOURNAL_DIR is set. Its slot lock and flusher thread must not be created
+# in the gunicorn master: the post_fork hook opens it in each worker (open_journal), so
+# a worker restarted after a crash replays the records left in its slot right away.
+# Under the dev server and in tests it is opened on the first payment.
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    global _journal
+    if not os.getenv('DISBURSEMENT_JOURNAL_DIR'):
+        return None
+    with _journal_lock:
+        if _journal is None or _journal[0] != os.getpid():
+            journal = Journal.from_env()
+            journal.start_flusher(store_payments)
+            _journal = (os.getpid(), journal)
+        return _journal[1]
+
+
+def open_journal():
+    # post_fork hook. A journal that cannot be opened now is tried again by the first payment.
+    try:
+        return get_journal()
+    except (JournalError, OSError) as e:
+        print(f"Failed to open the disbursement journal: {e}")
+        return None
+
+
+def close_journal():
+    # worker_exit hook, records not drained by now are replayed by the next worker
+    if _journal is not None and _journal[0] == os.getpid():
+        _journal[1].close()
+
+
+def journal_payment(payment_record):
+    # True once the record is on disk in the journal, False when it has to be written directly
+    try:
+        journal = get_journal()
+        if journal is None:
+            return False
+        journal.append(payment_record)
+        return True
+    except (JournalError, OSError) as e:
+        print(f"Failed to journal payment {payment_record['payment_id']}: {e}")
+        return False
+
+
+def get_http():
+    # requests.Session keeps the TLS connection to PayPal alive between payments
+    if _worker_clients is None:
+        return requests
+    if not hasattr(_worker_clients, 'http'):
+        _worker_clients.http = requests.Session()
+    return _worker_clients.http
+
+
+# GET method for load balancer / orchestrator readiness checks
+@paymentApp.route('/v1/api/ready', methods=['GET'])
+def ready():
+
+    if not PAYPAL_SANDBOX_URL or not PAYPAL_CLIENT_ID or not PAYPAL_SECRET:
+        return jsonify({"status": "not ready", "error": "PayPal configuration missing"}), 503
+
+    # DynamoDB only builds the resource (no network call, but fails fast when the region or
+    # credentials configuration is broken), SQLite runs a trivial query on the database file
+    # the probe is unauthenticated: the details (table names, AWS errors) go to the log only
+    try:
+        storage.check()
+    except Exception as e:
+        print(f"Readiness check failed: storage unavailable: {e}")
+        return jsonify({"status": "not ready", "error": "storage unavailable"}), 503
+
+    return jsonify({"status": "ready", "pid": os.getpid(), "providers": payment_router.snapshot()}), 200
+
+
 # POST method to add a customer
 @paymentApp.route('/v1/api/customer/add', methods=['POST'])
 def add_customer():
 
-    data = request.get_json()
+    data = request.get_json(silent=True)
 
     # sanitise params
-    if not data or 'customer_id' not in data or 'email' not in data:
-        return jsonify({"error": "Missing required fields: customer_id or email"}), 400
+    errors = validate_customer_request(data)
+    if errors:
+        return invalid_request(errors)
 
-    # Store customer record in DynamoDB
-    cust_record = {
-        'customer_id': data['customer_id'],
-        'email': data['email']
-    }
+    try:
+        # conditional write on the email marker, no scan needed
+        if not storage.claim_email(data['customer_id'], data['email']):
+            return jsonify({"error": f"{data['email']} is already registered to another customer"}), 409
+
+        old_record = storage.put_customer(data['customer_id'], data['email'])
+        _customer_cache.pop(data['customer_id'], None)
+
+    except StorageError as e:
+        return jsonify({"error": f"Error occurred: {e}"}), 500
+
+    # customer changed email, free the old one
+    old_email = old_record.get('email')
+    if old_email and old_email != data['email']:
+        try:
+            storage.release_email(data['customer_id'], old_email)
+        except StorageError as e:
+            print(f"Failed to release email {old_email}: {e}")
+
+    return jsonify({"status": data['customer_id'] + " added successfully"}), 200
+
+
+# GET method to look up customers by email through the email GSI
+@paymentApp.route('/v1/api/customer', methods=['GET'])
+def get_customer_by_email():
+
+    email = request.args.get('email', '').strip()
+    if not email:
+        return jsonify({"error": "Missing required query parameter: email"}), 400
 
     try:
-        dynamodb = boto3.resource('dynamodb')
-        cust_table = dynamodb.Table('Customers')
-        resp = cust_table.put_item(Item=cust_record)
-        return jsonify({"status": data['customer_id'] + " added successfully"}), resp['ResponseMetadata']['HTTPStatusCode']
+        items = storage.customers_by_email(email)
+    except StorageError as e:
+        return jsonify({"error": f"Error occurred: {e}"}), 500
 
-    except ClientError as e:
-        return jsonify({"error": f"Error occurred: {e.response['Error']['Message']}"}), 500
+    if not items:
+        return jsonify({"error": "Customer not found"}), 404
+    customers = [{'customer_id': item['customer_id'], 'email': item['email']} for item in items]
+    return jsonify({"email": email, "customers": customers}), 200
 
 
 # GET method retrieve customer info based on customer_id
@@ -50,21 +286,114 @@ def get_customer(customer_id):
     if customer_id is None:
         return jsonify({"error": "Invalid customer_id"}), 400
 
-    dynamodb = boto3.resource('dynamodb')
+    if customer_id.startswith(EMAIL_MARKER_PREFIX):
+        return jsonify({"error": "Customer not found"}), 404
 
-    try:
-        cust_table = dynamodb.Table('Customers')
-        resp = cust_table.get_item(Key={'customer_id': customer_id})
+    customer = cached_customer(customer_id)
+    if customer is None:
+        try:
+            customer = storage.get_customer(customer_id)
+        except StorageError as e:
+            return jsonify({"error": f"Error occurred: {e}"}), 500
 
-        # Check if the item exists in the response
-        if 'Item' in resp:
-            customer = resp['Item']
-            return jsonify(customer), 200
+        if customer is None:
+            return jsonify({"error": "Customer not found"}), 404
+        cache_customer(customer)
+
+    # make_conditional turns the response into a 304 when If-None-Match matches
+    response = jsonify(customer)
+    response.set_etag(customer_etag(customer))
+    response.headers['Cache-Control'] = f'max-age={CUSTOMER_MAX_AGE}, must-revalidate'
+    return response.make_conditional(request)
+
+
+# POST method to retrieve many customers at once, body {"customer_ids": [...]}
+@paymentApp.route('/v1/api/customers:batchGet', methods=['POST'])
+def batch_get_customers():
+
+    data = request.get_json(silent=True)
+    # 1 to 1000 ids, each a valid customer_id
+    errors = validate_customers_batch_get(data)
+    if errors:
+        return invalid_request(errors)
+
+    # dedupe, keeping the order of first appearance
+    customer_ids = list(dict.fromkeys(data['customer_ids']))
+
+    found = {}
+    to_fetch = []
+    for customer_id in customer_ids:
+        if not customer_id or customer_id.startswith(EMAIL_MARKER_PREFIX):
+            continue
+        item = cached_customer(customer_id)
+        if item is not None:
+            found[customer_id] = item
         else:
+            to_fetch.append(customer_id)
+
+    try:
+        fetched, unprocessed = storage.get_customers(to_fetch)
+    except StorageError as e:
+        return jsonify({"error": f"Error occurred: {e}"}), 500
+
+    for item in fetched.values():
+        cache_customer(item)
+    found.update(fetched)
+    unprocessed = set(unprocessed)
+
+    resp = {
+        "customers": [found[customer_id] for customer_id in customer_ids if customer_id in found],
+        "missing": [customer_id for customer_id in customer_ids
+                    if customer_id not in found and customer_id not in unprocessed]
+    }
+    # still throttled after every retry, the caller should ask again for these
+    if unprocessed:
+        resp["unprocessed"] = [customer_id for customer_id in customer_ids if customer_id in unprocessed]
+    return stream_json(resp)
+
+
+# GET method to read the running payout totals of a customer (one get_item)
+@paymentApp.route('/v1/api/customer/<customer_id>/summary', methods=['GET'])
+def get_payout_summary(customer_id):
+
+    try:
+        item = storage.get_payout_summary(customer_id)
+    except StorageError as e:
+        return jsonify({"error": f"Error occurred: {e}"}), 500
+
+    summary = {
+        'customer_id': customer_id,
+        'payment_count': int(item.get('payment_count', 0)),
+        'totals': {k[len('total_'):]: str(v) for k, v in item.items() if k.startswith('total_')},
+        'counts': {k[len('count_'):]: int(v) for k, v in item.items() if k.startswith('count_')},
+        'last_payment_at': item.get('last_payment_at')
+    }
+    return jsonify(summary), 200
+
+
+# GET method to list the payments of a customer, all write shards merged
+@paymentApp.route('/v1/api/payment/<customer_id>', methods=['GET'])
+def get_payment_history(customer_id):
+
+    try:
+        customer = storage.get_customer(customer_id)
+        if customer is None:
             return jsonify({"error": "Customer not found"}), 404
+        payments = storage.payment_history(customer_id, customer)
+    except StorageError as e:
+        return jsonify({"error": f"Error occurred: {e}"}), 500
+
+    # streamed and compressed as it is encoded, histories can be long (see compression.py)
+    return stream_json({"customer_id": customer_id, "payments": payments})
 
-    except ClientError as e:
-        return jsonify({"error": f"Error occurred: {e.response['Error']['Message']}"}), 500
+
+# add a successful payment to the customer's payout summary (see lambda_function.py)
+def record_payout_summary(customer_id, payment_id, amount, currency):
+    try:
+        storage.add_payout(customer_id, payment_id, amount, currency)
+    except StorageError as e:
+        # the payment is stored already, rebuild_payout_summaries.py fixes the summary
+        print(f"Failed to update payout summary of {customer_id}: {e}")
 
 
 # Get OAuth token from PayPal
@@ -76,7 +405,7 @@ def get_access_token():
         'Accept-Language': 'en_US'
     }
 
-    response = requests.post(
+    response = get_http().post(
         url,
         headers=headers,
         data={'grant_type': 'client_credentials'},
@@ -90,100 +419,127 @@ def get_access_token():
         print(f"Failed to get access token: {response.status_code} {response.text}")
         return None
 
-# POST method to process payment to customer
-@paymentApp.route('/v1/api/payments', methods=['POST'])
-def process_payment():
+# PAYMENT_PROVIDERS lists the enabled providers, best first (see providers.py)
+def build_payment_router(environ=os.environ):
+    providers = []
+    for name in environ.get('PAYMENT_PROVIDERS', 'paypal').split(','):
+        name = name.strip()
+        if name == 'paypal':
+            # looked up per call, so a per-worker session and patched helpers are used
+            providers.append(PayPalProvider(PAYPAL_SANDBOX_URL, lambda: get_access_token(), lambda: get_http(),
+                                            currencies_from_env(name, environ)))
+        elif name:
+            raise ValueError(f"unknown payment provider {name}")
+    return Router(providers)
 
-    req_data = request.get_json()
 
-    dynamodb = boto3.resource('dynamodb')
+payment_router = build_payment_router()
 
-    if req_data['customer_id']:
-        try:
-            cust_table = dynamodb.Table('Customers')
-            resp = cust_table.get_item(Key={'customer_id': req_data['customer_id']})
-            if 'Item' not in resp:
-                print(f"Customer {req_data['customer_id']} not found in records")
-                return jsonify({"error": f"customer {req_data['customer_id']} not in records"}), 404
+# POST method to process payment to customer
+@paymentApp.route('/v1/api/payments', methods=['POST'])
+def process_payment():
 
-        except ClientError as e:
-            return jsonify({"error": f"Error fetching customer: {e.response['Error']['Message']}"}), 500
+    req_data = request.get_json(silent=True)
 
-    access_token = get_access_token()
-    if access_token is None:
-        print(f"failed to get PayPal API OAuth token")
-        return jsonify({"error": "Error occurred: failed to get PayPal API OAuth token"}), 500
+    errors = validate_payments_request(req_data)
+    if errors:
+        return invalid_request(errors)
+    # integer minor units from here on, JPY takes no decimals (see money.py)
+    try:
+        amount_minor = to_minor_units(req_data['amount'], req_data['currency'])
+    except ValueError as e:
+        return invalid_request([f"amount: {e}"])
+    amount = minor_units_str(amount_minor, req_data['currency'])
 
-    url = f'{PAYPAL_SANDBOX_URL}/v1/payments/payment'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    payment_data = {
-        "intent": "authorize",
-        "payer": {
-            "payment_method": "paypal"
-        },
-        "transactions": [{
-            "amount": {
-                "total": req_data['amount'],
-                "currency": req_data['currency'],
-            },
-            "description": "Test payment"
-        }],
-
-        "redirect_urls": {
-            "return_url": "http://localhost:3000/return",  # Dummy URL
-            "cancel_url": "http://localhost:3000/cancel"   # Dummy URL
-        }
+    try:
+        customer_item = storage.get_customer(req_data['customer_id'])
+        if customer_item is None:
+            print(f"Customer {req_data['customer_id']} not found in records")
+            return jsonify({"error": f"customer {req_data['customer_id']} not in records"}), 404
 
-    }
+    except StorageError as e:
+        return jsonify({"error": f"Error fetching customer: {e}"}), 500
 
-    # Add payee (recipient) details
-    payment_data['transactions'][0]['payee'] = {
-        "email": req_data['email']  # Specify the recipient's email address here
+    # fastest healthy provider for the currency, see providers.py
+    payment = {
+        'customer_id': req_data['customer_id'],
+        'email': req_data['email'],
+        'amount': amount,
+        'currency': req_data['currency']
     }
-
-    response = requests.post(url, json=payment_data, headers=headers)
-
-    if response.status_code == 201:
-        print('Payment Authorization created successfully.')
-    else:
-        print(f"Failed to create payment: {response.status_code} {response.text}")
-        return jsonify({"error": f"payment failed for {data['customer_id']} - {response.text}"}), response.status_code
-
-    # Store payment record in DynamoDB
+    try:
+        provider, provider_payment_id = payment_router.authorize(payment)
+    except ProviderError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    # Store payment record in DynamoDB. Same format as the lambda ('...+00:00Z'): both
+    # write the time-bucket-index sort key, and a bare 'Z' would sort a whole second
+    # after its fractions
+    payment_id = datetime.now(timezone.utc).isoformat() + "Z"
     payment_record = {
-        'customer_id': req_data['customer_id'],
+        'customer_id': disbursement_partition_key(req_data['customer_id'], customer_item),
         'email': req_data['email'],
-        'payment_id': datetime.utcnow().isoformat() + "Z",
-        'amount': req_data['amount'],
-        'payment_method': 'paypal',
+        'payment_id': payment_id,
+        'amount': amount,
+        'payment_method': provider.name,
         'status': 'Completed',
         'currency': req_data['currency'],
+        'time_bucket': payment_time_bucket(payment_id),
         #'timestamp': str(context.aws_request_id)
     }
 
+    # the provider's id of the authorization, paypal_payment_id is the join key for
+    # lambda/reconcile_paypal.py
+    if provider_payment_id:
+        payment_record[f'{provider.name}_payment_id'] = provider_payment_id
+
     try:
-        disb_table = dynamodb.Table('Disbursements')
-        resp = disb_table.put_item(Item=payment_record)
-        print(f"Rajesham Debug: {resp['ResponseMetadata']['HTTPStatusCode']}")
-        return jsonify({"status": req_data['customer_id'] + " payment successful"}), resp['ResponseMetadata']['HTTPStatusCode']
+        # with the journal on, its flusher writes the record and the payout summary to
+        # storage in the background (store_payments)
+        if not journal_payment(payment_record):
+            storage.put_payment(payment_record,
+                                payment_notification(payment_record) if PAYMENT_NOTIFICATIONS else None)
+            record_payout_summary(req_data['customer_id'], payment_record['payment_id'],
+                                  minor_units_decimal(amount_minor, req_data['currency']), req_data['currency'])
+        return jsonify({"status": req_data['customer_id'] + " payment successful"}), 200
 
-    except ClientError as e:
-        return jsonify({"error": f"Error occurred: {e.response['Error']['Message']}"}), 500
+    except StorageError as e:
+        return jsonify({"error": f"Error occurred: {e}"}), 500
 
 
-    '''
-    # Send a notification
-    notification_message = f"Payment of ${amount} has been processed via {payment_method} for payee {payee_id}."
-    #send_event_notification(notification_message)
 
-    return {
-        'statusCode': 200,
-        'body': json.dumps({'message': 'Payment successfully processed', 'result': result})
-    }
-    '''
+# Per API key and route rate limiting with the API Gateway usage plans (see rate_limit.py).
+# Built after every route is registered and, under gunicorn, in the master before the
+# workers fork, so they all share one budget. Off unless RATE_LIMIT_API_KEYS is set.
+rate_limiter = RateLimiter.from_env(paymentApp)
+
+# exempt from rate limiting, like the load balancer health check
+RATE_LIMIT_EXEMPT = {'ready', 'static'}
+
+
+@paymentApp.before_request
+def enforce_rate_limit():
+
+    if not rate_limiter.enabled or request.endpoint is None or request.endpoint in RATE_LIMIT_EXEMPT:
+        return None
+
+    # same answers as API Gateway: 403 without a valid key, 429 over rate or quota
+    retry_after = rate_limiter.check(request.headers.get('x-api-key', ''), request.endpoint)
+    if retry_after is None:
+        return jsonify({"message": "Forbidden"}), 403
+    if retry_after:
+        return jsonify({"message": "Too Many Requests"}), 429, {'Retry-After': str(max(math.ceil(retry_after), 1))}
+    return None
+
+
+# sampled cProfile/tracemalloc profiles of requests, no hooks unless switched on (see profiling.py)
+install_profiling(paymentApp)
+
+# gzip/br by Accept-Encoding above RESPONSE_COMPRESSION_MIN_BYTES (see compression.py)
+install_compression(paymentApp)
+
 
+# Development server only. For production run under gunicorn:
+#   gunicorn -c gunicorn.conf.py paymentApp:paymentApp
 if __name__ == '__main__':
     paymentApp.run(debug=True)
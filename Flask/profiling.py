@@ -0,0 +1,102 @@
+#
+# On-demand request profiling for the Flask app, same switches as the lambda.
+#
+#   PROFILE_SAMPLE_RATE=0.01   profile 1% of requests
+#   PROFILE_HEADER=1           also profile requests sent with 'X-Profile: 1'
+#   PROFILE_DIR=/tmp/profiles  where the raw cProfile dumps go (newest 20 kept)
+#   PROFILE_MEMORY_BUDGET_MB   budget peak memory is reported against, default 128 like lambda.tf
+#
+# A profiled request runs under cProfile and tracemalloc and logs one compact JSON line
+# with its duration, top functions by cumulative time and the Python and process peak
+# memory. tracemalloc is process wide, so a worker profiles one request at a time and
+# skips sampling while one is running. With both switches off install_profiling()
+# registers no hooks at all and requests pay nothing.
+#
+
+import cProfile
+import json
+import os
+import pstats
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from flask import g, request
+
+PROFILE_MAX_FILES = 20
+PROFILE_TOP_FUNCTIONS = 15
+
+
+def install_profiling(app, environ=os.environ):
+    sample_rate = float(environ.get('PROFILE_SAMPLE_RATE', 0))
+    header = environ.get('PROFILE_HEADER', '') == '1'
+    if sample_rate <= 0 and not header:
+        return False
+
+    profile_dir = environ.get('PROFILE_DIR', '/tmp/profiles')
+    budget_mb = int(environ.get('PROFILE_MEMORY_BUDGET_MB', 128))
+    busy = threading.Lock()
+
+    @app.before_request
+    def start_profile():
+        requested = header and request.headers.get('X-Profile') == '1'
+        if not requested and random.random() >= sample_rate:
+            return None
+        if not busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        g.profile = (profiler, time.perf_counter())
+        profiler.enable()
+        return None
+
+    @app.teardown_request
+    def stop_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profiler, start = profile
+        try:
+            profiler.disable()
+            duration = time.perf_counter() - start
+            _, python_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            label = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+            print(json.dumps(profile_summary(profiler, label, duration, python_peak, budget_mb),
+                             separators=(',', ':')))
+            dump_profile(profiler, label, profile_dir)
+        finally:
+            busy.release()
+
+    return True
+
+
+def profile_summary(profiler, label, duration, python_peak, budget_mb):
+    stats = pstats.Stats(profiler)
+    top = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+    # ru_maxrss is in KB on Linux and covers the life of the worker, not just this request
+    rss_peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        'profile': label,
+        'pid': os.getpid(),
+        'duration_ms': round(duration * 1000, 2),
+        'python_peak_kb': round(python_peak / 1024, 1),
+        'rss_peak_mb': round(rss_peak_mb, 1),
+        'memory_budget_mb': budget_mb,
+        'memory_used_pct': round(100 * rss_peak_mb / budget_mb, 1),
+        # [function, calls, own ms, cumulative ms]
+        'top': [[f'{os.path.basename(filename)}:{line}:{name}', calls, round(own * 1000, 3), round(cumulative * 1000, 3)]
+                for (filename, line, name), (_, calls, own, cumulative, _) in top],
+    }
+
+
+def dump_profile(profiler, label, profile_dir):
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        name = ''.join(c if c.isalnum() else '_' for c in label).strip('_')
+        profiler.dump_stats(os.path.join(profile_dir, f'{time.time_ns()}-{os.getpid()}-{name}.prof'))
+        for old in sorted(os.listdir(profile_dir))[:-PROFILE_MAX_FILES]:
+            os.remove(os.path.join(profile_dir, old))
+    except OSError as e:
+        print(f"Failed to write profile: {e}")
@@ -0,0 +1,291 @@
+#
+# Payment providers and latency-aware routing between them.
+#
+# A provider authorizes one payment: PayPal today, Stripe and ACH are planned (see the
+# README). PAYMENT_PROVIDERS lists the enabled ones, e.g. "paypal", the order breaks
+# ties between providers without latency samples yet, and <NAME>_CURRENCIES optionally
+# restricts the currencies a provider may take, e.g. PAYPAL_CURRENCIES=USD,EUR,GBP (all
+# currencies when unset).
+#
+# The router keeps, per provider, an EWMA of the latency of successful calls and an
+# EWMA of the error rate (1 per degraded call, 0 per success). A payment goes to the
+# fastest healthy provider allowed for its currency. A provider whose error rate or
+# run of consecutive failures crosses the thresholds is ejected for EJECT_SECONDS and
+# only used when no healthy provider is left. After that it gets traffic again, and a
+# failure ejects it again right away. A healthy provider left without traffic for
+# PROBE_SECONDS gets one payment to refresh its average.
+#
+# Failover only happens when the failed call certainly did not create a payment
+# (connection refused or not set up in time, 429, OAuth failure). A timeout, a 5xx or a
+# connection dropped once it was up (reset, closed without a response) is ambiguous:
+# the provider may have authorized the payment before failing (a gateway error after
+# the write), so the error is returned to the client and no other provider is tried, as
+# a second authorization could charge twice. It still counts against the provider's
+# health.
+#
+# choose() costs a few microseconds. The candidate list for a currency is cached and
+# only re-sorted when a provider has been used since the last sort.
+#
+
+import json
+import threading
+import time
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+# weight of the newest sample in the latency and error rate averages
+EWMA_ALPHA = 0.2
+# eject above this error rate, or after this many failures in a row
+MAX_ERROR_RATE = 0.5
+MAX_CONSECUTIVE_FAILURES = 3
+EJECT_SECONDS = 30.0
+# a healthy provider that got no traffic for this long gets the next payment, so a
+# recovered provider's stale average does not keep it out for good
+PROBE_SECONDS = 10.0
+
+
+class ProviderError(Exception):
+    """
+    a provider call that did not authorize the payment. status is the HTTP status for the
+    client. retryable: no payment was created, another provider may be tried.
+    degraded: the provider misbehaved (not a declined or invalid payment).
+    """
+
+    def __init__(self, message, status=502, retryable=False, degraded=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.degraded = degraded
+
+
+def connect_failed(error):
+    # True for a requests ConnectionError raised while connecting (refused, DNS failure,
+    # connect timeout), before anything was sent. requests wraps urllib3's error in a
+    # MaxRetryError, whose reason is the cause.
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, 'reason', cause), ConnectTimeoutError)
+
+
+class Provider:
+    name = None
+
+    def __init__(self, currencies=None):
+        # None: every currency
+        self.currencies = frozenset(currencies) if currencies else None
+
+    def accepts(self, currency):
+        return self.currencies is None or currency in self.currencies
+
+    def authorize(self, payment):
+        """
+        authorize payment ({customer_id, email, amount, currency}). Returns the provider's
+        payment id (None if it sent none), raises ProviderError.
+        """
+        raise NotImplementedError
+
+
+class PayPalProvider(Provider):
+    name = 'paypal'
+
+    def __init__(self, base_url, access_token, http, currencies=None, timeout=30):
+        # access_token() and http() are looked up per call: the app hands out a per-worker
+        # session and caches nothing here
+        super().__init__(currencies)
+        self.base_url = base_url
+        self.access_token = access_token
+        self.http = http
+        self.timeout = timeout
+
+    def authorize(self, payment):
+        access_token = self.access_token()
+        if access_token is None:
+            raise ProviderError("Error occurred: failed to get PayPal API OAuth token", status=500,
+                                retryable=True, degraded=True)
+
+        payment_data = {
+            "intent": "authorize",
+            "payer": {
+                "payment_method": "paypal"
+            },
+            "transactions": [{
+                "amount": {
+                    "total": payment['amount'],
+                    "currency": payment['currency'],
+                },
+                "description": "Test payment",
+                # Add payee (recipient) details
+                "payee": {
+                    "email": payment['email']
+                }
+            }],
+            "redirect_urls": {
+                "return_url": "http://localhost:3000/return",  # Dummy URL
+                "cancel_url": "http://localhost:3000/cancel"   # Dummy URL
+            }
+        }
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+
+        try:
+            response = self.http().post(f'{self.base_url}/v1/payments/payment', json=payment_data,
+                                        headers=headers, timeout=self.timeout)
+        except requests.exceptions.ConnectionError as e:
+            # a dropped or reset connection may come after PayPal got the request: only a
+            # connection that was never set up can fail over (ConnectTimeout included)
+            if connect_failed(e):
+                raise ProviderError(f"payment failed for {payment['customer_id']} - {e}",
+                                    retryable=True, degraded=True)
+            raise ProviderError(f"payment failed for {payment['customer_id']} - {e}",
+                                status=504, degraded=True)
+        except requests.exceptions.Timeout as e:
+            raise ProviderError(f"payment failed for {payment['customer_id']} - {e}",
+                                status=504, degraded=True)
+
+        if response.status_code != 201:
+            print(f"Failed to create payment: {response.status_code} {response.text}")
+            # 429 is refused before anything is written, a 5xx may come after the write
+            throttled = response.status_code == 429
+            raise ProviderError(f"payment failed for {payment['customer_id']} - {response.text}",
+                                status=response.status_code, retryable=throttled,
+                                degraded=throttled or response.status_code >= 500)
+
+        print('Payment Authorization created successfully.')
+        try:
+            paypal_payment_id = json.loads(response.text).get('id')
+        except (TypeError, ValueError, AttributeError):
+            return None
+        return paypal_payment_id if isinstance(paypal_payment_id, str) else None
+
+
+class ProviderStats:
+    __slots__ = ('latency', 'error_rate', 'consecutive_failures', 'ejected_until', 'calls', 'last_used')
+
+    def __init__(self):
+        # None until the first success, sorts as 0 so a new provider gets tried
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.calls = 0
+        self.last_used = 0.0
+
+
+class NoProviderError(ProviderError):
+    def __init__(self, currency):
+        super().__init__(f"no payment provider accepts {currency}", status=400)
+
+
+class Router:
+
+    def __init__(self, providers, clock=time.monotonic):
+        self.providers = list(providers)
+        self.stats = {provider.name: ProviderStats() for provider in self.providers}
+        self.clock = clock
+        self.lock = threading.Lock()
+        # probes start PROBE_SECONDS after startup
+        for s in self.stats.values():
+            s.last_used = clock()
+        # currency: (version the order was computed at, providers in order, valid until,
+        # provider to probe)
+        self.version = 0
+        self.order = {}
+
+    def choose(self, currency):
+        """
+        providers to try for currency, best first: healthy ones by latency, then ejected
+        ones by how soon they come back. A healthy provider due for a probe goes first.
+        """
+        now = self.clock()
+        cached = self.order.get(currency)
+        if cached is None or cached[0] != self.version or cached[2] <= now:
+            cached = self._order(currency, now)
+        order, probe = cached[1], cached[3]
+        if probe is None or self.stats[probe.name].last_used + PROBE_SECONDS > now:
+            return order
+        # claim the probe so concurrent requests do not all take it
+        self.stats[probe.name].last_used = now
+        return [probe] + [provider for provider in order if provider is not probe]
+
+    def _order(self, currency, now):
+        stats = self.stats
+        healthy = []
+        ejected = []
+        for provider in self.providers:
+            if not provider.accepts(currency):
+                continue
+            s = stats[provider.name]
+            if s.ejected_until > now:
+                ejected.append((s.ejected_until, provider))
+            else:
+                healthy.append((s.latency or 0.0, provider))
+        healthy.sort(key=lambda entry: entry[0])
+        ejected.sort(key=lambda entry: entry[0])
+        order = [provider for _, provider in healthy] + [provider for _, provider in ejected]
+        # the healthy provider idle the longest, behind the best one
+        idle = [provider for _, provider in healthy[1:]]
+        probe = min(idle, key=lambda provider: stats[provider.name].last_used) if idle else None
+        # valid until the data changes or the next ejected provider comes back
+        expires = ejected[0][0] if ejected else float('inf')
+        cached = self.order[currency] = (self.version, order, expires, probe)
+        return cached
+
+    def record(self, name, latency, error):
+        with self.lock:
+            s = self.stats[name]
+            s.calls += 1
+            s.last_used = self.clock()
+            s.error_rate += EWMA_ALPHA * ((1.0 if error else 0.0) - s.error_rate)
+            if error:
+                s.consecutive_failures += 1
+                if s.error_rate > MAX_ERROR_RATE or s.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                    s.ejected_until = self.clock() + EJECT_SECONDS
+            else:
+                s.consecutive_failures = 0
+                s.latency = latency if s.latency is None else s.latency + EWMA_ALPHA * (latency - s.latency)
+            self.version += 1
+
+    def authorize(self, payment):
+        """
+        authorize payment with the best provider, failing over while it is safe.
+        Returns (provider, provider payment id), raises the last ProviderError.
+        """
+        candidates = self.choose(payment['currency'])
+        if not candidates:
+            raise NoProviderError(payment['currency'])
+
+        error = None
+        for provider in candidates:
+            start = time.perf_counter()
+            try:
+                provider_payment_id = provider.authorize(payment)
+            except ProviderError as e:
+                # a declined or invalid payment says nothing about the provider's health
+                if e.degraded:
+                    self.record(provider.name, time.perf_counter() - start, True)
+                if not e.retryable:
+                    raise
+                print(f"provider {provider.name} failed ({e}), trying the next one")
+                error = e
+                continue
+            self.record(provider.name, time.perf_counter() - start, False)
+            return provider, provider_payment_id
+        raise error
+
+    def snapshot(self):
+        # per provider state for logs and the readiness endpoint
+        now = self.clock()
+        return {name: {'latency_ms': None if s.latency is None else round(s.latency * 1000, 1),
+                       'error_rate': round(s.error_rate, 3),
+                       'ejected': s.ejected_until > now,
+                       'calls': s.calls}
+                for name, s in self.stats.items()}
+
+
+def currencies_from_env(name, environ):
+    value = environ.get(f'{name.upper()}_CURRENCIES', '')
+    return [c.strip().upper() for c in value.split(',') if c.strip()] or None
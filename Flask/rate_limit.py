@@ -0,0 +1,174 @@
+#
+# Per API key and per route token bucket rate limiting for the self-hosted Flask app.
+#
+# The plans mirror the API Gateway usage plans in deply/aws/apigateway_rate_limit.tf:
+#
+#   plan       rate (req/s)   burst   quota
+#   basic      5              10      500 per MONTH
+#   standard   10             20      1000 per MONTH
+#   premium    15             30      1500 per MONTH
+#
+# and are overridden with the terraform variable names in upper case, e.g.
+# BASIC_PLAN_RATE_LIMIT=8 or PREMIUM_PLAN_QUOTA_PERIOD=DAY. API keys are assigned to plans
+# with RATE_LIMIT_API_KEYS="<key>=basic,<key>=premium". Without any key the limiter is off.
+#
+# Every (key, route) pair gets a token bucket of `burst` tokens refilled at `rate` per
+# second, and every key a quota counter shared by all its routes, like API Gateway.
+# The state is a table of doubles in an anonymous shared mmap created at import time.
+# gunicorn preloads the app (gunicorn.conf.py), so all forked workers map the same pages
+# and enforce one budget. Without preload_app every worker would get its own budget.
+#
+# Slots are assigned from the sorted keys and routes, so no hashing or probing happens
+# per request. Each key has a multiprocessing.Lock, also created before the fork. A
+# worker killed while holding it cannot wedge the others: acquire times out and the
+# request is let through.
+#
+
+import mmap
+import multiprocessing
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+# terraform defaults of apigateway_rate_limit.tf
+DEFAULT_PLANS = {
+    'basic':    {'rate_limit': 5,  'burst_limit': 10, 'quota_limit': 500,  'quota_period': 'MONTH'},
+    'standard': {'rate_limit': 10, 'burst_limit': 20, 'quota_limit': 1000, 'quota_period': 'MONTH'},
+    'premium':  {'rate_limit': 15, 'burst_limit': 30, 'quota_limit': 1500, 'quota_period': 'MONTH'},
+}
+
+QUOTA_PERIODS = ('DAY', 'WEEK', 'MONTH')
+
+# give up on a lock held this long (its holder most likely died) and let the request through
+LOCK_TIMEOUT = 0.05
+
+# doubles per slot: bucket (tokens, last refill), quota (period start, count)
+SLOT_SIZE = 2
+
+
+def plans_from_env(environ=os.environ):
+    plans = {}
+    for name, defaults in DEFAULT_PLANS.items():
+        plan = {}
+        for setting, default in defaults.items():
+            value = environ.get(f'{name}_plan_{setting}'.upper(), default)
+            plan[setting] = value.upper() if setting == 'quota_period' else float(value)
+        if plan['quota_period'] not in QUOTA_PERIODS:
+            raise ValueError(f"{name} plan quota period must be one of {QUOTA_PERIODS}")
+        plans[name] = plan
+    return plans
+
+
+def api_keys_from_env(environ=os.environ):
+    keys = {}
+    for entry in environ.get('RATE_LIMIT_API_KEYS', '').split(','):
+        if not entry.strip():
+            continue
+        key, _, plan = entry.strip().rpartition('=')
+        keys[key] = plan
+    return keys
+
+
+def period_bounds(period, now):
+    # start and end (unix seconds, UTC) of the quota period containing now
+    day = datetime.fromtimestamp(now, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'DAY':
+        start, end = day, day + timedelta(days=1)
+    elif period == 'WEEK':
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+    else:
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    return start.timestamp(), end.timestamp()
+
+
+class RateLimiter:
+
+    def __init__(self, api_keys, plans, routes):
+        unknown = {plan for plan in api_keys.values() if plan not in plans}
+        if unknown:
+            raise ValueError(f"unknown rate limit plans {sorted(unknown)}, expected one of {sorted(plans)}")
+
+        self.keys = sorted(api_keys)
+        self.routes = sorted(routes)
+        self.plans = plans
+        route_index = {route: i for i, route in enumerate(self.routes)}
+
+        # per key: (rate, burst, quota, quota period, lock, quota slot offset,
+        # {route: bucket slot offset}), flat so check() does no further lookups
+        self.entries = {}
+        slots = 0
+        for key in self.keys:
+            plan = plans[api_keys[key]]
+            quota_slot = slots * SLOT_SIZE
+            buckets = {route: (slots + 1 + i) * SLOT_SIZE for route, i in route_index.items()}
+            self.entries[key] = (plan['rate_limit'], plan['burst_limit'], plan['quota_limit'],
+                                 plan['quota_period'], multiprocessing.Lock(), quota_slot, buckets)
+            slots += 1 + len(self.routes)
+
+        self.memory = mmap.mmap(-1, max(slots * SLOT_SIZE * 8, mmap.PAGESIZE))
+        self.state = memoryview(self.memory).cast('d')
+
+        # quota period per period name: (start as unix time, end as time.monotonic()),
+        # recomputed by each process when its period ends
+        self.periods = {}
+
+    @classmethod
+    def from_env(cls, app, environ=os.environ):
+        return cls(api_keys_from_env(environ), plans_from_env(environ), app.view_functions)
+
+    @property
+    def enabled(self):
+        return bool(self.keys)
+
+    def _period(self, period, now):
+        wall = time.time()
+        start, end = period_bounds(period, wall)
+        bounds = self.periods[period] = (start, now + (end - wall))
+        return bounds
+
+    def check(self, api_key, route):
+        """
+        take a token for api_key on route. Returns 0 when the request may go ahead,
+        otherwise the seconds until it would be allowed (Retry-After). None for a key
+        without a plan.
+        """
+        entry = self.entries.get(api_key)
+        if entry is None:
+            return None
+        rate, burst, quota, period, lock, quota_slot, buckets = entry
+        bucket_slot = buckets.get(route)
+        if bucket_slot is None:
+            return 0
+
+        # one clock read per request, the quota period end is kept in monotonic time too
+        now = time.monotonic()
+        period_start, period_end = self.periods.get(period) or self._period(period, now)
+        if now >= period_end:
+            period_start, period_end = self._period(period, now)
+        state = self.state
+
+        # uncontended try first, it is cheaper than a timed wait
+        if not lock.acquire(False) and not lock.acquire(timeout=LOCK_TIMEOUT):
+            return 0
+        try:
+            if state[quota_slot] != period_start:
+                state[quota_slot] = period_start
+                state[quota_slot + 1] = 0.0
+            if state[quota_slot + 1] >= quota:
+                return period_end - now
+
+            last = state[bucket_slot + 1]
+            tokens = burst if last == 0.0 else min(burst, state[bucket_slot] + (now - last) * rate)
+            if tokens < 1.0:
+                state[bucket_slot] = tokens
+                state[bucket_slot + 1] = now
+                return (1.0 - tokens) / rate
+
+            state[bucket_slot] = tokens - 1.0
+            state[bucket_slot + 1] = now
+            state[quota_slot + 1] += 1.0
+            return 0
+        finally:
+            lock.release()
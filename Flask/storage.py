@@ -0,0 +1,650 @@
+#
+# Storage backends of the Flask app.
+#
+# Storage is everything paymentApp reads and writes: customers and their email
+# uniqueness markers, payment records (Disbursements), payout summaries and the outbox
+# of payment notifications (see outbox.py).
+#
+#   DynamoDBStorage  the tables of deply/aws, same items and keys as the lambda
+#   SQLiteStorage    one local SQLite file, for on-prem hosts and for benchmarking the
+#                    app without network bound DynamoDB latency
+#
+# STORAGE_BACKEND=dynamodb (default) or sqlite picks one, STORAGE_SQLITE_PATH sets the
+# database file (default paymentApp.db). Items go in and come out as plain dicts shaped
+# like the DynamoDB items, so routes do not care which backend is behind them.
+# Backend failures are raised as StorageError.
+#
+
+import heapq
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+# GSI on Customers.email (see deply/aws/dynamodb.tf)
+CUSTOMER_EMAIL_INDEX = 'email-index'
+
+# Email uniqueness markers are stored in Customers under 'email#<email>', same as the lambda
+EMAIL_MARKER_PREFIX = 'email#'
+
+# Disbursements partition keys of a write sharded payee: customer_id, customer_id#1, ...
+DISBURSEMENT_SHARD_SEPARATOR = '#'
+# shards of one payee are queried in parallel, as the lambda does
+MAX_SHARD_QUERY_WORKERS = 16
+# payments stored with a notification are one DynamoDB transaction each, run this many at a time
+MAX_TRANSACT_WORKERS = 16
+
+# BatchGetItem takes at most 100 keys, chunks are read concurrently and
+# UnprocessedKeys retried with jittered exponential backoff
+BATCH_GET_CHUNK_SIZE = 100
+MAX_BATCH_GET_WORKERS = 10
+BATCH_GET_MAX_ATTEMPTS = 6
+
+PAYMENT_COLUMNS = ('customer_id', 'payment_id', 'email', 'amount', 'currency', 'payment_method',
+                   'status', 'paypal_payment_id', 'time_bucket')
+
+
+class StorageError(Exception):
+    pass
+
+
+def disbursement_read_keys(customer_id, customer_item):
+    # every partition key a customer's payments may be under, including shards no longer written
+    customer_item = customer_item or {}
+    shards = max(int(customer_item.get('disbursement_shards', 1)),
+                 int(customer_item.get('disbursement_shards_max', 1)), 1)
+    return [customer_id] + [f"{customer_id}{DISBURSEMENT_SHARD_SEPARATOR}{shard}" for shard in range(1, shards)]
+
+
+class Storage:
+    # claim email for customer_id, False if another customer already holds it
+    def claim_email(self, customer_id, email):
+        raise NotImplementedError
+
+    # drop the marker of an email the customer no longer uses
+    def release_email(self, customer_id, email):
+        raise NotImplementedError
+
+    # create or update a customer, bumping its version. Returns the previous record or {}
+    def put_customer(self, customer_id, email):
+        raise NotImplementedError
+
+    def get_customer(self, customer_id):
+        raise NotImplementedError
+
+    # ({customer_id: record} of those found, [ids the backend could not serve yet])
+    def get_customers(self, customer_ids):
+        raise NotImplementedError
+
+    def customers_by_email(self, email):
+        raise NotImplementedError
+
+    # a notification given with a payment is stored with it, both or neither
+    def put_payment(self, record, notification=None):
+        self.put_payments([record], [notification] if notification else [])
+
+    # notifications: none, or one per record in the same order. Each record is stored
+    # together with its notification, both or neither, and a record that is already
+    # stored (a journal replay) writes neither: a stored payment has exactly one outbox
+    # notification, even once it has been sent and deleted
+    def put_payments(self, records, notifications=()):
+        raise NotImplementedError
+
+    # payments of a customer across all its shards, oldest first
+    def payment_history(self, customer_id, customer_item):
+        raise NotImplementedError
+
+    # add a successful payment to the customer's payout summary
+    def add_payout(self, customer_id, payment_id, amount, currency):
+        raise NotImplementedError
+
+    # PayoutSummaries item of a customer ({} if it has none): payment_count,
+    # count_<CUR>, total_<CUR>, last_payment_at
+    def get_payout_summary(self, customer_id):
+        raise NotImplementedError
+
+    # outbox notifications due at or before now, oldest due first
+    def pending_notifications(self, limit, now):
+        raise NotImplementedError
+
+    # drop delivered notifications from the outbox
+    def complete_notifications(self, notification_ids):
+        raise NotImplementedError
+
+    # record a failed attempt, next_attempt_at None parks the notification for good
+    def reschedule_notification(self, notification_id, attempts, next_attempt_at):
+        raise NotImplementedError
+
+    # raise if the backend cannot be used, for the readiness check
+    def check(self):
+        raise NotImplementedError
+
+
+def _dynamodb_error(e):
+    return StorageError(e.response['Error']['Message'])
+
+
+def _dynamodb_number(value):
+    # boto3 refuses floats, JSON request bodies are full of them
+    return Decimal(str(value)) if isinstance(value, float) else value
+
+
+# NotificationOutbox items carry pending = 1 until sent or parked, the sparse
+# pending-index (pending, next_attempt_at) lists what is due (see deply/aws/dynamodb.tf)
+OUTBOX_PENDING_INDEX = 'pending-index'
+
+
+def _outbox_item(notification):
+    item = {k: _dynamodb_number(v) for k, v in notification.items()}
+    item.setdefault('attempts', 0)
+    item['next_attempt_at'] = _dynamodb_number(float(item.get('next_attempt_at', 0)))
+    item['pending'] = 1
+    return item
+
+
+def _outbox_notification(item):
+    notification = {k: v for k, v in item.items() if k != 'pending'}
+    notification['attempts'] = int(notification.get('attempts', 0))
+    notification['next_attempt_at'] = float(notification['next_attempt_at'])
+    return notification
+
+
+class DynamoDBStorage(Storage):
+    # dynamodb() returns the resource to use, paymentApp.get_dynamodb hands out one per worker thread
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+        self.deserializer = TypeDeserializer()
+        self.serializer = TypeSerializer()
+
+    def claim_email(self, customer_id, email):
+        try:
+            self.dynamodb().Table('Customers').put_item(
+                Item={'customer_id': EMAIL_MARKER_PREFIX + email, 'owner_id': customer_id},
+                ConditionExpression=Attr('customer_id').not_exists() | Attr('owner_id').eq(customer_id)
+            )
+        except ClientError as e:
+            if e.response['Error'].get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise _dynamodb_error(e)
+        return True
+
+    def release_email(self, customer_id, email):
+        try:
+            self.dynamodb().Table('Customers').delete_item(
+                Key={'customer_id': EMAIL_MARKER_PREFIX + email},
+                ConditionExpression=Attr('owner_id').eq(customer_id)
+            )
+        except ClientError as e:
+            raise _dynamodb_error(e)
+
+    def put_customer(self, customer_id, email):
+        try:
+            # update keeps the other attributes of the record and bumps its version
+            resp = self.dynamodb().Table('Customers').update_item(
+                Key={'customer_id': customer_id},
+                UpdateExpression='SET email = :email ADD version :one',
+                ExpressionAttributeValues={':email': email, ':one': 1},
+                ReturnValues='ALL_OLD'
+            )
+        except ClientError as e:
+            raise _dynamodb_error(e)
+        return resp.get('Attributes', {})
+
+    def get_customer(self, customer_id):
+        try:
+            resp = self.dynamodb().Table('Customers').get_item(Key={'customer_id': customer_id})
+        except ClientError as e:
+            raise _dynamodb_error(e)
+        return resp.get('Item')
+
+    def get_customers(self, customer_ids):
+        # the low level client is thread safe, the resource is not
+        client = self.dynamodb().meta.client
+        chunks = [customer_ids[i:i + BATCH_GET_CHUNK_SIZE] for i in range(0, len(customer_ids), BATCH_GET_CHUNK_SIZE)]
+        try:
+            with ThreadPoolExecutor(max_workers=max(min(len(chunks), MAX_BATCH_GET_WORKERS), 1)) as pool:
+                results = list(pool.map(lambda chunk: self._batch_get_chunk(client, chunk), chunks))
+        except ClientError as e:
+            raise _dynamodb_error(e)
+
+        found = {}
+        unprocessed = []
+        for chunk_found, chunk_unprocessed in results:
+            found.update(chunk_found)
+            unprocessed.extend(chunk_unprocessed)
+        return found, unprocessed
+
+    def _batch_get_chunk(self, client, customer_ids):
+        request_items = {'Customers': {'Keys': [{'customer_id': {'S': customer_id}} for customer_id in customer_ids]}}
+        found = {}
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            resp = client.batch_get_item(RequestItems=request_items)
+            for raw in resp.get('Responses', {}).get('Customers', []):
+                item = {k: self.deserializer.deserialize(v) for k, v in raw.items()}
+                found[item['customer_id']] = item
+            request_items = resp.get('UnprocessedKeys') or {}
+            if not request_items.get('Customers', {}).get('Keys'):
+                return found, []
+            if attempt + 1 < BATCH_GET_MAX_ATTEMPTS:
+                time.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+        return found, [key['customer_id']['S'] for key in request_items['Customers']['Keys']]
+
+    def customers_by_email(self, email):
+        try:
+            resp = self.dynamodb().Table('Customers').query(
+                IndexName=CUSTOMER_EMAIL_INDEX,
+                KeyConditionExpression=Key('email').eq(email)
+            )
+        except ClientError as e:
+            raise _dynamodb_error(e)
+        return resp.get('Items', [])
+
+    def put_payment(self, record, notification=None):
+        try:
+            if notification is None:
+                self.dynamodb().Table('Disbursements').put_item(
+                    Item={k: _dynamodb_number(v) for k, v in record.items()})
+                return
+            # one round trip like put_item
+            self._put_with_notification(self.dynamodb().meta.client, record, notification)
+        except ClientError as e:
+            raise _dynamodb_error(e)
+
+    def put_payments(self, records, notifications=()):
+        dynamodb = self.dynamodb()
+        try:
+            if notifications:
+                # one transaction per payment, BatchWriteItem is not atomic. The low level
+                # client is thread safe, the resource is not
+                client = dynamodb.meta.client
+                with ThreadPoolExecutor(max_workers=min(len(records), MAX_TRANSACT_WORKERS)) as pool:
+                    list(pool.map(lambda pair: self._put_with_notification(client, *pair),
+                                  zip(records, notifications)))
+                return
+            # batch_writer groups the puts 25 at a time, resends unprocessed items and
+            # keeps the last of duplicate keys, which BatchWriteItem would reject.
+            # Not atomic: the journal (journal.py) replays a batch that failed half way.
+            with dynamodb.Table('Disbursements').batch_writer(
+                    overwrite_by_pkeys=['customer_id', 'payment_id']) as batch:
+                for record in records:
+                    batch.put_item(Item={k: _dynamodb_number(v) for k, v in record.items()})
+        except ClientError as e:
+            raise _dynamodb_error(e)
+
+    def _put_with_notification(self, client, record, notification):
+        # the record and its outbox item in one transaction, only if the record is new. A
+        # record that exists was stored with its notification already, which may have
+        # been sent and deleted since, so a replay must not put it back.
+        serialize = self.serializer.serialize
+        try:
+            client.transact_write_items(TransactItems=[
+                {'Put': {'TableName': 'Disbursements',
+                         'Item': {k: serialize(_dynamodb_number(v)) for k, v in record.items()},
+                         'ConditionExpression': 'attribute_not_exists(payment_id)'}},
+                {'Put': {'TableName': 'NotificationOutbox',
+                         'Item': {k: serialize(v) for k, v in _outbox_item(notification).items()}}}
+            ])
+        except ClientError as e:
+            reasons = e.response.get('CancellationReasons') or [{}]
+            if e.response['Error'].get('Code') == 'TransactionCanceledException' and \
+                    reasons[0].get('Code') == 'ConditionalCheckFailed':
+                return
+            raise
+
+    def payment_history(self, customer_id, customer_item):
+        # the low level client is thread safe, the resource is not
+        client = self.dynamodb().meta.client
+        keys = disbursement_read_keys(customer_id, customer_item)
+        try:
+            if len(keys) == 1:
+                shards = [self._query_partition(client, keys[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(len(keys), MAX_SHARD_QUERY_WORKERS)) as pool:
+                    shards = list(pool.map(lambda key: self._query_partition(client, key), keys))
+        except ClientError as e:
+            raise _dynamodb_error(e)
+        # each shard comes back in payment_id order, a k-way merge keeps it
+        payments = list(heapq.merge(*shards, key=lambda p: p['payment_id']))
+        for payment in payments:
+            payment['customer_id'] = customer_id
+        return payments
+
+    def _query_partition(self, client, partition_key):
+        items = []
+        query_args = {
+            'TableName': 'Disbursements',
+            'KeyConditionExpression': 'customer_id = :pk',
+            'ExpressionAttributeValues': {':pk': {'S': partition_key}},
+        }
+        while True:
+            resp = client.query(**query_args)
+            for raw in resp.get('Items', []):
+                items.append({k: self.deserializer.deserialize(v) for k, v in raw.items()})
+            if 'LastEvaluatedKey' not in resp:
+                return items
+            query_args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def add_payout(self, customer_id, payment_id, amount, currency):
+        try:
+            self.dynamodb().Table('PayoutSummaries').update_item(
+                Key={'customer_id': customer_id},
+                UpdateExpression='ADD payment_count :one, #count :one, #total :amount SET last_payment_at = :pid',
+                ExpressionAttributeNames={'#count': f'count_{currency}', '#total': f'total_{currency}'},
+                ExpressionAttributeValues={':one': 1, ':amount': Decimal(str(amount)), ':pid': payment_id}
+            )
+        except ClientError as e:
+            raise _dynamodb_error(e)
+
+    def get_payout_summary(self, customer_id):
+        try:
+            resp = self.dynamodb().Table('PayoutSummaries').get_item(Key={'customer_id': customer_id})
+        except ClientError as e:
+            raise _dynamodb_error(e)
+        return resp.get('Item', {})
+
+    def pending_notifications(self, limit, now):
+        try:
+            resp = self.dynamodb().Table('NotificationOutbox').query(
+                IndexName=OUTBOX_PENDING_INDEX,
+                KeyConditionExpression=Key('pending').eq(1) & Key('next_attempt_at').lte(Decimal(str(now))),
+                Limit=limit
+            )
+        except ClientError as e:
+            raise _dynamodb_error(e)
+        return [_outbox_notification(item) for item in resp.get('Items', [])]
+
+    def complete_notifications(self, notification_ids):
+        try:
+            with self.dynamodb().Table('NotificationOutbox').batch_writer(
+                    overwrite_by_pkeys=['notification_id']) as batch:
+                for notification_id in notification_ids:
+                    batch.delete_item(Key={'notification_id': notification_id})
+        except ClientError as e:
+            raise _dynamodb_error(e)
+
+    def reschedule_notification(self, notification_id, attempts, next_attempt_at):
+        table = self.dynamodb().Table('NotificationOutbox')
+        # only an item still in the outbox: update_item would otherwise create a partial
+        # one for a notification another dispatcher has sent and deleted meanwhile
+        exists = 'attribute_exists(notification_id)'
+        try:
+            if next_attempt_at is None:
+                # out of the pending index, kept for inspection
+                table.update_item(Key={'notification_id': notification_id},
+                                  UpdateExpression='SET attempts = :a REMOVE pending',
+                                  ConditionExpression=exists,
+                                  ExpressionAttributeValues={':a': attempts})
+            else:
+                table.update_item(Key={'notification_id': notification_id},
+                                  UpdateExpression='SET attempts = :a, next_attempt_at = :n',
+                                  ConditionExpression=exists,
+                                  ExpressionAttributeValues={':a': attempts, ':n': Decimal(str(next_attempt_at))})
+        except ClientError as e:
+            if e.response['Error'].get('Code') == 'ConditionalCheckFailedException':
+                return
+            raise _dynamodb_error(e)
+
+    def check(self):
+        # building the resource does not hit the network, but fails fast when the
+        # region or credentials configuration is broken
+        self.dynamodb()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id             TEXT PRIMARY KEY,
+    email                   TEXT NOT NULL,
+    version                 INTEGER NOT NULL DEFAULT 1,
+    disbursement_shards     INTEGER,
+    disbursement_shards_max INTEGER
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS customers_email ON customers (email);
+CREATE TABLE IF NOT EXISTS email_markers (
+    email    TEXT PRIMARY KEY,
+    owner_id TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS disbursements (
+    customer_id       TEXT NOT NULL,
+    payment_id        TEXT NOT NULL,
+    email             TEXT,
+    amount            TEXT,
+    currency          TEXT,
+    payment_method    TEXT,
+    status            TEXT,
+    paypal_payment_id TEXT,
+    time_bucket       TEXT,
+    PRIMARY KEY (customer_id, payment_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS payout_summaries (
+    customer_id     TEXT PRIMARY KEY,
+    payment_count   INTEGER NOT NULL,
+    last_payment_at TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    notification_id TEXT PRIMARY KEY,
+    body            TEXT NOT NULL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL,
+    pending         INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS notification_outbox_due ON notification_outbox (next_attempt_at) WHERE pending = 1;
+CREATE TABLE IF NOT EXISTS payout_totals (
+    customer_id TEXT NOT NULL,
+    currency    TEXT NOT NULL,
+    count       INTEGER NOT NULL,
+    total       TEXT NOT NULL,
+    PRIMARY KEY (customer_id, currency)
+) WITHOUT ROWID;
+"""
+
+# SQLite limits host parameters per statement, batch reads stay well under it
+SQLITE_MAX_IN = 500
+
+_CUSTOMER_COLUMNS = ('customer_id', 'email', 'version', 'disbursement_shards', 'disbursement_shards_max')
+
+
+def _customer_row(row):
+    return {k: v for k, v in zip(_CUSTOMER_COLUMNS, row) if v is not None}
+
+
+def _payment_row(row):
+    payment = {k: v for k, v in zip(PAYMENT_COLUMNS, row) if v is not None}
+    if 'amount' in payment:
+        payment['amount'] = Decimal(payment['amount'])
+    return payment
+
+
+class SQLiteStorage(Storage):
+    # One connection per thread (and per process: a forked worker never reuses the
+    # master's). WAL lets readers run next to the single writer, synchronous=NORMAL
+    # only syncs at checkpoints, which is durable against process crashes and loses at
+    # most the last transactions on power loss. Every statement is a constant string,
+    # so the connection's statement cache prepares each once.
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        # not kept: a connection must not be carried across the gunicorn fork
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SQLITE_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            # isolation_level=None: transactions are opened explicitly with BEGIN
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=OFF')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def _write(self, fn):
+        # one IMMEDIATE transaction: takes the write lock up front so read-modify-write
+        # sequences cannot deadlock on lock upgrade
+        conn = self._connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+        except sqlite3.Error as e:
+            raise StorageError(str(e))
+
+    def _read(self, sql, params=()):
+        try:
+            return self._connection().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            raise StorageError(str(e))
+
+    def claim_email(self, customer_id, email):
+        def claim(conn):
+            conn.execute('INSERT OR IGNORE INTO email_markers (email, owner_id) VALUES (?, ?)', (email, customer_id))
+            owner = conn.execute('SELECT owner_id FROM email_markers WHERE email = ?', (email,)).fetchone()
+            return owner[0] == customer_id
+        return self._write(claim)
+
+    def release_email(self, customer_id, email):
+        self._write(lambda conn: conn.execute(
+            'DELETE FROM email_markers WHERE email = ? AND owner_id = ?', (email, customer_id)))
+
+    def put_customer(self, customer_id, email):
+        def put(conn):
+            old = conn.execute('SELECT customer_id, email, version, disbursement_shards, disbursement_shards_max '
+                               'FROM customers WHERE customer_id = ?', (customer_id,)).fetchone()
+            conn.execute('INSERT INTO customers (customer_id, email, version) VALUES (?, ?, 1) '
+                         'ON CONFLICT (customer_id) DO UPDATE SET email = excluded.email, version = version + 1',
+                         (customer_id, email))
+            return _customer_row(old) if old else {}
+        return self._write(put)
+
+    def get_customer(self, customer_id):
+        rows = self._read('SELECT customer_id, email, version, disbursement_shards, disbursement_shards_max '
+                          'FROM customers WHERE customer_id = ?', (customer_id,))
+        return _customer_row(rows[0]) if rows else None
+
+    def get_customers(self, customer_ids):
+        found = {}
+        for i in range(0, len(customer_ids), SQLITE_MAX_IN):
+            chunk = customer_ids[i:i + SQLITE_MAX_IN]
+            rows = self._read('SELECT customer_id, email, version, disbursement_shards, disbursement_shards_max '
+                              'FROM customers WHERE customer_id IN (SELECT value FROM json_each(?))',
+                              (_json_list(chunk),))
+            for row in rows:
+                found[row[0]] = _customer_row(row)
+        return found, []
+
+    def customers_by_email(self, email):
+        rows = self._read('SELECT customer_id, email, version, disbursement_shards, disbursement_shards_max '
+                          'FROM customers WHERE email = ?', (email,))
+        return [_customer_row(row) for row in rows]
+
+    def put_payments(self, records, notifications=()):
+        rows = [tuple(None if record.get(k) is None else str(record[k]) if k == 'amount' else record[k]
+                      for k in PAYMENT_COLUMNS)
+                for record in records]
+        outbox = [(n['notification_id'], json.dumps(n, default=str), float(n.get('next_attempt_at', 0)))
+                  for n in notifications]
+
+        # the whole batch, notifications included, is one transaction and one fsync at checkpoint time
+        def put(conn):
+            if not outbox:
+                conn.executemany(f"INSERT OR REPLACE INTO disbursements ({', '.join(PAYMENT_COLUMNS)}) "
+                                 f"VALUES ({', '.join('?' * len(PAYMENT_COLUMNS))})", rows)
+                return
+            # a notification only comes with a new record, see Storage.put_payments
+            for row, notification in zip(rows, outbox):
+                if conn.execute(f"INSERT OR IGNORE INTO disbursements ({', '.join(PAYMENT_COLUMNS)}) "
+                                f"VALUES ({', '.join('?' * len(PAYMENT_COLUMNS))})", row).rowcount:
+                    conn.execute('INSERT OR REPLACE INTO notification_outbox (notification_id, body, next_attempt_at) '
+                                 'VALUES (?, ?, ?)', notification)
+        self._write(put)
+
+    def payment_history(self, customer_id, customer_item):
+        rows = self._read(f"SELECT {', '.join(PAYMENT_COLUMNS)} FROM disbursements "
+                          f"WHERE customer_id IN (SELECT value FROM json_each(?)) ORDER BY payment_id",
+                          (_json_list(disbursement_read_keys(customer_id, customer_item)),))
+        payments = [_payment_row(row) for row in rows]
+        for payment in payments:
+            payment['customer_id'] = customer_id
+        return payments
+
+    def add_payout(self, customer_id, payment_id, amount, currency):
+        def add(conn):
+            conn.execute('INSERT INTO payout_summaries (customer_id, payment_count, last_payment_at) VALUES (?, 1, ?) '
+                         'ON CONFLICT (customer_id) DO UPDATE SET payment_count = payment_count + 1, '
+                         'last_payment_at = excluded.last_payment_at', (customer_id, payment_id))
+            # totals are summed as Decimal in Python, SQLite REAL would round them
+            row = conn.execute('SELECT count, total FROM payout_totals WHERE customer_id = ? AND currency = ?',
+                               (customer_id, currency)).fetchone()
+            count, total = (row[0], Decimal(row[1])) if row else (0, Decimal(0))
+            conn.execute('INSERT OR REPLACE INTO payout_totals (customer_id, currency, count, total) VALUES (?, ?, ?, ?)',
+                         (customer_id, currency, count + 1, str(total + Decimal(str(amount)))))
+        self._write(add)
+
+    def get_payout_summary(self, customer_id):
+        summary = self._read('SELECT payment_count, last_payment_at FROM payout_summaries WHERE customer_id = ?',
+                             (customer_id,))
+        if not summary:
+            return {}
+        item = {'customer_id': customer_id, 'payment_count': summary[0][0], 'last_payment_at': summary[0][1]}
+        for currency, count, total in self._read(
+                'SELECT currency, count, total FROM payout_totals WHERE customer_id = ?', (customer_id,)):
+            item[f'count_{currency}'] = count
+            item[f'total_{currency}'] = Decimal(total)
+        return item
+
+    def pending_notifications(self, limit, now):
+        rows = self._read('SELECT body, attempts, next_attempt_at FROM notification_outbox '
+                          'WHERE pending = 1 AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?', (now, limit))
+        notifications = []
+        for body, attempts, next_attempt_at in rows:
+            notification = json.loads(body)
+            notification['attempts'] = attempts
+            notification['next_attempt_at'] = next_attempt_at
+            notifications.append(notification)
+        return notifications
+
+    def complete_notifications(self, notification_ids):
+        self._write(lambda conn: conn.execute(
+            'DELETE FROM notification_outbox WHERE notification_id IN (SELECT value FROM json_each(?))',
+            (_json_list(notification_ids),)))
+
+    def reschedule_notification(self, notification_id, attempts, next_attempt_at):
+        self._write(lambda conn: conn.execute(
+            'UPDATE notification_outbox SET attempts = ?, next_attempt_at = ?, pending = ? WHERE notification_id = ?',
+            (attempts, next_attempt_at, 0 if next_attempt_at is None else 1, notification_id)))
+
+    def check(self):
+        self._read('SELECT 1')
+
+
+def _json_list(values):
+    return json.dumps(list(values))
+
+
+def storage_from_env(dynamodb, environ=os.environ):
+    backend = environ.get('STORAGE_BACKEND', 'dynamodb')
+    if backend == 'dynamodb':
+        return DynamoDBStorage(dynamodb)
+    if backend == 'sqlite':
+        return SQLiteStorage(environ.get('STORAGE_SQLITE_PATH', 'paymentApp.db'))
+    raise ValueError(f"STORAGE_BACKEND must be dynamodb or sqlite, not {backend}")
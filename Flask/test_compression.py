@@ -0,0 +1,135 @@
+# run: pytest -v
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+from flask import Flask, jsonify
+
+import compression
+import response_encoding
+from compression import install_compression, jsonify_encoder
+from response_encoding import accepted_encoding, json_chunks
+from storage import SQLiteStorage
+
+
+class TestAcceptEncoding(unittest.TestCase):
+
+    def test_negotiation(self):
+        with patch.object(response_encoding, 'brotli', None):
+            self.assertEqual(accepted_encoding('gzip, deflate, br'), 'gzip')
+            self.assertIsNone(accepted_encoding('br'))
+        with patch.object(response_encoding, 'brotli', object()):
+            self.assertEqual(accepted_encoding('gzip, deflate, br'), 'br')
+            self.assertEqual(accepted_encoding('br;q=0.5, gzip'), 'gzip')
+            self.assertEqual(accepted_encoding('*'), 'br')
+            self.assertEqual(accepted_encoding('*, br;q=0'), 'gzip')
+        self.assertIsNone(accepted_encoding(None))
+        self.assertIsNone(accepted_encoding('identity'))
+        self.assertIsNone(accepted_encoding('gzip;q=0'))
+
+    def test_json_chunks_match_jsonify(self):
+        app = Flask(__name__)
+        obj = {'payments': [{'b': Decimal('10.50'), 'a': 'x'}, {'a': 'é'}], 'customer_id': 'c', 'empty': []}
+        with app.app_context():
+            expected = jsonify(obj).get_data(as_text=True)
+            self.assertEqual(''.join(json_chunks(obj, jsonify_encoder())), expected.strip())
+
+
+class TestCompressedResponses(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        install_compression(self.app, {'RESPONSE_COMPRESSION_MIN_BYTES': '100'})
+
+        @self.app.route('/big')
+        def big():
+            response = jsonify({'rows': ['row'] * 100})
+            response.set_etag('v1')
+            return response
+
+        @self.app.route('/small')
+        def small():
+            return jsonify({'ok': True})
+
+        @self.app.route('/stream/<int:rows>')
+        def stream(rows):
+            return compression.stream_json({'rows': [{'n': i} for i in range(rows)]})
+
+    def test_after_request_hook(self):
+        with self.app.test_client() as client:
+            big = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+            small = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+            plain = client.get('/big')
+
+        self.assertEqual(big.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(big.data)), {'rows': ['row'] * 100})
+        self.assertEqual(big.headers['ETag'], 'W/"v1"')
+        self.assertIn('Accept-Encoding', big.headers['Vary'])
+        self.assertNotIn('Content-Encoding', small.headers)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.headers['ETag'], '"v1"')
+
+    def test_stream_json(self):
+        with self.app.test_client() as client:
+            streamed = client.get('/stream/5000', headers={'Accept-Encoding': 'gzip'})
+            plain = client.get('/stream/5000')
+            small = client.get('/stream/1', headers={'Accept-Encoding': 'gzip'})
+
+        expected = {'rows': [{'n': i} for i in range(5000)]}
+        self.assertTrue(streamed.is_streamed)
+        self.assertNotIn('Content-Length', streamed.headers)
+        self.assertEqual(streamed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(streamed.data)), expected)
+        self.assertEqual(plain.json, expected)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(small.json, {'rows': [{'n': 0}]})
+        self.assertNotIn('Content-Encoding', small.headers)
+
+    @unittest.skipIf(response_encoding.brotli is None, 'brotli not installed')
+    def test_brotli(self):
+        with self.app.test_client() as client:
+            response = client.get('/stream/5000', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(len(json.loads(response_encoding.brotli.decompress(response.data))['rows']), 5000)
+
+    def test_disabled(self):
+        app = Flask(__name__)
+        self.assertFalse(install_compression(app, {'RESPONSE_COMPRESSION': '0'}))
+
+
+class TestPaymentHistoryResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = SQLiteStorage(os.path.join(self.dir, 'test.db'))
+        self.storage.put_customer('vetagaadu3', 'vetagaadu3@example.com')
+        self.storage.put_payments([{
+            'customer_id': 'vetagaadu3', 'payment_id': f'2024-01-01T00:00:{i:02d}.{i:06d}Z', 'email': 'vetagaadu3@example.com',
+            'amount': Decimal('10.50'), 'currency': 'USD', 'payment_method': 'paypal', 'status': 'Completed',
+            'time_bucket': '2024-01-01T00#0'} for i in range(60)])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_history_is_compressed(self):
+        import paymentApp
+        with patch.object(paymentApp, 'storage', self.storage):
+            with paymentApp.paymentApp.test_client() as client:
+                compressed = client.get('/v1/api/payment/vetagaadu3', headers={'Accept-Encoding': 'gzip'})
+                plain = client.get('/v1/api/payment/vetagaadu3')
+
+        self.assertEqual(compressed.status_code, 200)
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        body = json.loads(gzip.decompress(compressed.data))
+        self.assertEqual(body, plain.json)
+        self.assertEqual(len(body['payments']), 60)
+        self.assertLess(len(compressed.data), len(plain.data) / 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+# run: pytest -v
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from journal import Journal, JournalError, read_records, segment_name
+
+
+def record(i):
+    return {'customer_id': f'cust{i % 3}', 'payment_id': f'2024-01-01T00:00:{i:06d}Z', 'amount': i}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.written = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_batch(self, records):
+        self.written.extend(records)
+
+    def test_append_and_flush(self):
+        journal = Journal(self.dir, segment_size=64 * 1024)
+        journal.start_flusher(self.write_batch)
+        for i in range(100):
+            journal.append(record(i))
+
+        wait_for(lambda: len(self.written) == 100)
+        self.assertEqual([r['amount'] for r in self.written], list(range(100)))
+        wait_for(lambda: journal.backlog() == 0)
+        journal.close()
+
+    def test_replay_after_restart(self):
+        # nothing drained: the process died before the flusher ran
+        journal = Journal(self.dir)
+        for i in range(10):
+            journal.append(record(i))
+        journal.close()
+
+        journal = Journal(self.dir)
+        self.assertEqual(journal.path, os.path.join(self.dir, 'slot-0'))
+        self.assertEqual(journal.backlog(), 10)
+        journal.start_flusher(self.write_batch)
+        wait_for(lambda: len(self.written) == 10)
+        journal.close()
+
+        # drained records are not replayed again
+        journal = Journal(self.dir)
+        self.assertEqual(journal.backlog(), 0)
+        journal.close()
+
+    def test_torn_record_ends_segment(self):
+        journal = Journal(self.dir)
+        for i in range(3):
+            journal.append(record(i))
+        path = os.path.join(journal.path, segment_name(journal.seq))
+        end = journal.offset
+        journal.close()
+
+        # corrupt the last payload byte, as if the crash hit the middle of a write
+        with open(path, 'r+b') as f:
+            f.seek(end - 1)
+            f.write(b'X')
+
+        self.assertEqual([r['amount'] for r, _ in read_records(path, 0)], [0, 1])
+
+    def test_slots_per_process(self):
+        first = Journal(self.dir)
+        second = Journal(self.dir)
+        self.assertNotEqual(first.path, second.path)
+        first.close()
+        # a released slot is reused
+        third = Journal(self.dir)
+        self.assertEqual(third.path, first.path)
+        second.close()
+        third.close()
+
+    def test_segment_rotation(self):
+        journal = Journal(self.dir, segment_size=1024)
+        for i in range(100):
+            journal.append(record(i))
+        self.assertGreater(journal.seq, 1)
+        journal.start_flusher(self.write_batch)
+
+        wait_for(lambda: len(self.written) == 100)
+        self.assertEqual(sorted(r['amount'] for r in self.written), list(range(100)))
+        # drained segments are removed
+        wait_for(lambda: len(journal._segments()) == 1)
+        journal.close()
+
+        with self.assertRaises(JournalError):
+            journal.append(record(0))
+
+    def test_flusher_retries_failed_writes(self):
+        failures = [2]
+
+        def flaky(records):
+            if failures[0]:
+                failures[0] -= 1
+                raise Exception("ProvisionedThroughputExceededException")
+            self.written.extend(records)
+
+        journal = Journal(self.dir)
+        journal.start_flusher(flaky)
+        journal.append(record(1))
+        wait_for(lambda: len(self.written) == 1)
+        journal.close()
+
+    def test_close_stops_retrying_flusher(self):
+        def down(records):
+            raise Exception("ServiceUnavailable")
+
+        journal = Journal(self.dir)
+        journal.start_flusher(down)
+        journal.append(record(1))
+        journal.close(timeout=0.1)
+
+        # the flusher is gone, so the slot is free and the record waits there for replay
+        self.assertFalse(journal.flusher.is_alive())
+        replay = Journal(self.dir)
+        self.assertEqual(replay.path, journal.path)
+        self.assertEqual(replay.backlog(), 1)
+        replay.close()
+
+    def test_close_keeps_slot_of_stuck_flusher(self):
+        calls = threading.Event()
+        release = threading.Event()
+
+        def stuck(records):
+            calls.set()
+            release.wait()
+
+        journal = Journal(self.dir)
+        journal.start_flusher(stuck)
+        journal.append(record(1))
+        calls.wait(5)
+        with patch('journal.CLOSE_STOP_TIMEOUT', 0.1):
+            journal.close(timeout=0.1)
+
+        # still inside the storage call: nobody else may drain the slot meanwhile
+        other = Journal(self.dir)
+        self.assertNotEqual(other.path, journal.path)
+        other.close()
+        release.set()
+        journal.flusher.join(5)
+        self.assertFalse(journal.flusher.is_alive())
+        journal.lock_file.close()
+
+    def test_bad_record_is_dead_lettered(self):
+        def rejects_bad(records):
+            if any(r['payment_id'] == 'bad' for r in records):
+                raise Exception("ValidationException")
+            self.written.extend(records)
+
+        journal = Journal(self.dir, max_attempts=2)
+        journal.append(record(1))
+        journal.append({'customer_id': 'cust1', 'payment_id': 'bad'})
+        journal.append(record(2))
+        journal.start_flusher(rejects_bad)
+
+        wait_for(lambda: journal.backlog() == 0)
+        self.assertEqual([r['amount'] for r in self.written], [1, 2])
+        self.assertEqual(journal.dead_lettered, 1)
+        with open(os.path.join(journal.path, 'dead-letter.ndjson')) as f:
+            dead = [json.loads(line) for line in f]
+        self.assertEqual(dead, [{'record': {'customer_id': 'cust1', 'payment_id': 'bad'},
+                                 'error': 'ValidationException'}])
+
+        # the journal keeps draining after it
+        journal.append(record(3))
+        wait_for(lambda: len(self.written) == 3)
+        journal.close()
+
+    def test_outage_dead_letters_nothing(self):
+        calls = []
+
+        def down(records):
+            calls.append(len(records))
+            raise Exception("EndpointConnectionError")
+
+        journal = Journal(self.dir, max_attempts=2)
+        for i in range(5):
+            journal.append(record(i))
+        journal.start_flusher(down)
+
+        # batch, batch, then at most ISOLATE_OUTAGE_FAILURES single records
+        wait_for(lambda: len(calls) >= 6)
+        journal.close(timeout=0)
+        self.assertEqual(journal.dead_lettered, 0)
+        self.assertFalse(os.path.exists(os.path.join(journal.path, 'dead-letter.ndjson')))
+        self.assertEqual(calls[:5], [5, 5, 1, 1, 1])
+
+    def test_concurrent_appends(self):
+        journal = Journal(self.dir)
+        journal.start_flusher(self.write_batch)
+
+        def append(t):
+            for i in range(50):
+                journal.append({'customer_id': f'cust{t}', 'payment_id': str(i)})
+
+        threads = [threading.Thread(target=append, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        wait_for(lambda: len(self.written) == 200)
+        self.assertEqual(len({(r['customer_id'], r['payment_id']) for r in self.written}), 200)
+        journal.close()
+
+    def test_from_env(self):
+        self.assertIsNone(Journal.from_env({}))
+        journal = Journal.from_env({'DISBURSEMENT_JOURNAL_DIR': self.dir, 'DISBURSEMENT_JOURNAL_SEGMENT_MB': '1',
+                                    'DISBURSEMENT_JOURNAL_MAX_ATTEMPTS': '3'})
+        self.assertEqual(journal.segment_size, 1024 * 1024)
+        self.assertEqual(journal.max_attempts, 3)
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
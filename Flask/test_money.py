@@ -0,0 +1,76 @@
+# run: pytest -v
+import json
+import os
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from money import CURRENCY_EXPONENTS, minor_units_decimal, minor_units_str, to_minor_units
+
+
+class TestMinorUnits(unittest.TestCase):
+
+    def test_exponents_cover_the_api_currencies(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'schemas', 'payments_request.json')) as f:
+            schema = json.load(f)
+        self.assertEqual(set(CURRENCY_EXPONENTS), set(schema['properties']['currency']['enum']))
+
+    def test_to_minor_units(self):
+        for amount, currency, minor in [(10, 'USD', 1000), (10.5, 'EUR', 1050), (10.15, 'USD', 1015),
+                                        ('10.50', 'GBP', 1050), ('10', 'USD', 1000), ('5', 'USD', 500),
+                                        ('10.500', 'USD', 1050), ('-0.05', 'INR', -5), ('1.5 ', 'USD', 150),
+                                        (Decimal('99.99'), 'USD', 9999), (100.0, 'JPY', 100), ('1e3', 'JPY', 1000),
+                                        (1000000, 'JPY', 1000000)]:
+            self.assertEqual(to_minor_units(amount, currency), minor, (amount, currency))
+
+    def test_refused(self):
+        with self.assertRaisesRegex(ValueError, 'at most 2 decimals in USD'):
+            to_minor_units(10.155, 'USD')
+        with self.assertRaisesRegex(ValueError, 'at most 2 decimals in USD'):
+            to_minor_units('0.001', 'USD')
+        with self.assertRaisesRegex(ValueError, 'whole number of JPY'):
+            to_minor_units(100.5, 'JPY')
+        for amount in [float('nan'), float('inf'), 'NaN', 'x', '', True]:
+            with self.assertRaisesRegex(ValueError, 'not a number'):
+                to_minor_units(amount, 'USD')
+        with self.assertRaisesRegex(ValueError, 'unknown currency'):
+            to_minor_units(10, 'XXX')
+
+    def test_formatting(self):
+        self.assertEqual(minor_units_str(1050, 'USD'), '10.50')
+        self.assertEqual(minor_units_str(-5, 'USD'), '-0.05')
+        self.assertEqual(minor_units_str(1000, 'JPY'), '1000')
+        self.assertEqual(minor_units_decimal(1050, 'USD'), Decimal('10.50'))
+        self.assertEqual(str(minor_units_decimal(1050, 'USD')), '10.50')
+        self.assertEqual(minor_units_decimal(1000, 'JPY'), Decimal(1000))
+
+
+class TestPaymentAmounts(unittest.TestCase):
+
+    @patch('paymentApp.get_journal', return_value=None)
+    @patch('paymentApp.get_access_token', return_value='token')
+    @patch('paymentApp.storage')
+    @patch('requests.post')
+    def test_payment_amounts(self, mock_post, mock_storage, mock_token, mock_journal):
+        import paymentApp
+        mock_storage.get_customer.return_value = {'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@example.com'}
+        mock_post.return_value = MagicMock(status_code=201, text='{"id": "PAYID-1"}')
+        body = {'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@example.com', 'amount': 100.5, 'currency': 'USD'}
+
+        with paymentApp.paymentApp.test_client() as client:
+            paid = client.post('/v1/api/payments', json=body)
+            yen = client.post('/v1/api/payments', json=dict(body, currency='JPY'))
+
+        self.assertEqual(paid.status_code, 200)
+        self.assertEqual(mock_post.call_args.kwargs['json']['transactions'][0]['amount'],
+                         {'total': '100.50', 'currency': 'USD'})
+        self.assertEqual(mock_storage.put_payment.call_args.args[0]['amount'], '100.50')
+        self.assertEqual(mock_storage.add_payout.call_args.args[2:], (Decimal('100.50'), 'USD'))
+        # refused before PayPal is called
+        self.assertEqual(yen.status_code, 400)
+        self.assertEqual(yen.json['errors'], ['amount: must be a whole number of JPY'])
+        self.assertEqual(mock_post.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
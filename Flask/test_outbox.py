@@ -0,0 +1,240 @@
+# run: pytest -v
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from botocore.exceptions import ClientError
+
+import outbox
+from outbox import LocalSink, SnsSink, WebhookSink, dispatch_once, payment_notification, sink_from_env
+from storage import DynamoDBStorage, SQLiteStorage, StorageError
+
+
+def payment_record(customer_id='cust1', payment_id='2024-01-01T00:00:00Z'):
+    return {
+        'customer_id': customer_id,
+        'payment_id': payment_id,
+        'email': 'cust1@example.com',
+        'amount': 100.0,
+        'payment_method': 'paypal',
+        'status': 'Completed',
+        'currency': 'USD',
+        'time_bucket': '2024-01-01T00#0'
+    }
+
+
+def _raise(error):
+    raise error
+
+
+class FailingSink:
+    batch_size = 10
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.sent = []
+
+    def send(self, notifications):
+        if self.fail is None:
+            raise Exception("sink down")
+        self.sent.extend(n['notification_id'] for n in notifications if n['notification_id'] not in self.fail)
+        return set(self.fail) & {n['notification_id'] for n in notifications}
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = SQLiteStorage(os.path.join(self.dir, 'test.db'))
+        self.sink_path = os.path.join(self.dir, 'notifications.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sent(self):
+        with open(self.sink_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_payment_notification(self):
+        notification = payment_notification(payment_record('cust1#2'))
+
+        # shard suffix dropped from the payee, kept in the id which must match the payment's key
+        self.assertEqual(notification['customer_id'], 'cust1')
+        self.assertEqual(notification['notification_id'], 'cust1#2|2024-01-01T00:00:00Z')
+        self.assertEqual(notification['message'], 'Payment of 100.0 USD has been processed via paypal for payee cust1.')
+
+    def test_stored_with_payment_and_dispatched(self):
+        records = [payment_record(payment_id=f'2024-01-01T00:00:0{i}Z') for i in range(3)]
+        self.storage.put_payments(records, [payment_notification(r) for r in records])
+        self.storage.put_payment(payment_record('cust2'), payment_notification(payment_record('cust2')))
+
+        self.assertEqual(dispatch_once(self.storage, LocalSink(self.sink_path), now=1000), (4, 0))
+
+        sent = self.sent()
+        self.assertEqual(len(sent), 4)
+        self.assertNotIn('attempts', sent[0])
+        # delivered notifications leave the outbox
+        self.assertEqual(self.storage.pending_notifications(100, 1000), [])
+        self.assertEqual(dispatch_once(self.storage, LocalSink(self.sink_path), now=1000), (0, 0))
+
+    def test_replayed_payment_is_not_notified_again(self):
+        records = [payment_record(payment_id=f'2024-01-01T00:00:0{i}Z') for i in range(2)]
+        self.storage.put_payments(records[:1], [payment_notification(records[0])])
+        self.assertEqual(dispatch_once(self.storage, LocalSink(self.sink_path), now=1000), (1, 0))
+
+        # the journal replays a batch with the sent payment in it
+        self.storage.put_payments(records, [payment_notification(r) for r in records])
+
+        self.assertEqual([n['payment_id'] for n in self.storage.pending_notifications(100, 1000)],
+                         ['2024-01-01T00:00:01Z'])
+        self.assertEqual(len(self.storage.payment_history('cust1', {})), 2)
+
+    def test_payment_without_notification(self):
+        self.storage.put_payment(payment_record())
+        self.assertEqual(self.storage.pending_notifications(100, 1000), [])
+
+    def test_retry_and_park(self):
+        self.storage.put_payment(payment_record(), payment_notification(payment_record()))
+        sink = FailingSink()
+
+        self.assertEqual(dispatch_once(self.storage, sink, now=1000), (0, 1))
+        pending = self.storage.pending_notifications(100, 10 ** 9)
+        self.assertEqual(pending[0]['attempts'], 1)
+        self.assertGreaterEqual(pending[0]['next_attempt_at'], 1000)
+
+        # retries are at most RETRY_CAP apart, move the clock past each one
+        now = 1000
+        for _ in range(outbox.MAX_ATTEMPTS - 1):
+            now += outbox.RETRY_CAP + 1
+            self.assertEqual(dispatch_once(self.storage, sink, now=now), (0, 1))
+        # parked for good after MAX_ATTEMPTS
+        self.assertEqual(self.storage.pending_notifications(100, 10 ** 10), [])
+
+    def test_partial_batch_failure(self):
+        records = [payment_record(payment_id=f'2024-01-01T00:00:0{i}Z') for i in range(3)]
+        self.storage.put_payments(records, [payment_notification(r) for r in records])
+        sink = FailingSink(fail={'cust1|2024-01-01T00:00:01Z'})
+
+        self.assertEqual(dispatch_once(self.storage, sink, now=1000), (2, 1))
+        self.assertEqual([n['notification_id'] for n in self.storage.pending_notifications(100, 10 ** 9)],
+                         ['cust1|2024-01-01T00:00:01Z'])
+
+    def test_sns_sink(self):
+        client = MagicMock()
+        notifications = [payment_notification(payment_record(payment_id=str(i))) for i in range(3)]
+        failed_id = outbox.dedupe_id(notifications[1])
+        client.publish_batch.return_value = {'Failed': [{'Id': failed_id}]}
+
+        sink = SnsSink('arn:aws:sns:us-east-2:123:payments.fifo', client)
+        self.assertEqual(sink.send(notifications), {notifications[1]['notification_id']})
+
+        entries = client.publish_batch.call_args.kwargs['PublishBatchRequestEntries']
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(entries[1]['MessageDeduplicationId'], failed_id)
+        self.assertEqual(entries[1]['MessageGroupId'], 'cust1')
+
+    def test_webhook_sink(self):
+        session = MagicMock()
+        session.post.return_value = MagicMock(status_code=503)
+        notifications = [payment_notification(payment_record(payment_id=str(i))) for i in range(2)]
+        sink = WebhookSink('https://hooks.example.com/payments', session)
+
+        self.assertEqual(sink.send(notifications), {n['notification_id'] for n in notifications})
+        session.post.return_value = MagicMock(status_code=202)
+        self.assertEqual(sink.send(list(reversed(notifications))), set())
+
+        # the same batch carries the same key, whatever its order
+        keys = [c.kwargs['headers']['Idempotency-Key'] for c in session.post.call_args_list]
+        self.assertEqual(keys[0], keys[1])
+
+    def test_sink_from_env(self):
+        self.assertIsInstance(sink_from_env({}), LocalSink)
+        with self.assertRaises(ValueError):
+            sink_from_env({'NOTIFICATION_SINK': 'pager'})
+
+
+class TestDynamoDBOutbox(unittest.TestCase):
+
+    def test_put_payment_with_notification_is_one_transaction(self):
+        dynamodb = MagicMock()
+        storage = DynamoDBStorage(lambda: dynamodb)
+
+        storage.put_payment(payment_record(), payment_notification(payment_record()))
+
+        items = dynamodb.meta.client.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual([item['Put']['TableName'] for item in items], ['Disbursements', 'NotificationOutbox'])
+        self.assertEqual(items[0]['Put']['ConditionExpression'], 'attribute_not_exists(payment_id)')
+        self.assertEqual(items[1]['Put']['Item']['pending'], {'N': '1'})
+        dynamodb.Table.return_value.put_item.assert_not_called()
+
+    def test_reschedule_only_notifications_still_in_outbox(self):
+        dynamodb = MagicMock()
+        storage = DynamoDBStorage(lambda: dynamodb)
+        update = dynamodb.Table.return_value.update_item
+
+        for next_attempt_at in (1060.0, None):
+            storage.reschedule_notification('cust1|p1', 2, next_attempt_at)
+            self.assertEqual(update.call_args.kwargs['ConditionExpression'], 'attribute_exists(notification_id)')
+
+        # sent and deleted by another dispatcher meanwhile: nothing to do
+        update.side_effect = ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'gone'}},
+                                         'UpdateItem')
+        storage.reschedule_notification('cust1|p1', 3, 1120.0)
+        update.side_effect = ClientError({'Error': {'Code': 'InternalServerError', 'Message': 'down'}}, 'UpdateItem')
+        with self.assertRaises(StorageError):
+            storage.reschedule_notification('cust1|p1', 3, 1120.0)
+
+    def test_put_payments_with_notifications_one_transaction_each(self):
+        dynamodb = MagicMock()
+        storage = DynamoDBStorage(lambda: dynamodb)
+        records = [payment_record(payment_id=f'2024-01-01T00:00:0{i}Z') for i in range(3)]
+        # the second payment is a replay, stored with its notification the first time
+        replayed = ClientError({'Error': {'Code': 'TransactionCanceledException', 'Message': 'cancelled'},
+                                'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]},
+                               'TransactWriteItems')
+        dynamodb.meta.client.transact_write_items.side_effect = \
+            lambda TransactItems: _raise(replayed) if '01Z' in TransactItems[0]['Put']['Item']['payment_id']['S'] else {}
+
+        storage.put_payments(records, [payment_notification(r) for r in records])
+
+        calls = dynamodb.meta.client.transact_write_items.call_args_list
+        self.assertEqual(sorted(c.kwargs['TransactItems'][1]['Put']['Item']['notification_id']['S'] for c in calls),
+                         [f'cust1|2024-01-01T00:00:0{i}Z' for i in range(3)])
+        dynamodb.Table.return_value.batch_writer.assert_not_called()
+
+        # any other failure is the batch's, the journal retries it
+        dynamodb.meta.client.transact_write_items.side_effect = ClientError(
+            {'Error': {'Code': 'TransactionCanceledException', 'Message': 'throttled'},
+             'CancellationReasons': [{'Code': 'ThrottlingError'}, {'Code': 'None'}]}, 'TransactWriteItems')
+        with self.assertRaises(StorageError):
+            storage.put_payments(records, [payment_notification(r) for r in records])
+
+
+class TestPaymentAppNotifications(unittest.TestCase):
+
+    @patch('paymentApp.get_access_token')
+    @patch('requests.post')
+    def test_process_payment_writes_outbox(self, mock_post, mock_get_token):
+        import paymentApp
+        with tempfile.TemporaryDirectory() as d:
+            storage = SQLiteStorage(os.path.join(d, 'app.db'))
+            storage.put_customer('customer1', 'cust1@example.com')
+            mock_get_token.return_value = 'token'
+            mock_post.return_value = MagicMock(status_code=201, text='{"id": "PAYID-1"}')
+
+            with patch.object(paymentApp, 'storage', storage), patch.object(paymentApp, 'PAYMENT_NOTIFICATIONS', True):
+                with paymentApp.paymentApp.test_client() as client:
+                    response = client.post('/v1/api/payments', json={
+                        'customer_id': 'customer1', 'amount': 25, 'currency': 'USD', 'email': 'cust1@example.com'})
+
+            self.assertEqual(response.status_code, 200)
+            pending = storage.pending_notifications(100, 10 ** 10)
+            self.assertEqual(len(pending), 1)
+            self.assertEqual(pending[0]['email'], 'cust1@example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,14 @@ from flask import Flask
 import boto3
 from botocore.exceptions import ClientError
 from paymentApp import paymentApp, get_access_token
+import paymentApp as paymentAppModule
+import threading
 import os
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+from storage import StorageError
 
 # Mock PayPal sandbox URLs and credentials
 PAYPAL_SANDBOX_URL = "https://api.sandbox.paypal.com"
@@ -17,11 +24,11 @@ class TestCustomerAPI(unittest.TestCase):
 
     @patch('boto3.resource')  # Mocking boto3 resource to avoid actual DynamoDB calls
     def test_add_customer_success(self, mock_boto_resource):
-        # Simulate a successful DynamoDB put_item response
+        # Simulate a successful DynamoDB update_item response
         mock_dynamo_db = MagicMock()
         mock_table = MagicMock()
         mock_dynamo_db.Table.return_value = mock_table
-        mock_table.put_item.return_value = {
+        mock_table.update_item.return_value = {
             'ResponseMetadata': {'HTTPStatusCode': 200}
         }
         mock_boto_resource.return_value = mock_dynamo_db
@@ -62,6 +69,26 @@ class TestCustomerAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json['customer_id'], 'vetagaadu3')
 
+    @patch('boto3.resource')
+    def test_get_customer_etag(self, mock_boto_resource):
+        mock_table = mock_boto_resource.return_value.Table.return_value
+        mock_table.get_item.return_value = {
+            'Item': {'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@abc.com', 'version': 2}
+        }
+
+        with paymentApp.test_client() as client:
+            response = client.get('/v1/api/customer/vetagaadu3')
+            self.assertEqual(response.headers['ETag'], '"v2"')
+            self.assertEqual(response.headers['Cache-Control'], 'max-age=60, must-revalidate')
+
+            # current version: no body
+            response = client.get('/v1/api/customer/vetagaadu3', headers={'If-None-Match': '"v2"'})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            response = client.get('/v1/api/customer/vetagaadu3', headers={'If-None-Match': '"v1"'})
+            self.assertEqual(response.status_code, 200)
+
     @patch('boto3.resource')
     def test_get_customer_not_found(self, mock_boto_resource):
         # Simulate a DynamoDB response with no customer
@@ -87,7 +114,8 @@ class TestCustomerAPI(unittest.TestCase):
 
         # Check the status code and response
         self.assertEqual(response.status_code, 400)
-        self.assertIn('Missing required fields', response.json['error'])
+        self.assertEqual(response.json['error'], 'Invalid request body')
+        self.assertEqual(response.json['errors'], ['customer_id: is required'])
 
     @patch('boto3.resource')
     def test_add_customer_dynamodb_error(self, mock_boto_resource):
@@ -111,6 +139,93 @@ class TestCustomerAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 500)
         self.assertIn('Error occurred', response.json['error'])
 
+    @patch('boto3.resource')
+    def test_add_customer_email_taken(self, mock_boto_resource):
+        # Simulate the email marker being owned by another customer
+        mock_dynamo_db = MagicMock()
+        mock_table = MagicMock()
+        mock_dynamo_db.Table.return_value = mock_table
+        mock_table.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}}, 'PutItem'
+        )
+        mock_boto_resource.return_value = mock_dynamo_db
+
+        customer_data = {'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@abc.com'}
+        with paymentApp.test_client() as client:
+            response = client.post('/v1/api/customer/add', json=customer_data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('already registered', response.json['error'])
+
+    @patch('boto3.resource')
+    def test_get_customer_by_email(self, mock_boto_resource):
+        mock_dynamo_db = MagicMock()
+        mock_table = MagicMock()
+        mock_dynamo_db.Table.return_value = mock_table
+        mock_table.query.return_value = {
+            'Items': [{'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@abc.com'}]
+        }
+        mock_boto_resource.return_value = mock_dynamo_db
+
+        with paymentApp.test_client() as client:
+            response = client.get('/v1/api/customer?email=vetagaadu3@abc.com')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['customers'][0]['customer_id'], 'vetagaadu3')
+        self.assertEqual(mock_table.query.call_args.kwargs['IndexName'], 'email-index')
+        mock_table.scan.assert_not_called()
+
+    @patch('paymentApp.time.sleep')
+    @patch('boto3.resource')
+    def test_batch_get_customers(self, mock_boto_resource, mock_sleep):
+        mock_client = mock_boto_resource.return_value.meta.client
+        retried = []
+
+        def batch_get_item(RequestItems):
+            keys = RequestItems['Customers']['Keys']
+            self.assertLessEqual(len(keys), 100)
+            ids = [k['customer_id']['S'] for k in keys]
+            resp = {'Responses': {'Customers': [{'customer_id': {'S': i}, 'email': {'S': f'{i}@abc.com'}}
+                                                for i in ids if i != 'vetagaadu149']}}
+            # the first attempt of the first chunk is throttled on its last key
+            if not retried and 'vetagaadu099' in ids:
+                retried.append('vetagaadu099')
+                resp['Responses']['Customers'] = resp['Responses']['Customers'][:-1]
+                resp['UnprocessedKeys'] = {'Customers': {'Keys': keys[-1:]}}
+            return resp
+        mock_client.batch_get_item.side_effect = batch_get_item
+
+        ids = [f'vetagaadu{i:03d}' for i in range(150)]
+        with paymentApp.test_client() as client:
+            response = client.post('/v1/api/customers:batchGet', json={'customer_ids': ids + ids[:10]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['customer_id'] for c in response.json['customers']], ids[:149])
+        self.assertEqual(response.json['missing'], ['vetagaadu149'])
+        self.assertEqual(mock_client.batch_get_item.call_count, 3)
+
+        with paymentApp.test_client() as client:
+            response = client.post('/v1/api/customers:batchGet', json={'customer_ids': []})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('boto3.resource')
+    def test_get_payout_summary(self, mock_boto_resource):
+        mock_dynamo_db = MagicMock()
+        mock_table = MagicMock()
+        mock_dynamo_db.Table.return_value = mock_table
+        mock_table.get_item.return_value = {
+            'Item': {'customer_id': 'vetagaadu3', 'payment_count': 2, 'count_USD': 2, 'total_USD': '20.5'}
+        }
+        mock_boto_resource.return_value = mock_dynamo_db
+
+        with paymentApp.test_client() as client:
+            response = client.get('/v1/api/customer/vetagaadu3/summary')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['payment_count'], 2)
+        self.assertEqual(response.json['totals'], {'USD': '20.5'})
+        mock_dynamo_db.Table.assert_called_with('PayoutSummaries')
+
     @patch('requests.post')
     def test_get_access_token(self, mock_post):
 
@@ -189,6 +304,91 @@ class TestCustomerAPI(unittest.TestCase):
         self.assertTrue(response.is_json)
         self.assertIn("payment successful", response.json['status'])
 
+    @patch('paymentApp.get_journal')
+    @patch('paymentApp.get_access_token')
+    @patch('boto3.resource')
+    @patch('requests.post')
+    def test_process_payment_journaled(self, mock_post, mock_boto_resource, mock_get_token, mock_get_journal):
+        mock_get_token.return_value = "mock_access_token"
+        mock_dynamo_db = MagicMock()
+        mock_boto_resource.return_value = mock_dynamo_db
+        mock_customer_table = MagicMock()
+        mock_disb_table = MagicMock()
+        mock_dynamo_db.Table.side_effect = lambda table_name: mock_customer_table if table_name == 'Customers' else mock_disb_table
+        mock_customer_table.get_item.return_value = {
+            'Item': {'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@example.com'}
+        }
+        mock_paypal_response = MagicMock()
+        mock_paypal_response.status_code = 201
+        mock_paypal_response.text = '{"id": "PAYID-1"}'
+        mock_post.return_value = mock_paypal_response
+
+        with paymentApp.test_client() as client:
+            response = client.post('/v1/api/payments', json={
+                "customer_id": "vetagaadu3", "amount": 100.0, "currency": "USD", "email": "vetagaadu3@example.com"
+            })
+
+        # the record goes to the journal, its flusher writes Disbursements
+        self.assertEqual(response.status_code, 200)
+        record = mock_get_journal.return_value.append.call_args.args[0]
+        self.assertEqual(record['paypal_payment_id'], 'PAYID-1')
+        # the lambda's payment_id format, both feed the time-bucket-index sort key
+        self.assertTrue(record['payment_id'].endswith('+00:00Z'))
+        mock_disb_table.put_item.assert_not_called()
+        # so does the payout summary, nothing waits on DynamoDB
+        mock_disb_table.update_item.assert_not_called()
+
+        # a journal that cannot write falls back to the direct put
+        mock_get_journal.return_value.append.side_effect = OSError("disk full")
+        with paymentApp.test_client() as client:
+            response = client.post('/v1/api/payments', json={
+                "customer_id": "vetagaadu3", "amount": 100.0, "currency": "USD", "email": "vetagaadu3@example.com"
+            })
+        self.assertEqual(response.status_code, 200)
+        mock_disb_table.put_item.assert_called_once()
+        mock_disb_table.update_item.assert_called_once()
+
+    @patch('paymentApp.storage')
+    def test_open_journal_replays_leftover_records(self, mock_storage):
+        from journal import Journal
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        # a worker that died before its flusher wrote the record
+        crashed = Journal(journal_dir)
+        crashed.append({'customer_id': 'vetagaadu3', 'payment_id': 'p1', 'amount': '10.50', 'currency': 'USD'})
+        crashed.close()
+
+        with patch.dict('os.environ', {'DISBURSEMENT_JOURNAL_DIR': journal_dir}), \
+                patch.object(paymentAppModule, '_journal', None):
+            # the post_fork hook, no payment request comes in
+            journal = paymentAppModule.open_journal()
+            deadline = time.monotonic() + 5
+            while not mock_storage.put_payments.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+            paymentAppModule.close_journal()
+
+        self.assertEqual(mock_storage.put_payments.call_args.args[0][0]['payment_id'], 'p1')
+        self.assertEqual(journal.backlog(), 0)
+
+    @patch('paymentApp.storage')
+    def test_store_payments_adds_payout_summaries(self, mock_storage):
+        records = [{'customer_id': 'vetagaadu3#2', 'payment_id': 'p1', 'amount': '10.50', 'currency': 'USD'},
+                   {'customer_id': 'vetagaadu4', 'payment_id': 'p2', 'amount': '1000', 'currency': 'JPY'}]
+
+        paymentAppModule.store_payments(records)
+
+        mock_storage.put_payments.assert_called_once()
+        # summaries are per customer, not per shard
+        self.assertEqual([c.args for c in mock_storage.add_payout.call_args_list],
+                         [('vetagaadu3', 'p1', Decimal('10.50'), 'USD'), ('vetagaadu4', 'p2', Decimal('1000'), 'JPY')])
+
+        # records that could not be stored count nowhere, the flusher retries them
+        mock_storage.reset_mock()
+        mock_storage.put_payments.side_effect = StorageError('down')
+        with self.assertRaises(StorageError):
+            paymentAppModule.store_payments(records)
+        mock_storage.add_payout.assert_not_called()
+
     @patch('boto3.resource')
     @patch('requests.post')
     def test_process_payment_customer_not_found(self, mock_post, mock_boto_resource):
@@ -207,7 +407,7 @@ class TestCustomerAPI(unittest.TestCase):
 
         # Request data for the payment
         request_data = {
-            "customer_id": "nonexistent_customer",
+            "customer_id": "nonexistent1",
             "amount": 100.0,
             "currency": "USD",
             "email": "nonexistent@example.com"
@@ -255,6 +455,100 @@ class TestCustomerAPI(unittest.TestCase):
         self.assertIn("Error occurred: failed to get PayPal API OAuth token", response.json['error'])
 
 
+class TestProfiling(unittest.TestCase):
+
+    def test_off_by_default(self):
+        from profiling import install_profiling
+        app = Flask('profiling_off')
+        self.assertFalse(install_profiling(app, {}))
+        self.assertEqual(app.before_request_funcs, {})
+
+    def test_profile_on_header(self):
+        import json
+        import tempfile
+        from profiling import install_profiling
+
+        app = Flask('profiling_on')
+
+        @app.route('/work')
+        def work():
+            return {'total': sum(range(10000))}
+
+        with tempfile.TemporaryDirectory() as profile_dir, patch('builtins.print') as mock_print:
+            self.assertTrue(install_profiling(app, {'PROFILE_HEADER': '1', 'PROFILE_DIR': profile_dir}))
+            with app.test_client() as client:
+                client.get('/work')
+                self.assertEqual(os.listdir(profile_dir), [])
+                self.assertEqual(client.get('/work', headers={'X-Profile': '1'}).status_code, 200)
+
+            self.assertEqual(len(os.listdir(profile_dir)), 1)
+            summary = json.loads(mock_print.call_args.args[0])
+            self.assertEqual(summary['profile'], 'GET /work')
+            self.assertEqual(summary['memory_budget_mb'], 128)
+            self.assertTrue(any(':work' in row[0] for row in summary['top']))
+
+
+class TestServing(unittest.TestCase):
+
+    def tearDown(self):
+        paymentAppModule._worker_clients = None
+
+    def test_ready(self):
+        with patch('paymentApp.PAYPAL_SANDBOX_URL', PAYPAL_SANDBOX_URL), \
+             patch('paymentApp.PAYPAL_CLIENT_ID', 'test_client_id'), \
+             patch('paymentApp.PAYPAL_SECRET', 'test_secret'), \
+             patch('boto3.resource'):
+            with paymentApp.test_client() as client:
+                response = client.get('/v1/api/ready')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['status'], 'ready')
+
+    def test_not_ready_without_paypal_config(self):
+        with patch('paymentApp.PAYPAL_SANDBOX_URL', None):
+            with paymentApp.test_client() as client:
+                response = client.get('/v1/api/ready')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('PayPal configuration missing', response.json['error'])
+
+    def test_not_ready_hides_storage_error(self):
+        with patch('paymentApp.PAYPAL_SANDBOX_URL', PAYPAL_SANDBOX_URL), \
+             patch('paymentApp.PAYPAL_CLIENT_ID', 'test_client_id'), \
+             patch('paymentApp.PAYPAL_SECRET', 'test_secret'), \
+             patch('paymentApp.storage') as mock_storage:
+            mock_storage.check.side_effect = Exception('AccessDeniedException on table Customers')
+            with paymentApp.test_client() as client:
+                response = client.get('/v1/api/ready')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json, {'status': 'not ready', 'error': 'storage unavailable'})
+
+    @patch('boto3.session.Session')
+    def test_worker_clients_per_thread(self, mock_session):
+        # each call to Session() hands out a distinct resource
+        mock_session.side_effect = lambda: MagicMock()
+        paymentAppModule.init_worker_clients()
+
+        main_db = paymentAppModule.get_dynamodb()
+        main_http = paymentAppModule.get_http()
+        # same thread reuses its clients
+        self.assertIs(paymentAppModule.get_dynamodb(), main_db)
+        self.assertIs(paymentAppModule.get_http(), main_http)
+
+        other = {}
+        def worker_thread():
+            other['db'] = paymentAppModule.get_dynamodb()
+            other['http'] = paymentAppModule.get_http()
+        t = threading.Thread(target=worker_thread)
+        t.start()
+        t.join()
+
+        # other threads get their own
+        self.assertIsNot(other['db'], main_db)
+        self.assertIsNot(other['http'], main_http)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,216 @@
+# run: pytest -v
+import unittest
+from http.client import RemoteDisconnected
+from unittest.mock import MagicMock
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import providers
+from providers import NoProviderError, PayPalProvider, Provider, ProviderError, Router
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeProvider(Provider):
+
+    def __init__(self, name, currencies=None, error=None):
+        super().__init__(currencies)
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def authorize(self, payment):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return f'{self.name}-{self.calls}'
+
+
+def payment(currency='USD'):
+    return {'customer_id': 'cust1', 'email': 'cust1@example.com', 'amount': 10, 'currency': currency}
+
+
+def outage():
+    return ProviderError("payment failed - connection refused", retryable=True, degraded=True)
+
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_fastest_healthy_provider_first(self):
+        fast, slow = FakeProvider('fast'), FakeProvider('slow')
+        router = Router([slow, fast], clock=self.clock)
+        router.record('slow', 0.400, False)
+        router.record('fast', 0.100, False)
+
+        self.assertEqual(router.choose('USD'), [fast, slow])
+
+        # the average follows the latency: fast slows down past slow
+        for _ in range(20):
+            router.record('fast', 1.0, False)
+        self.assertEqual(router.choose('USD'), [slow, fast])
+
+    def test_currency_allow_list(self):
+        paypal, ach = FakeProvider('paypal', ['USD', 'EUR']), FakeProvider('ach', ['USD'])
+        router = Router([paypal, ach], clock=self.clock)
+
+        self.assertEqual(router.choose('EUR'), [paypal])
+        with self.assertRaises(NoProviderError) as ctx:
+            router.authorize(payment('JPY'))
+        self.assertEqual(ctx.exception.status, 400)
+
+    def test_failover_when_no_payment_was_created(self):
+        down, up = FakeProvider('down', error=outage()), FakeProvider('up')
+        router = Router([down, up], clock=self.clock)
+
+        provider, provider_payment_id = router.authorize(payment())
+
+        self.assertIs(provider, up)
+        self.assertEqual(provider_payment_id, 'up-1')
+        self.assertEqual(down.calls, 1)
+        self.assertEqual(router.stats['down'].consecutive_failures, 1)
+
+    def test_no_failover_on_ambiguous_or_declined(self):
+        timeout = FakeProvider('timeout', error=ProviderError("timed out", status=504, degraded=True))
+        other = FakeProvider('other')
+        router = Router([timeout, other], clock=self.clock)
+        with self.assertRaises(ProviderError):
+            router.authorize(payment())
+        self.assertEqual(other.calls, 0)
+        self.assertEqual(router.stats['timeout'].consecutive_failures, 1)
+
+        # a 5xx may come after the payment was written
+        gateway = FakeProvider('gateway', error=ProviderError("bad gateway", status=502, degraded=True))
+        router = Router([gateway, other], clock=self.clock)
+        with self.assertRaises(ProviderError) as ctx:
+            router.authorize(payment())
+        self.assertEqual(ctx.exception.status, 502)
+        self.assertEqual(other.calls, 0)
+        self.assertEqual(router.stats['gateway'].consecutive_failures, 1)
+
+        # a declined payment is the payer's problem, not the provider's
+        declined = FakeProvider('declined', error=ProviderError("declined", status=400))
+        router = Router([declined, other], clock=self.clock)
+        with self.assertRaises(ProviderError):
+            router.authorize(payment())
+        self.assertEqual(router.stats['declined'].error_rate, 0.0)
+
+    def test_ejection_and_recovery(self):
+        flaky, steady = FakeProvider('flaky'), FakeProvider('steady')
+        router = Router([flaky, steady], clock=self.clock)
+        router.record('flaky', 0.050, False)
+        router.record('steady', 0.200, False)
+
+        for _ in range(providers.MAX_CONSECUTIVE_FAILURES):
+            router.record('flaky', 0.050, True)
+        # ejected: last resort only, even though it is faster
+        self.assertEqual(router.choose('USD'), [steady, flaky])
+
+        # back after EJECT_SECONDS (steady had traffic meanwhile, so no probe)
+        self.clock.now += providers.EJECT_SECONDS + 1
+        router.record('steady', 0.200, False)
+        self.assertEqual(router.choose('USD'), [flaky, steady])
+
+    def test_idle_provider_is_probed(self):
+        fast, slow = FakeProvider('fast'), FakeProvider('slow')
+        router = Router([fast, slow], clock=self.clock)
+        router.record('fast', 0.100, False)
+        router.record('slow', 0.900, False)
+        self.assertEqual(router.choose('USD'), [fast, slow])
+
+        # slow had no traffic for PROBE_SECONDS: it gets one payment, then the order is back
+        self.clock.now += providers.PROBE_SECONDS + 1
+        router.record('fast', 0.100, False)
+        self.assertEqual(router.choose('USD'), [slow, fast])
+        self.assertEqual(router.choose('USD'), [fast, slow])
+
+    def test_only_provider_is_used_even_when_ejected(self):
+        down = FakeProvider('down', error=outage())
+        router = Router([down], clock=self.clock)
+        for _ in range(5):
+            with self.assertRaises(ProviderError):
+                router.authorize(payment())
+        self.assertEqual(down.calls, 5)
+        self.assertTrue(router.snapshot()['down']['ejected'])
+
+
+class TestPayPalProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.http = MagicMock()
+        self.token = MagicMock(return_value='token')
+        self.provider = PayPalProvider('https://api.sandbox.paypal.com', self.token, lambda: self.http)
+
+    def test_authorize(self):
+        self.http.post.return_value = MagicMock(status_code=201, text='{"id": "PAYID-1"}')
+
+        self.assertEqual(self.provider.authorize(payment()), 'PAYID-1')
+
+        body = self.http.post.call_args.kwargs['json']
+        self.assertEqual(body['transactions'][0]['payee'], {'email': 'cust1@example.com'})
+        self.assertEqual(self.http.post.call_args.kwargs['headers']['Authorization'], 'Bearer token')
+
+    def test_errors(self):
+        for status in (500, 502, 503):
+            self.http.post.return_value = MagicMock(status_code=status, text='unavailable')
+            with self.assertRaises(ProviderError) as ctx:
+                self.provider.authorize(payment())
+            self.assertEqual(ctx.exception.status, status)
+            self.assertTrue(ctx.exception.degraded)
+            self.assertFalse(ctx.exception.retryable)
+
+        self.http.post.return_value = MagicMock(status_code=429, text='slow down')
+        with self.assertRaises(ProviderError) as ctx:
+            self.provider.authorize(payment())
+        self.assertTrue(ctx.exception.retryable and ctx.exception.degraded)
+
+        self.http.post.return_value = MagicMock(status_code=400, text='bad payee')
+        with self.assertRaises(ProviderError) as ctx:
+            self.provider.authorize(payment())
+        self.assertEqual(ctx.exception.status, 400)
+        self.assertFalse(ctx.exception.retryable or ctx.exception.degraded)
+
+        # never connected: nothing reached PayPal, another provider may be tried
+        refused = MaxRetryError(None, '/v1/payments/payment', NewConnectionError(None, 'Connection refused'))
+        for error in (requests.exceptions.ConnectionError(refused), requests.exceptions.ConnectTimeout('slow')):
+            self.http.post.side_effect = error
+            with self.assertRaises(ProviderError) as ctx:
+                self.provider.authorize(payment())
+            self.assertTrue(ctx.exception.retryable)
+
+        # dropped after the request went out: PayPal may have authorized it, no failover
+        dropped = ProtocolError('Connection aborted.', RemoteDisconnected('Remote end closed connection'))
+        reset = ProtocolError('Connection aborted.', ConnectionResetError(104, 'Connection reset by peer'))
+        for error in (dropped, reset):
+            self.http.post.side_effect = requests.exceptions.ConnectionError(error)
+            with self.assertRaises(ProviderError) as ctx:
+                self.provider.authorize(payment())
+            self.assertEqual(ctx.exception.status, 504)
+            self.assertFalse(ctx.exception.retryable)
+            self.assertTrue(ctx.exception.degraded)
+
+        self.http.post.side_effect = requests.exceptions.ReadTimeout("slow")
+        with self.assertRaises(ProviderError) as ctx:
+            self.provider.authorize(payment())
+        self.assertEqual(ctx.exception.status, 504)
+        self.assertFalse(ctx.exception.retryable)
+
+    def test_no_token(self):
+        self.token.return_value = None
+        with self.assertRaises(ProviderError) as ctx:
+            self.provider.authorize(payment())
+        self.assertIn('OAuth', str(ctx.exception))
+        self.http.post.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
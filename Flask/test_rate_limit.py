@@ -0,0 +1,91 @@
+#
+# run: pytest -v
+#
+
+import os
+import time
+import unittest
+from unittest.mock import patch
+from rate_limit import RateLimiter, plans_from_env, api_keys_from_env, period_bounds
+import paymentApp as paymentAppModule
+from paymentApp import paymentApp
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def limiter(self, **env):
+        env.setdefault('RATE_LIMIT_API_KEYS', 'key1=basic,key2=premium')
+        return RateLimiter(api_keys_from_env(env), plans_from_env(env), ['get_customer', 'process_payment'])
+
+    def test_plans_mirror_terraform(self):
+        plans = plans_from_env({})
+        self.assertEqual(plans['basic'], {'rate_limit': 5, 'burst_limit': 10, 'quota_limit': 500, 'quota_period': 'MONTH'})
+        self.assertEqual(plans['premium']['burst_limit'], 30)
+        self.assertEqual(plans_from_env({'STANDARD_PLAN_QUOTA_PERIOD': 'day'})['standard']['quota_period'], 'DAY')
+
+    def test_burst_then_refill(self):
+        limiter = self.limiter()
+        results = [limiter.check('key1', 'get_customer') for _ in range(11)]
+        self.assertEqual(results[:10], [0] * 10)
+        # 5 tokens per second, the 11th request waits about 1/5 s
+        self.assertAlmostEqual(results[10], 0.2, delta=0.05)
+
+        # buckets are per route and per key
+        self.assertEqual(limiter.check('key1', 'process_payment'), 0)
+        self.assertEqual(limiter.check('key2', 'get_customer'), 0)
+        self.assertIsNone(limiter.check('unknown', 'get_customer'))
+
+        time.sleep(0.25)
+        self.assertEqual(limiter.check('key1', 'get_customer'), 0)
+
+    def test_quota(self):
+        limiter = self.limiter(BASIC_PLAN_QUOTA_LIMIT='3', BASIC_PLAN_QUOTA_PERIOD='DAY')
+        for route in ['get_customer', 'process_payment', 'get_customer']:
+            self.assertEqual(limiter.check('key1', route), 0)
+        # quota is per key across routes, retry at the next day
+        retry_after = limiter.check('key1', 'process_payment')
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 24 * 3600)
+
+    def test_shared_across_processes(self):
+        limiter = self.limiter()
+        pid = os.fork()
+        if pid == 0:
+            # child spends the whole burst
+            for _ in range(10):
+                limiter.check('key1', 'get_customer')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertGreater(limiter.check('key1', 'get_customer'), 0)
+
+    def test_period_bounds(self):
+        start, end = period_bounds('MONTH', 1706745600.0)  # 2024-02-01T00:00:00Z
+        self.assertEqual((start, end), (1706745600.0, 1709251200.0))
+        start, end = period_bounds('WEEK', 1706745600.0)  # a Thursday
+        self.assertEqual(end - start, 7 * 86400)
+        self.assertLessEqual(start, 1706745600.0)
+
+
+class TestRateLimitedApp(unittest.TestCase):
+
+    def test_429_with_retry_after(self):
+        limiter = RateLimiter({'key1': 'basic'}, plans_from_env({}), paymentApp.view_functions)
+        with patch.object(paymentAppModule, 'rate_limiter', limiter), patch('boto3.resource') as mock_boto_resource:
+            mock_boto_resource.return_value.Table.return_value.get_item.return_value = {
+                'Item': {'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@abc.com'}}
+            with paymentApp.test_client() as client:
+                self.assertEqual(client.get('/v1/api/customer/vetagaadu3').status_code, 403)
+                codes = [client.get('/v1/api/customer/vetagaadu3', headers={'x-api-key': 'key1'}).status_code
+                         for _ in range(10)]
+                self.assertEqual(codes, [200] * 10)
+
+                response = client.get('/v1/api/customer/vetagaadu3', headers={'x-api-key': 'key1'})
+                self.assertEqual(response.status_code, 429)
+                self.assertEqual(response.headers['Retry-After'], '1')
+
+                # the readiness check is never limited
+                self.assertNotIn(client.get('/v1/api/ready').status_code, (403, 429))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+# run: pytest -v
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from storage import DynamoDBStorage, SQLiteStorage, StorageError, disbursement_read_keys, storage_from_env
+
+
+def payment(customer_id, payment_id, amount='10.50', currency='USD'):
+    return {
+        'customer_id': customer_id,
+        'payment_id': payment_id,
+        'email': 'test@example.com',
+        'amount': Decimal(amount),
+        'currency': currency,
+        'payment_method': 'paypal',
+        'status': 'PAYMENT_SUCCESS',
+        'paypal_payment_id': 'PAYID-1',
+        'time_bucket': payment_id[:13] + '#0'
+    }
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = SQLiteStorage(os.path.join(self.dir, 'test.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_claim_and_release_email(self):
+        self.assertTrue(self.storage.claim_email('cust1', 'a@example.com'))
+        # claiming again for the same customer is fine, another customer is refused
+        self.assertTrue(self.storage.claim_email('cust1', 'a@example.com'))
+        self.assertFalse(self.storage.claim_email('cust2', 'a@example.com'))
+
+        # only the owner can release it
+        self.storage.release_email('cust2', 'a@example.com')
+        self.assertFalse(self.storage.claim_email('cust2', 'a@example.com'))
+        self.storage.release_email('cust1', 'a@example.com')
+        self.assertTrue(self.storage.claim_email('cust2', 'a@example.com'))
+
+    def test_put_customer_bumps_version(self):
+        self.assertEqual(self.storage.put_customer('cust1', 'a@example.com'), {})
+        old = self.storage.put_customer('cust1', 'b@example.com')
+
+        self.assertEqual(old, {'customer_id': 'cust1', 'email': 'a@example.com', 'version': 1})
+        self.assertEqual(self.storage.get_customer('cust1'),
+                         {'customer_id': 'cust1', 'email': 'b@example.com', 'version': 2})
+        self.assertIsNone(self.storage.get_customer('nobody'))
+        self.assertEqual([c['customer_id'] for c in self.storage.customers_by_email('b@example.com')], ['cust1'])
+        self.assertEqual(self.storage.customers_by_email('a@example.com'), [])
+
+    def test_get_customers(self):
+        ids = [f'cust{i}' for i in range(1200)]
+        for customer_id in ids[::2]:
+            self.storage.put_customer(customer_id, f'{customer_id}@example.com')
+
+        found, unprocessed = self.storage.get_customers(ids)
+
+        self.assertEqual(sorted(found), sorted(ids[::2]))
+        self.assertEqual(found['cust10']['email'], 'cust10@example.com')
+        self.assertEqual(unprocessed, [])
+
+    def test_payment_history_merges_shards(self):
+        self.storage.put_payments([
+            payment('cust1', '2024-01-01T00:00:03Z'),
+            payment('cust1#1', '2024-01-01T00:00:01Z'),
+            payment('cust1#2', '2024-01-01T00:00:02Z'),
+            payment('cust2', '2024-01-01T00:00:00Z')
+        ])
+
+        history = self.storage.payment_history('cust1', {'disbursement_shards': 3})
+
+        self.assertEqual([p['payment_id'] for p in history],
+                         ['2024-01-01T00:00:01Z', '2024-01-01T00:00:02Z', '2024-01-01T00:00:03Z'])
+        self.assertTrue(all(p['customer_id'] == 'cust1' for p in history))
+        self.assertEqual(history[0]['amount'], Decimal('10.50'))
+        # without the shard count only the base partition is read
+        self.assertEqual(len(self.storage.payment_history('cust1', {})), 1)
+
+    def test_add_payout(self):
+        self.storage.add_payout('cust1', '2024-01-01T00:00:00Z', 10.1, 'USD')
+        self.storage.add_payout('cust1', '2024-01-01T00:00:01Z', 0.2, 'USD')
+        self.storage.add_payout('cust1', '2024-01-01T00:00:02Z', 500, 'INR')
+
+        summary = self.storage.get_payout_summary('cust1')
+
+        self.assertEqual(summary['payment_count'], 3)
+        self.assertEqual(summary['last_payment_at'], '2024-01-01T00:00:02Z')
+        # no float rounding in the totals
+        self.assertEqual(summary['total_USD'], Decimal('10.3'))
+        self.assertEqual(summary['count_USD'], 2)
+        self.assertEqual(summary['total_INR'], Decimal('500'))
+        self.assertEqual(self.storage.get_payout_summary('nobody'), {})
+
+    def test_concurrent_writers(self):
+        def pay(thread):
+            for i in range(50):
+                self.storage.add_payout('cust1', f'{thread}-{i}', 1, 'USD')
+
+        threads = [threading.Thread(target=pay, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        summary = self.storage.get_payout_summary('cust1')
+        self.assertEqual(summary['payment_count'], 200)
+        self.assertEqual(summary['total_USD'], Decimal('200'))
+
+    def test_failed_write_rolls_back(self):
+        def fail(conn):
+            conn.execute("INSERT INTO email_markers (email, owner_id) VALUES ('a@example.com', 'cust1')")
+            conn.execute('INSERT INTO no_such_table VALUES (1)')
+
+        with self.assertRaises(StorageError):
+            self.storage._write(fail)
+        self.assertTrue(self.storage.claim_email('cust2', 'a@example.com'))
+
+
+class TestDynamoDBStorage(unittest.TestCase):
+
+    def test_put_customer_bumps_version(self):
+        dynamodb = MagicMock()
+        dynamodb.Table.return_value.update_item.return_value = {'Attributes': {'email': 'a@example.com'}}
+        storage = DynamoDBStorage(lambda: dynamodb)
+
+        old = storage.put_customer('cust1', 'b@example.com')
+
+        self.assertEqual(old, {'email': 'a@example.com'})
+        kwargs = dynamodb.Table.return_value.update_item.call_args.kwargs
+        self.assertEqual(kwargs['UpdateExpression'], 'SET email = :email ADD version :one')
+
+    def test_get_customer_not_found(self):
+        dynamodb = MagicMock()
+        dynamodb.Table.return_value.get_item.return_value = {}
+        self.assertIsNone(DynamoDBStorage(lambda: dynamodb).get_customer('nobody'))
+
+    def test_payment_history_queries_shards_in_parallel(self):
+        # the first page of every shard waits for the other shards, so this only returns
+        # when the three are queried at once
+        barrier = threading.Barrier(3, timeout=5)
+        pages = {
+            'cust1': [['2024-01-01T00:00:00Z']],
+            'cust1#1': [['2024-01-01T00:00:02Z']],
+            'cust1#2': [['2024-01-01T00:00:01Z'], ['2024-01-01T00:00:03Z']],
+        }
+
+        def query(**kwargs):
+            partition_key = kwargs['ExpressionAttributeValues'][':pk']['S']
+            page = int(kwargs.get('ExclusiveStartKey', {}).get('page', {}).get('N', 0))
+            if page == 0:
+                barrier.wait()
+            resp = {'Items': [{'customer_id': {'S': partition_key}, 'payment_id': {'S': payment_id},
+                               'amount': {'N': '10.5'}} for payment_id in pages[partition_key][page]]}
+            if page + 1 < len(pages[partition_key]):
+                resp['LastEvaluatedKey'] = {'page': {'N': str(page + 1)}}
+            return resp
+
+        dynamodb = MagicMock()
+        dynamodb.meta.client.query.side_effect = query
+
+        history = DynamoDBStorage(lambda: dynamodb).payment_history('cust1', {'disbursement_shards_max': 3})
+
+        self.assertEqual([p['payment_id'] for p in history],
+                         ['2024-01-01T00:00:00Z', '2024-01-01T00:00:01Z', '2024-01-01T00:00:02Z',
+                          '2024-01-01T00:00:03Z'])
+        self.assertEqual({p['customer_id'] for p in history}, {'cust1'})
+        self.assertEqual(history[0]['amount'], Decimal('10.5'))
+        self.assertEqual(dynamodb.meta.client.query.call_count, 4)
+
+
+class TestStorageFromEnv(unittest.TestCase):
+
+    def test_backends(self):
+        self.assertIsInstance(storage_from_env(MagicMock(), {}), DynamoDBStorage)
+        with tempfile.TemporaryDirectory() as d:
+            storage = storage_from_env(MagicMock(), {'STORAGE_BACKEND': 'sqlite',
+                                                     'STORAGE_SQLITE_PATH': os.path.join(d, 'app.db')})
+            self.assertIsInstance(storage, SQLiteStorage)
+        with self.assertRaises(ValueError):
+            storage_from_env(MagicMock(), {'STORAGE_BACKEND': 'postgres'})
+
+    def test_disbursement_read_keys(self):
+        self.assertEqual(disbursement_read_keys('cust1', None), ['cust1'])
+        self.assertEqual(disbursement_read_keys('cust1', {'disbursement_shards': 1, 'disbursement_shards_max': 3}),
+                         ['cust1', 'cust1#1', 'cust1#2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
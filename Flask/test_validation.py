@@ -0,0 +1,123 @@
+# run: pytest -v
+import os
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+from validation import Validator, load_validators
+
+
+def payment(**fields):
+    body = {'customer_id': 'vetagaadu3', 'email': 'vetagaadu3@example.com', 'amount': 100.0, 'currency': 'USD'}
+    body.update(fields)
+    return {name: value for name, value in body.items() if value is not None}
+
+
+class TestValidator(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.validators = load_validators()
+
+    def test_schemas_are_the_api_gateway_models(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'deply', 'aws', 'apigateway.tf')) as f:
+            terraform = f.read()
+        for name in self.validators:
+            self.assertIn(f'schemas/{name}.json', terraform)
+
+    def test_valid_payment(self):
+        validate = self.validators['payments_request']
+        for body in [payment(), payment(amount=1), payment(amount=1000000), payment(amount=Decimal('10.50')),
+                     payment(currency='JPY', customer_id='A' * 20)]:
+            self.assertEqual(validate(body), [], body)
+            self.assertTrue(validate.is_valid(body))
+
+    def test_every_error_in_one_pass(self):
+        errors = self.validators['payments_request'](
+            {'customer_id': 'cust_1', 'email': 'nobody', 'amount': 0})
+
+        self.assertEqual(errors, [
+            'currency: is required',
+            'customer_id: must be at least 8 characters',
+            'customer_id: does not match ^[A-Za-z0-9]{8,20}$',
+            'email: does not match ^[a-zA-Z0-9._-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}$',
+            'amount: must be at least 1',
+        ])
+
+    def test_types(self):
+        validate = self.validators['payments_request']
+        self.assertEqual(validate(None), ['body: must be an object'])
+        self.assertEqual(validate([payment()]), ['body: must be an object'])
+        # bool is an int in Python but not a number in JSON schema, NaN is out of any range
+        self.assertEqual(validate(payment(amount=True)), ['amount: must be a number'])
+        self.assertEqual(validate(payment(amount='10')), ['amount: must be a number'])
+        self.assertEqual(validate(payment(amount=float('nan'))),
+                         ['amount: must be at least 1', 'amount: must be at most 1000000'])
+        self.assertEqual(validate(payment(currency='usd')),
+                         ['currency: must be one of USD, INR, EUR, JPY, GBP'])
+        self.assertEqual(validate(payment(currency=['USD'])), ['currency: must be a string'])
+
+    def test_end_anchor_rejects_trailing_newline(self):
+        # Python's '$' matches before a final newline, JSON schema's does not
+        self.assertEqual(self.validators['customer_request']({'customer_id': 'vetagaadu\n', 'email': 'a@b.io'}),
+                         ['customer_id: does not match ^[A-Za-z0-9]{8,20}$'])
+
+    def test_batch_get(self):
+        validate = self.validators['customers_batch_get']
+        self.assertEqual(validate({'customer_ids': ['customer1', 'customer2']}), [])
+        self.assertEqual(validate({'customer_ids': ['customer1', 'email#a@b.com', 7]}), [
+            'customer_ids[1]: does not match ^[A-Za-z0-9]{8,20}$',
+            'customer_ids[2]: must be a string',
+        ])
+        self.assertEqual(validate({'customer_ids': []}), ['customer_ids: must have at least 1 items'])
+        self.assertEqual(validate({'customer_ids': ['customer1'] * 1001}),
+                         ['customer_ids: must have at most 1000 items'])
+
+    def test_fast_path_agrees_with_error_path(self):
+        validate = self.validators['payments_request']
+        values = [None, True, 0, 1, 5.5, 2000000, '', 'vetagaadu3', 'a@b.io', 'USD', 'EUR', [], {}]
+        for name in ('customer_id', 'email', 'amount', 'currency', 'extra'):
+            for value in values:
+                body = payment(**{name: value})
+                self.assertEqual(validate.is_valid(body), validate(body) == [], body)
+
+    def test_other_keywords(self):
+        validate = Validator({
+            'type': 'object',
+            'properties': {'tags': {'type': 'array', 'items': {'enum': ['a', 1]}},
+                           'count': {'type': 'integer', 'minimum': 0}},
+            'additionalProperties': False,
+        })
+        self.assertEqual(validate({'tags': ['a', 1], 'count': 3}), [])
+        self.assertEqual(validate({'tags': [2], 'count': 1.5, 'other': 1}), [
+            'tags[0]: must be one of a, 1',
+            'count: must be an integer',
+            'other: is not allowed',
+        ])
+        self.assertFalse(validate.is_valid({'other': 1}))
+
+    def test_unsupported_keyword(self):
+        with self.assertRaises(ValueError):
+            Validator({'type': 'object', 'properties': {'a': {'oneOf': []}}})
+        with self.assertRaises(ValueError):
+            Validator({'type': 'null'})
+
+
+class TestPaymentAppValidation(unittest.TestCase):
+
+    @patch('paymentApp.storage')
+    def test_invalid_payment_never_reaches_storage(self, mock_storage):
+        import paymentApp
+        with paymentApp.paymentApp.test_client() as client:
+            response = client.post('/v1/api/payments', json={'customer_id': 'vetagaadu3', 'amount': -5})
+            not_json = client.post('/v1/api/payments', data='amount=5')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['errors'], ['email: is required', 'currency: is required',
+                                                   'amount: must be at least 1'])
+        self.assertEqual(not_json.json['errors'], ['body: must be an object'])
+        mock_storage.get_customer.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
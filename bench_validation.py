@@ -0,0 +1,66 @@
+#
+# Throughput of the request validator (validation.py) on bulk inputs.
+#
+# run: python bench_validation.py [--records 200000] [--invalid 0.1]
+#
+# Validates generated payment bodies, a share of them invalid in one or more fields,
+# three ways: the generated fast path alone, validate() (fast path, error path for the
+# invalid ones) and the error path for every record, i.e. what a plain interpreter of the
+# schema costs. Then a 1000 id customers:batchGet body, the largest the API takes.
+#
+
+import argparse
+import random
+import time
+
+from validation import collect_errors, load_validators
+
+
+def make_payments(count, invalid, seed=1):
+    rng = random.Random(seed)
+    currencies = ['USD', 'INR', 'EUR', 'JPY', 'GBP']
+    bodies = []
+    for i in range(count):
+        body = {'customer_id': f'customer{i:08d}', 'email': f'customer{i}@example.com',
+                'amount': round(rng.uniform(1, 1000000), 2), 'currency': rng.choice(currencies)}
+        if rng.random() < invalid:
+            # one to three bad fields
+            for field in rng.sample(list(body), rng.randint(1, 3)):
+                body[field] = rng.choice([None, '', 'x' * 300, -1, 'cust_1', 'usd'])
+        bodies.append(body)
+    return bodies
+
+
+def timed(label, fn, bodies, unit='records'):
+    start = time.perf_counter()
+    result = fn(bodies)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {len(bodies) / elapsed:>12,.0f} {unit}/s  {elapsed / len(bodies) * 1e6:>7.2f} us each")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='request validator throughput')
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--invalid', type=float, default=0.1)
+    args = parser.parse_args()
+
+    validators = load_validators()
+    validate = validators['payments_request']
+    bodies = make_payments(args.records, args.invalid)
+    print(f"{args.records} payment bodies, {args.invalid:.0%} with bad fields")
+
+    valid = timed('fast path (is_valid)', lambda b: sum(map(validate.is_valid, b)), bodies)
+    rejected = timed('validate() with all errors', lambda b: sum(1 for body in b if validate(body)), bodies)
+    timed('error path only (interpreted)',
+          lambda b: [collect_errors(validate.root, body, '', []) for body in b], bodies)
+    assert valid + rejected == len(bodies)
+    print(f"{valid} valid, {rejected} rejected")
+
+    batch_get = validators['customers_batch_get']
+    batch = [{'customer_ids': [f'customer{i:08d}' for i in range(1000)]}] * 200
+    timed('customers:batchGet, 1000 ids', lambda b: [batch_get(body) for body in b], batch, unit='bodies')
+
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,10 @@ resource "aws_api_gateway_rest_api" "api" {
   endpoint_configuration {
     types = ["REGIONAL"]
   }
+
+  # the lambda returns compressed responses base64 encoded, */* makes API Gateway decode
+  # them into binary bodies (and pass request bodies base64 encoded, the lambda decodes them)
+  binary_media_types = var.enable_response_compression ? ["*/*"] : []
 }
 
 # create resource /v1
@@ -49,13 +53,41 @@ resource "aws_api_gateway_resource" "get_customer_id" {
   path_part   = "{customer_id}"
 }
 
+# create resource /v1/api/customer/{customer_id}/summary
+resource "aws_api_gateway_resource" "customer_summary" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.get_customer_id.id
+  path_part   = "summary"
+}
+
 # create resource /v1/api/payments
+# create resource /v1/api/customers:batchGet
+resource "aws_api_gateway_resource" "customers_batch_get" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.v1_api.id
+  path_part   = "customers:batchGet"
+}
+
 resource "aws_api_gateway_resource" "v1_api_payments" {
   rest_api_id = aws_api_gateway_rest_api.api.id
   parent_id   = aws_api_gateway_resource.v1_api.id
   path_part   = "payments"
 }
 
+# create resource /v1/api/payment
+resource "aws_api_gateway_resource" "v1_api_payment" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.v1_api.id
+  path_part   = "payment"
+}
+
+# create resource /v1/api/payment/{customer_id}
+resource "aws_api_gateway_resource" "get_payment_customer_id" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.v1_api_payment.id
+  path_part   = "{customer_id}"
+}
+
 # create POST method on /v1/api/customer
 resource "aws_api_gateway_method" "post_customer" {
   rest_api_id          = aws_api_gateway_rest_api.api.id
@@ -79,6 +111,22 @@ resource "aws_api_gateway_method" "post_customer" {
   depends_on = [aws_api_gateway_model.customer_request_model]
 }
 
+# create GET method on /v1/api/customer?email= (lookup by email)
+resource "aws_api_gateway_method" "get_customer_by_email" {
+  rest_api_id          = aws_api_gateway_rest_api.api.id
+  resource_id          = aws_api_gateway_resource.v1_api_customer.id
+  http_method          = "GET"
+  authorization        = "COGNITO_USER_POOLS"
+  authorizer_id        = aws_api_gateway_authorizer.payApp_authorizer.id
+  request_validator_id = aws_api_gateway_request_validator.req_validator.id
+
+  request_parameters = {
+    "method.request.querystring.email" = true # email is required in query string
+    "method.request.header.x-api-key"  = var.enable_rate_limit
+  }
+  api_key_required = var.enable_rate_limit
+}
+
 # create GET method on /v1/api/customer/{customer_id}
 resource "aws_api_gateway_method" "get_customer" {
   rest_api_id          = aws_api_gateway_rest_api.api.id
@@ -90,6 +138,22 @@ resource "aws_api_gateway_method" "get_customer" {
 
   # TBD (Rajesham)
   # request_validator_id = aws_api_gateway_request_validator.id
+  request_parameters = {
+    "method.request.path.customer_id"      = true # customer_id is required in path
+    "method.request.header.x-api-key"      = var.enable_rate_limit
+    "method.request.header.If-None-Match" = false
+  }
+  api_key_required = var.enable_rate_limit
+}
+
+# create GET method on /v1/api/customer/{customer_id}/summary
+resource "aws_api_gateway_method" "get_customer_summary" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.customer_summary.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.payApp_authorizer.id
+
   request_parameters = {
     "method.request.path.customer_id" = true # customer_id is required in path
     "method.request.header.x-api-key" = var.enable_rate_limit
@@ -117,6 +181,59 @@ resource "aws_api_gateway_method" "post_payments" {
   depends_on = [aws_api_gateway_model.payments_request_model]
 }
 
+# create GET method on /v1/api/payment/{customer_id} (payment history)
+resource "aws_api_gateway_method" "get_payment_history" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.get_payment_customer_id.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.payApp_authorizer.id
+
+  request_parameters = {
+    "method.request.path.customer_id" = true # customer_id is required in path
+    "method.request.header.x-api-key" = var.enable_rate_limit
+  }
+  api_key_required = var.enable_rate_limit
+}
+
+# create POST method on /v1/api/customers:batchGet (many customers in one call)
+resource "aws_api_gateway_method" "post_customers_batch_get" {
+  rest_api_id          = aws_api_gateway_rest_api.api.id
+  resource_id          = aws_api_gateway_resource.customers_batch_get.id
+  http_method          = "POST"
+  authorization        = "COGNITO_USER_POOLS"
+  authorizer_id        = aws_api_gateway_authorizer.payApp_authorizer.id
+  request_validator_id = aws_api_gateway_request_validator.req_validator.id
+
+  request_parameters = {
+    "method.request.header.x-api-key" = var.enable_rate_limit
+  }
+  api_key_required = var.enable_rate_limit
+
+  request_models = {
+    "application/json" = aws_api_gateway_model.customers_batch_get_model.name
+  }
+  depends_on = [aws_api_gateway_model.customers_batch_get_model]
+}
+
+# create GET method on /v1/api/payments?from=&to= (payments of all customers in a time window)
+resource "aws_api_gateway_method" "get_payments_in_window" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.v1_api_payments.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.payApp_authorizer.id
+
+  request_parameters = {
+    "method.request.querystring.from"   = true
+    "method.request.querystring.to"     = true
+    "method.request.querystring.limit"  = false
+    "method.request.querystring.cursor" = false
+    "method.request.header.x-api-key"   = var.enable_rate_limit
+  }
+  api_key_required = var.enable_rate_limit
+}
+
 resource "aws_api_gateway_request_validator" "req_validator" {
   name                        = "RequestBodyValidator"
   rest_api_id                 = aws_api_gateway_rest_api.api.id
@@ -125,31 +242,16 @@ resource "aws_api_gateway_request_validator" "req_validator" {
 }
 
 # define the request body model for /v1/api/customer
+# The models are the JSON schemas in schemas/ at the repo root. validation.py next to them
+# compiles the same files for the lambda and the Flask app, so both check exactly what API
+# Gateway does.
 resource "aws_api_gateway_model" "customer_request_model" {
   rest_api_id  = aws_api_gateway_rest_api.api.id
   name         = "CustomerRequestModel"
   content_type = "application/json"
 
   # see RFC 5321 and RFC 5322 for email specs/format and length
-  schema = jsonencode({
-    "type" : "object",
-    "properties" : {
-      "customer_id" : {
-        "type" : "string"
-        "pattern" : "^[A-Za-z0-9]{8,20}$",
-        "minLength" : 8,
-        "maxLength" : 20
-      },
-      "email" : {
-        "type" : "string",
-        "format" : "email",
-        "pattern" : "^[a-zA-Z0-9._-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}$",
-        "minLength" : 5,
-        "maxLength" : 254
-      }
-    },
-    "required" : ["customer_id", "email"]
-  })
+  schema = file("${path.module}/../../schemas/customer_request.json")
 }
 
 # define the request body model for /v1/api/payments
@@ -159,35 +261,16 @@ resource "aws_api_gateway_model" "payments_request_model" {
   content_type = "application/json"
 
   # see RFC 5321 and RFC 5322 for email specs/format and length
-  schema = jsonencode({
-    "type" : "object",
-    "properties" : {
-      "customer_id" : {
-        "type" : "string",
-        "pattern" : "^[A-Za-z0-9]{8,20}$",
-        "minLength" : 8,
-        "maxLength" : 20
-      },
-      "email" : {
-        "type" : "string",
-        "format" : "email",
-        "pattern" : "^[a-zA-Z0-9._-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}$",
-        "minLength" : 5,
-        "maxLength" : 254
-      },
-      "amount" : {
-        "type" : "number",
-        "minimum" : 1,
-        "maximum" : 1000000
-
-      },
-      "currency" : {
-        "type" : "string",
-        "enum" : ["USD", "INR", "EUR", "JPY", "GBP"]
-      }
-    },
-    "required" : ["customer_id", "email", "amount", "currency"]
-  })
+  schema = file("${path.module}/../../schemas/payments_request.json")
+}
+
+# define the request body model for /v1/api/customers:batchGet
+resource "aws_api_gateway_model" "customers_batch_get_model" {
+  rest_api_id  = aws_api_gateway_rest_api.api.id
+  name         = "CustomersBatchGetModel"
+  content_type = "application/json"
+
+  schema = file("${path.module}/../../schemas/customers_batch_get.json")
 }
 
 # lambda integration for /v1/api/customer
@@ -208,6 +291,16 @@ resource "aws_api_gateway_integration" "customer_integration" {
   uri  = aws_lambda_function.payment_lambda.invoke_arn
 }
 
+# lambda integration for GET /v1/api/customer?email=
+resource "aws_api_gateway_integration" "customer_email_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.v1_api_customer.id
+  http_method             = aws_api_gateway_method.get_customer_by_email.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.payment_lambda.invoke_arn
+}
+
 # lambda integration for /v1/api/customer/{customer_id}
 resource "aws_api_gateway_integration" "customer_id_integration" {
   rest_api_id             = aws_api_gateway_rest_api.api.id
@@ -219,6 +312,26 @@ resource "aws_api_gateway_integration" "customer_id_integration" {
   request_parameters = {
     "integration.request.path.customer_id" = "method.request.path.customer_id"
   }
+
+  # stage cache key: the customer, and If-None-Match so a cached 304 is never
+  # served to a client without the ETag
+  cache_key_parameters = [
+    "method.request.path.customer_id",
+    "method.request.header.If-None-Match",
+  ]
+}
+
+# lambda integration for /v1/api/customer/{customer_id}/summary
+resource "aws_api_gateway_integration" "customer_summary_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.customer_summary.id
+  http_method             = aws_api_gateway_method.get_customer_summary.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.payment_lambda.invoke_arn
+  request_parameters = {
+    "integration.request.path.customer_id" = "method.request.path.customer_id"
+  }
 }
 
 # lambda lntegration for /v1/api/payments
@@ -231,6 +344,39 @@ resource "aws_api_gateway_integration" "payments_integration" {
   uri                     = aws_lambda_function.payment_lambda.invoke_arn
 }
 
+# lambda integration for /v1/api/payment/{customer_id}
+resource "aws_api_gateway_integration" "payment_history_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.get_payment_customer_id.id
+  http_method             = aws_api_gateway_method.get_payment_history.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.payment_lambda.invoke_arn
+  request_parameters = {
+    "integration.request.path.customer_id" = "method.request.path.customer_id"
+  }
+}
+
+# lambda integration for GET /v1/api/payments?from=&to=
+resource "aws_api_gateway_integration" "payments_window_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.v1_api_payments.id
+  http_method             = aws_api_gateway_method.get_payments_in_window.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.payment_lambda.invoke_arn
+}
+
+# lambda integration for POST /v1/api/customers:batchGet
+resource "aws_api_gateway_integration" "customers_batch_get_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.customers_batch_get.id
+  http_method             = aws_api_gateway_method.post_customers_batch_get.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.payment_lambda.invoke_arn
+}
+
 # permissions to allow API Gateway to invoke lambda (Customer)
 resource "aws_lambda_permission" "allow_api_gateway_customer" {
   statement_id  = "AllowExecutionFromPaymentAppAPIGateway" # some unique name
@@ -260,12 +406,26 @@ resource "aws_api_gateway_deployment" "payment_apigateway_deploy" {
       aws_api_gateway_resource.v1_api.id,
       aws_api_gateway_resource.v1_api_customer.id,
       aws_api_gateway_resource.v1_api_payments.id,
+      aws_api_gateway_resource.v1_api_payment.id,
+      aws_api_gateway_resource.get_payment_customer_id.id,
+      aws_api_gateway_resource.customer_summary.id,
+      aws_api_gateway_resource.customers_batch_get.id,
       aws_api_gateway_method.post_customer.id,
       aws_api_gateway_method.get_customer.id,
+      aws_api_gateway_method.get_customer_by_email.id,
       aws_api_gateway_method.post_payments.id,
+      aws_api_gateway_method.get_payment_history.id,
+      aws_api_gateway_method.get_customer_summary.id,
+      aws_api_gateway_method.get_payments_in_window.id,
+      aws_api_gateway_method.post_customers_batch_get.id,
       aws_api_gateway_integration.customer_integration.id,
       aws_api_gateway_integration.customer_id_integration.id,
+      aws_api_gateway_integration.customer_email_integration.id,
       aws_api_gateway_integration.payments_integration.id,
+      aws_api_gateway_integration.payment_history_integration.id,
+      aws_api_gateway_integration.customer_summary_integration.id,
+      aws_api_gateway_integration.payments_window_integration.id,
+      aws_api_gateway_integration.customers_batch_get_integration.id,
       aws_api_gateway_authorizer.payApp_authorizer.id
     ]))
   }
@@ -279,7 +439,12 @@ resource "aws_api_gateway_deployment" "payment_apigateway_deploy" {
   depends_on = [
     aws_api_gateway_integration.customer_integration,
     aws_api_gateway_integration.customer_id_integration,
-    aws_api_gateway_integration.payments_integration
+    aws_api_gateway_integration.customer_email_integration,
+    aws_api_gateway_integration.payments_integration,
+    aws_api_gateway_integration.payment_history_integration,
+    aws_api_gateway_integration.customer_summary_integration,
+    aws_api_gateway_integration.payments_window_integration,
+    aws_api_gateway_integration.customers_batch_get_integration
   ]
 }
 
@@ -288,6 +453,10 @@ resource "aws_api_gateway_stage" "app_stage" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
   stage_name    = var.payment_app_apigateway_stage
 
+  # stage cache for customer reads, see customer_read_cache below
+  cache_cluster_enabled = var.enable_api_cache
+  cache_cluster_size    = var.enable_api_cache ? var.api_cache_size : null
+
   /* TBD
   access_log_settings {
     destination_arn = aws_cloudwatch_log_group.pay_app_api_gateway_loggroup.arn
@@ -342,4 +511,21 @@ resource "aws_api_gateway_method_settings" "payapp_cloudwatch_logs" {
     throttling_burst_limit = 1000  # Allows up to 1000 requests in a burst
     */
   }
-}
\ No newline at end of file
+}
+
+# cache GET /v1/api/customer/{customer_id} in the stage cache. Entries live for
+# api_cache_ttl seconds, so a changed email can be served stale that long; clients
+# revalidate cheaply with If-None-Match either way.
+resource "aws_api_gateway_method_settings" "customer_read_cache" {
+  count       = var.enable_api_cache ? 1 : 0
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  stage_name  = aws_api_gateway_stage.app_stage.stage_name
+  method_path = "v1/api/customer/{customer_id}/GET"
+
+  settings {
+    logging_level        = "INFO"
+    metrics_enabled      = true
+    caching_enabled      = true
+    cache_ttl_in_seconds = var.api_cache_ttl
+  }
+}
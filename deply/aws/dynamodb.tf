@@ -20,6 +20,24 @@ resource "aws_dynamodb_table" "disbursements" {
     type = "S" # String
   }
 
+  attribute {
+    name = "time_bucket"
+    type = "S" # String
+  }
+
+  # GSI for cross-customer time-window queries (GET /v1/api/payments?from=&to=).
+  # time_bucket is '<hour or day of payment_id>#<shard>', granularity and shard count
+  # come from var.disbursement_time_bucket and var.disbursement_time_bucket_shards.
+  # The shards keep all writes of the current hour from landing on one GSI partition.
+  global_secondary_index {
+    name            = "time-bucket-index"
+    hash_key        = "time_bucket"
+    range_key       = "payment_id"
+    projection_type = "ALL"
+    read_capacity   = var.RCU
+    write_capacity  = var.WCU
+  }
+
   # Optional: Time to Live (TTL) configuration (e.g., for expiring old records)
   ttl {
     # attribute_name = "timestamp"
@@ -47,6 +65,23 @@ resource "aws_dynamodb_table" "customers" {
     type = "S" # String
   }
 
+  attribute {
+    name = "email"
+    type = "S" # String
+  }
+
+  # GSI to look up customers by email (GET /v1/api/customer?email=) without a
+  # table scan. customer_id and email are all the lookup returns, so KEYS_ONLY
+  # keeps the index small. Email uniqueness markers ('email#<email>' items) have
+  # no email attribute and never land in the index.
+  global_secondary_index {
+    name            = "email-index"
+    hash_key        = "email"
+    projection_type = "KEYS_ONLY"
+    read_capacity   = var.RCU
+    write_capacity  = var.WCU
+  }
+
   # Optional: Time to Live (TTL) configuration (e.g., for expiring old records)
   ttl {
     # attribute_name = "timestamp"
@@ -59,3 +94,68 @@ resource "aws_dynamodb_table" "customers" {
     Environment = "Test"
   }
 }
+
+# create PayoutSummaries table: running payout totals per customer, updated with
+# UpdateItem ADD on every payment (see record_payout_summary in lambda_function.py)
+resource "aws_dynamodb_table" "payout_summaries" {
+  name           = var.payout_summaries_table_name
+  billing_mode   = var.billing_mode
+  read_capacity  = var.RCU
+  write_capacity = var.WCU
+
+  hash_key = "customer_id" # Partition Key
+
+  attribute {
+    name = "customer_id"
+    type = "S" # String
+  }
+
+  # Optional: Tags for the DynamoDB table
+  tags = {
+    Name        = "PayoutSummaries Table"
+    Environment = "Test"
+  }
+}
+
+# create NotificationOutbox table: payment notifications written together with the
+# Disbursements record (see Flask/outbox.py) and drained by the notification dispatcher
+resource "aws_dynamodb_table" "notification_outbox" {
+  name           = var.notification_outbox_table_name
+  billing_mode   = var.billing_mode
+  read_capacity  = var.RCU
+  write_capacity = var.WCU
+
+  hash_key = "notification_id" # Partition Key
+
+  attribute {
+    name = "notification_id"
+    type = "S" # String
+  }
+
+  attribute {
+    name = "pending"
+    type = "N" # Number
+  }
+
+  attribute {
+    name = "next_attempt_at"
+    type = "N" # Number
+  }
+
+  # sparse GSI of the notifications still to send, due first. Only pending items carry
+  # the pending attribute, so sent and parked ones drop out of the index.
+  global_secondary_index {
+    name            = "pending-index"
+    hash_key        = "pending"
+    range_key       = "next_attempt_at"
+    projection_type = "ALL"
+    read_capacity   = var.RCU
+    write_capacity  = var.WCU
+  }
+
+  # Optional: Tags for the DynamoDB table
+  tags = {
+    Name        = "NotificationOutbox Table"
+    Environment = "Test"
+  }
+}
@@ -15,6 +15,24 @@ resource "aws_lambda_function" "payment_lambda" {
       PAYPAL_SANDBOX_URL = var.paypal_sandbox_url
       PAYPAL_CLIENT_ID   = var.paypal_clinet_id
       PAYPAL_SECRET      = var.paypal_secret
+
+      DISBURSEMENT_TIME_BUCKET        = var.disbursement_time_bucket
+      DISBURSEMENT_TIME_BUCKET_SHARDS = var.disbursement_time_bucket_shards
+
+      # CUSTOMER_MAX_AGE: Cache-Control max-age of customer reads, as long as the stage cache keeps them
+      CUSTOMER_CACHE_TTL = var.customer_cache_ttl
+      CUSTOMER_MAX_AGE   = var.api_cache_ttl
+
+      # on-demand profiling, see PROFILE_* in lambda_function.py
+      PROFILE_SAMPLE_RATE = var.profile_sample_rate
+      PROFILE_HEADER      = var.profile_header ? "1" : "0"
+
+      # payment records go through the journal queue when enabled, see sqs.tf
+      DISBURSEMENT_QUEUE_URL = var.enable_disbursement_queue ? aws_sqs_queue.disbursement_journal[0].url : ""
+
+      # gzip/br responses by Accept-Encoding, needs the binary_media_types of apigateway.tf
+      RESPONSE_COMPRESSION           = var.enable_response_compression ? "1" : "0"
+      RESPONSE_COMPRESSION_MIN_BYTES = var.response_compression_min_bytes
     }
   }
 
@@ -56,13 +74,19 @@ resource "aws_iam_policy" "dynamodb_access_policy" {
         Action = [
           "dynamodb:PutItem",
           "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem",
           "dynamodb:Query",
-          "dynamodb:GetItem"
+          "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
+          "dynamodb:BatchWriteItem"
         ]
         Effect = "Allow"
         Resource = [
           aws_dynamodb_table.disbursements.arn,
-          aws_dynamodb_table.customers.arn
+          "${aws_dynamodb_table.disbursements.arn}/index/*",
+          aws_dynamodb_table.customers.arn,
+          "${aws_dynamodb_table.customers.arn}/index/*",
+          aws_dynamodb_table.payout_summaries.arn
         ]
       }
     ]
@@ -0,0 +1,69 @@
+
+# Disbursements journal queue, see DISBURSEMENT_QUEUE_URL in lambda_function.py.
+# process_payment sends payment records here instead of writing Disbursements on the
+# request path, and the same lambda drains the queue with BatchWriteItem.
+# Controlled with the enable_disbursement_queue variable.
+resource "aws_sqs_queue" "disbursement_journal_dlq" {
+  count                     = var.enable_disbursement_queue ? 1 : 0
+  name                      = "PaymentAppDisbursementJournalDLQ"
+  message_retention_seconds = 1209600 # 14 days, the maximum
+}
+
+resource "aws_sqs_queue" "disbursement_journal" {
+  count                     = var.enable_disbursement_queue ? 1 : 0
+  name                      = "PaymentAppDisbursementJournal"
+  message_retention_seconds = 1209600
+  # at least 6x the lambda timeout (60s in lambda.tf), as AWS recommends for event
+  # source mappings. Not derived from the function, whose environment points at this queue.
+  visibility_timeout_seconds = 360
+
+  # records still failing after this many deliveries are parked for inspection and redrive
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.disbursement_journal_dlq[0].arn
+    maxReceiveCount     = var.disbursement_queue_max_receive_count
+  })
+}
+
+resource "aws_lambda_event_source_mapping" "disbursement_journal" {
+  count            = var.enable_disbursement_queue ? 1 : 0
+  event_source_arn = aws_sqs_queue.disbursement_journal[0].arn
+  function_name    = aws_lambda_function.payment_lambda.arn
+
+  # up to 100 records per invocation, i.e. 4 BatchWriteItem calls, gathered for at most
+  # a second. Only the failed messages of a batch are redelivered.
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 1
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  depends_on = [aws_iam_role_policy_attachment.lambda_sqs_attachment]
+}
+
+# create IAM policy for lambda to send to and consume the journal queue
+resource "aws_iam_policy" "sqs_access_policy" {
+  count       = var.enable_disbursement_queue ? 1 : 0
+  name        = "PaymentAppSqsPolicy"
+  description = "IAM policy to use Payment App's disbursement journal queue"
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Effect   = "Allow"
+        Resource = aws_sqs_queue.disbursement_journal[0].arn
+      }
+    ]
+  })
+}
+
+# attach sqs access policy to lambda role
+resource "aws_iam_role_policy_attachment" "lambda_sqs_attachment" {
+  count      = var.enable_disbursement_queue ? 1 : 0
+  role       = aws_iam_role.lambda_role.name
+  policy_arn = aws_iam_policy.sqs_access_policy[0].arn
+}
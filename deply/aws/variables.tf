@@ -13,6 +13,96 @@ variable "customers_table_name" {
   description = "Customers Table in Dynamodb"
 }
 
+variable "payout_summaries_table_name" {
+  type        = string
+  description = "Per customer payout totals Table in Dynamodb"
+  default     = "PayoutSummaries"
+}
+
+variable "notification_outbox_table_name" {
+  type        = string
+  description = "Outbox of payment notifications in Dynamodb, drained by Flask/outbox.py"
+  default     = "NotificationOutbox"
+}
+
+# Disbursements time-bucket-index GSI, see dynamodb.tf
+variable "disbursement_time_bucket" {
+  type        = string
+  description = "Granularity of the Disbursements time buckets: hour or day"
+  default     = "hour"
+
+  validation {
+    condition     = contains(["hour", "day"], var.disbursement_time_bucket)
+    error_message = "disbursement_time_bucket must be hour or day."
+  }
+}
+
+variable "disbursement_time_bucket_shards" {
+  type        = number
+  description = "Number of GSI partitions the payments of one time bucket are spread over"
+  default     = 4
+}
+
+variable "customer_cache_ttl" {
+  type        = number
+  description = "Seconds a lambda container may serve a Customers item from memory, 0 turns the cache off"
+  default     = 0
+}
+
+variable "profile_sample_rate" {
+  type        = number
+  description = "Fraction of lambda invocations profiled with cProfile and tracemalloc, 0 turns sampling off"
+  default     = 0
+}
+
+variable "profile_header" {
+  type        = bool
+  description = "Profile lambda invocations sent with the 'X-Profile: 1' header"
+  default     = false
+}
+
+variable "enable_response_compression" {
+  type        = bool
+  description = "Compress lambda responses (gzip/br by Accept-Encoding) and set binary_media_types on the REST API so API Gateway sends them as binary"
+  default     = false
+}
+
+variable "response_compression_min_bytes" {
+  type        = number
+  description = "Responses smaller than this many bytes are not compressed"
+  default     = 1024
+}
+
+variable "enable_disbursement_queue" {
+  type        = bool
+  description = "Send payment records through an SQS journal queue drained by the lambda instead of writing Disbursements on the request path"
+  default     = false
+}
+
+variable "disbursement_queue_max_receive_count" {
+  type        = number
+  description = "Deliveries of a journal queue message before it moves to the dead letter queue"
+  default     = 10
+}
+
+variable "enable_api_cache" {
+  type        = bool
+  description = "Enable the API Gateway stage cache for customer reads (billed per hour)"
+  default     = false
+}
+
+variable "api_cache_size" {
+  type        = string
+  description = "API Gateway stage cache size in GB"
+  default     = "0.5"
+}
+
+variable "api_cache_ttl" {
+  type        = number
+  description = "Seconds API Gateway serves a cached customer read"
+  default     = 60
+}
+
 variable "billing_mode" {
   type        = string
   description = "Dynamodb Billing Mode"
@@ -0,0 +1,74 @@
+#
+# Set time_bucket on Disbursements rows that lack it or that were bucketed with another
+# granularity, so they show up in the time-bucket-index GSI.
+#
+# run: DISBURSEMENT_TIME_BUCKET=hour DISBURSEMENT_TIME_BUCKET_SHARDS=4 \
+#          python3 backfill_time_buckets.py [--segments 16]
+#
+# Use the same DISBURSEMENT_TIME_BUCKET and DISBURSEMENT_TIME_BUCKET_SHARDS values as the
+# lambda (deply/aws/terraform.tfvars). Run it once after the GSI is first created and
+# again after changing disbursement_time_bucket. Lowering the shard count needs a run too:
+# queries only look at shards below the current count.
+#
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.config import Config
+from export_disbursements import scan_segment
+from lambda_function import payment_time_bucket, time_bucket_shards
+
+
+def needs_backfill(item, shards):
+    """
+    True if the raw item's time_bucket is missing, of another granularity or out of shard range.
+    """
+    current = item.get('time_bucket', {}).get('S')
+    if current is None:
+        return True
+    bucket, _, shard = current.partition('#')
+    expected_bucket = payment_time_bucket(item['payment_id']['S']).partition('#')[0]
+    return bucket != expected_bucket or not shard.isdigit() or int(shard) >= shards
+
+
+def backfill_segment(client, table_name, segment, total_segments):
+    shards = time_bucket_shards()
+    updated = 0
+    pages = scan_segment(client, table_name, segment, total_segments,
+                         ProjectionExpression='customer_id, payment_id, time_bucket')
+    for items, _ in pages:
+        for item in items:
+            if not needs_backfill(item, shards):
+                continue
+            client.update_item(
+                TableName=table_name,
+                Key={'customer_id': item['customer_id'], 'payment_id': item['payment_id']},
+                UpdateExpression='SET time_bucket = :bucket',
+                # don't resurrect a row deleted since the scan
+                ConditionExpression='attribute_exists(payment_id)',
+                ExpressionAttributeValues={':bucket': {'S': payment_time_bucket(item['payment_id']['S'])}}
+            )
+            updated += 1
+    return updated
+
+
+def backfill(client, table_name, total_segments):
+    with ThreadPoolExecutor(max_workers=total_segments) as pool:
+        futures = [pool.submit(backfill_segment, client, table_name, segment, total_segments)
+                   for segment in range(total_segments)]
+        return sum(f.result() for f in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='backfill Disbursements.time_bucket')
+    parser.add_argument('--table', default='Disbursements')
+    parser.add_argument('--segments', type=int, default=16)
+    args = parser.parse_args()
+
+    client = boto3.client('dynamodb', config=Config(max_pool_connections=args.segments))
+    updated = backfill(client, args.table, args.segments)
+    print(f'time_bucket set on {updated} rows of {args.table}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+#
+# CPU time and allocations of every route of the lambda handler, with zero-latency
+# stand-ins for DynamoDB, SQS and PayPal, checked against a stored baseline.
+#
+# run: python3 bench_handlers.py [--threshold 0.25] [--memory-threshold 0.10] [--only name] [--update]
+#
+# Each case sends one API Gateway event (or an SQS batch) through lambda_handler, so
+# routing, body parsing and validation, the handler and building the response are all
+# measured. The stand-ins answer from dicts built up front and keep no state, so every
+# call does the same work. Per case it reports:
+#
+#   us/call   best of --rounds timeit runs, divided by the calls per run
+#   peak KiB  tracemalloc peak of one call above what was allocated before it
+#
+# The results are compared with bench_handlers_baseline.json. A case slower than the
+# baseline by more than --threshold, or with a peak above it by more than
+# --memory-threshold, is reported and the script exits 1. Times only compare on the same
+# machine and Python: refresh the baseline there with --update after an intended change.
+#
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+from decimal import Decimal
+from types import SimpleNamespace
+
+import lambda_function
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_handlers_baseline.json')
+
+CUSTOMER_ID = 'customer0001'
+LONG_HISTORY_CUSTOMER_ID = 'customer0002'
+EMAIL = 'customer0001@example.com'
+OK = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+def customer_items(count):
+    return {f'customer{i:04d}': {'customer_id': f'customer{i:04d}', 'email': f'customer{i:04d}@example.com',
+                                 'version': Decimal(3)} for i in range(1, count + 1)}
+
+
+def payment_items(customer_id, count):
+    return [{
+        'customer_id': customer_id,
+        'payment_id': f'2024-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}.{i:06d}Z',
+        'email': f'{customer_id}@example.com',
+        'amount': Decimal(f'{10 + i % 900}.{i % 100:02d}'),
+        'currency': ('USD', 'EUR', 'INR', 'GBP', 'JPY')[i % 5],
+        'payment_method': 'paypal',
+        'status': 'Completed',
+        'paypal_payment_id': f'PAYID-M{i:012d}X',
+        'time_bucket': f'2024-01-01T{i // 3600 % 24:02d}#0',
+    } for i in range(count)]
+
+
+def serialized(items):
+    # how the low level client returns items, so deserializing is part of the measurement
+    return [{k: lambda_function._serializer.serialize(v) for k, v in item.items()} for item in items]
+
+
+class StubTable:
+
+    def __init__(self, items):
+        self.items = items
+        self.by_email = {}
+        for item in items.values():
+            self.by_email.setdefault(item.get('email'), []).append(item)
+
+    def get_item(self, Key):
+        item = self.items.get(Key['customer_id'])
+        return dict(OK, Item=item) if item is not None else dict(OK)
+
+    def put_item(self, Item, **kwargs):
+        return OK
+
+    def update_item(self, Key, **kwargs):
+        return dict(OK, Attributes=self.items.get(Key['customer_id'], {}))
+
+    def delete_item(self, Key, **kwargs):
+        return OK
+
+    def query(self, **kwargs):
+        # only the email index is queried through the resource
+        return dict(OK, Items=self.by_email.get(EMAIL, []))
+
+
+class StubClient:
+
+    def __init__(self, customers, histories, window):
+        self.customers = {customer_id: serialized([item])[0] for customer_id, item in customers.items()}
+        self.histories = {customer_id: serialized(items) for customer_id, items in histories.items()}
+        self.window = serialized(window)
+
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems['Customers']['Keys']
+        found = [self.customers[key['customer_id']['S']] for key in keys if key['customer_id']['S'] in self.customers]
+        return dict(OK, Responses={'Customers': found}, UnprocessedKeys={})
+
+    def query(self, **kwargs):
+        if kwargs.get('IndexName') == lambda_function.TIME_BUCKET_INDEX:
+            # every time bucket shard holds the same rows, enough to fill any page
+            return dict(OK, Items=self.window[:kwargs['Limit']])
+        return dict(OK, Items=self.histories.get(kwargs['ExpressionAttributeValues'][':pk']['S'], []))
+
+    def batch_write_item(self, RequestItems):
+        return dict(OK, UnprocessedItems={})
+
+
+class StubResponse:
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def stub_post(url, **kwargs):
+    if url.endswith('/v1/oauth2/token'):
+        return StubResponse(200, {'access_token': 'A21AAbench', 'token_type': 'Bearer', 'expires_in': 32400})
+    return StubResponse(201, {'id': 'PAYID-MBENCH0001', 'intent': 'authorize', 'state': 'created'})
+
+
+def stand_ins():
+    customers = customer_items(1000)
+    customers[LONG_HISTORY_CUSTOMER_ID] = dict(customers[LONG_HISTORY_CUSTOMER_ID], disbursement_shards=4)
+    histories = {CUSTOMER_ID: payment_items(CUSTOMER_ID, 100)}
+    # a hot payee, its history spread over four shards
+    long_history = payment_items(LONG_HISTORY_CUSTOMER_ID, 1000)
+    for shard in range(4):
+        histories[lambda_function.disbursement_partition_key(LONG_HISTORY_CUSTOMER_ID, shard)] = long_history[shard::4]
+
+    tables = {'Customers': StubTable(customers),
+              'PayoutSummaries': StubTable({CUSTOMER_ID: {
+                  'customer_id': CUSTOMER_ID, 'payment_count': Decimal(12), 'count_USD': Decimal(10),
+                  'total_USD': Decimal('1250.50'), 'count_EUR': Decimal(2), 'total_EUR': Decimal('99.00'),
+                  'last_payment_at': '2024-01-01T00:00:11.000011Z'}}),
+              'Disbursements': StubTable({})}
+    resource = SimpleNamespace(Table=tables.__getitem__,
+                               meta=SimpleNamespace(client=StubClient(customers, histories, payment_items('x', 1000))))
+    boto3 = SimpleNamespace(resource=lambda *args, **kwargs: resource,
+                            client=lambda *args, **kwargs: SimpleNamespace(send_message=lambda **kwargs: OK))
+    return boto3, SimpleNamespace(post=stub_post)
+
+
+def api_event(method, resource, path_parameters=None, query=None, body=None, headers=None):
+    return {
+        'resource': resource,
+        'httpMethod': method,
+        'headers': dict({'Content-Type': 'application/json'}, **(headers or {})),
+        'pathParameters': path_parameters,
+        'queryStringParameters': query,
+        'body': json.dumps(body) if body is not None else None,
+        'isBase64Encoded': False,
+    }
+
+
+def sqs_event(count):
+    records = []
+    for i, item in enumerate(payment_items(CUSTOMER_ID, count)):
+        records.append({'messageId': f'message{i}', 'eventSource': 'aws:sqs',
+                        'body': json.dumps(item, default=str)})
+    return {'Records': records}
+
+
+# name, event, expected outcome (statusCode, or the number of failed messages of an SQS batch)
+CASES = [
+    ('add_customer', api_event('POST', '/v1/api/customer', body={'customer_id': CUSTOMER_ID, 'email': EMAIL}), 200),
+    ('add_customer_invalid', api_event('POST', '/v1/api/customer', body={'customer_id': 'c#1', 'email': 'x'}), 400),
+    ('get_customer_by_email', api_event('GET', '/v1/api/customer', query={'email': EMAIL}), 200),
+    ('get_customer', api_event('GET', '/v1/api/customer/{customer_id}', {'customer_id': CUSTOMER_ID}), 200),
+    ('get_customer_not_modified', api_event('GET', '/v1/api/customer/{customer_id}', {'customer_id': CUSTOMER_ID},
+                                            headers={'If-None-Match': '"v3"'}), 304),
+    ('batch_get_customers_100', api_event('POST', '/v1/api/customers:batchGet',
+                                          body={'customer_ids': [f'customer{i:04d}' for i in range(1, 101)]}), 200),
+    ('batch_get_customers_1000', api_event('POST', '/v1/api/customers:batchGet',
+                                           body={'customer_ids': [f'customer{i:04d}' for i in range(1, 1001)]}), 200),
+    ('get_payout_summary', api_event('GET', '/v1/api/customer/{customer_id}/summary',
+                                     {'customer_id': CUSTOMER_ID}), 200),
+    ('process_payment', api_event('POST', '/v1/api/payments', body={
+        'customer_id': CUSTOMER_ID, 'email': EMAIL, 'amount': 125.5, 'currency': 'USD'}), 200),
+    ('process_payment_invalid', api_event('POST', '/v1/api/payments', body={
+        'customer_id': CUSTOMER_ID, 'email': EMAIL, 'amount': 0, 'currency': 'usd'}), 400),
+    ('get_payments_in_window', api_event('GET', '/v1/api/payments', query={
+        'from': '2024-01-01T00:00:00', 'to': '2024-01-01T05:59:59', 'limit': '100'}), 200),
+    ('get_payment_history_100', api_event('GET', '/v1/api/payment/{customer_id}', {'customer_id': CUSTOMER_ID}), 200),
+    ('get_payment_history_1000_sharded_gzip', api_event('GET', '/v1/api/payment/{customer_id}',
+                                                        {'customer_id': LONG_HISTORY_CUSTOMER_ID},
+                                                        headers={'Accept-Encoding': 'gzip'}), 200),
+    ('not_found', api_event('GET', '/v1/api/unknown'), 404),
+    ('journal_queue_batch_10', sqs_event(10), 0),
+]
+
+
+def outcome(resp):
+    if 'statusCode' in resp:
+        return resp['statusCode']
+    return len(resp['batchItemFailures'])
+
+
+def time_per_call(handler, events, rounds):
+    # Rounds go over all cases in turn and each case keeps its best round, so a burst of
+    # load on the host slows one round of a case rather than all of them.
+    timers = {name: timeit.Timer(lambda event=event: handler(event, None)) for name, event in events.items()}
+    numbers = {name: timer.autorange()[0] for name, timer in timers.items()}
+    best = {}
+    for _ in range(rounds):
+        for name, timer in timers.items():
+            elapsed = timer.timeit(numbers[name]) / numbers[name]
+            best[name] = min(best.get(name, elapsed), elapsed)
+    return best
+
+
+def peak_per_call(handler, event, calls=5):
+    # the smallest of a few calls, the first ones may still fill caches
+    peaks = []
+    tracemalloc.start()
+    for _ in range(calls):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        handler(event, None)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return min(peaks)
+
+
+def run_cases(cases, rounds):
+    handler = lambda_function.lambda_handler
+    # handlers log every request, keep the formatting but not the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, event, expected in cases:
+            got = outcome(handler(event, None))
+            if got != expected:
+                raise SystemExit(f'{name}: expected {expected}, got {got}, the stand-ins are out of date')
+        times = time_per_call(handler, {name: event for name, event, _ in cases}, rounds)
+        return {name: {'us_per_call': round(times[name] * 1e6, 2),
+                       'peak_kib': round(peak_per_call(handler, event) / 1024, 1)}
+                for name, event, _ in cases}
+
+
+def change(value, base):
+    return f'{(value - base) / base * 100:+6.1f}%' if base else '       '
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    # print the results next to the baseline, return the regressions
+    regressions = []
+    cases = baseline.get('cases', {})
+    print(f"{'case':<40} {'us/call':>9} {'':>7} {'peak KiB':>9} {'':>7}")
+    for name, result in results.items():
+        base = cases.get(name)
+        if base is None:
+            print(f"{name:<40} {result['us_per_call']:>9.2f} {'new':>7} {result['peak_kib']:>9.1f}")
+            continue
+        print(f"{name:<40} {result['us_per_call']:>9.2f} {change(result['us_per_call'], base['us_per_call'])} "
+              f"{result['peak_kib']:>9.1f} {change(result['peak_kib'], base['peak_kib'])}")
+        if result['us_per_call'] > base['us_per_call'] * (1 + threshold):
+            regressions.append(f"{name}: {result['us_per_call']} us per call, baseline {base['us_per_call']}")
+        if result['peak_kib'] > base['peak_kib'] * (1 + memory_threshold):
+            regressions.append(f"{name}: peak {result['peak_kib']} KiB, baseline {base['peak_kib']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='lambda handler microbenchmarks against a stored baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--memory-threshold', type=float, default=0.10, help='allowed growth of the peak')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--only', help='run the cases whose name contains this')
+    parser.add_argument('--update', action='store_true', help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    # no AWS or PayPal access, a fixed configuration
+    os.environ.update({'PAYPAL_SANDBOX_URL': 'https://api.sandbox.paypal.com', 'PAYPAL_CLIENT_ID': 'bench',
+                       'PAYPAL_SECRET': 'bench', 'CUSTOMER_CACHE_TTL': '0', 'DISBURSEMENT_TIME_BUCKET': 'hour',
+                       'DISBURSEMENT_TIME_BUCKET_SHARDS': '4'})
+    os.environ.pop('DISBURSEMENT_QUEUE_URL', None)
+    lambda_function.boto3, lambda_function.requests = stand_ins()
+    lambda_function.RESPONSE_COMPRESSION = True
+
+    cases = [case for case in CASES if not args.only or args.only in case[0]]
+    results = run_cases(cases, args.rounds)
+
+    python = platform.python_version()
+    if args.update:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': python, 'machine': platform.machine(), 'cases': results}, f, indent=1)
+            f.write('\n')
+        print(f'wrote {len(results)} cases to {args.baseline}')
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline.get('python', python) != python:
+        print(f"baseline is from Python {baseline['python']}, this is {python}")
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    if regressions:
+        print(f'\n{len(regressions)} over the thresholds:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
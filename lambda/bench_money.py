@@ -0,0 +1,99 @@
+#
+# Per-currency totals and range checks over a million amounts: Decimal per amount
+# against integer minor units in MoneyColumns (money.py at the repo root).
+#
+# run: python3 bench_money.py [--amounts 1000000]
+#
+# The amounts are decimal strings in the five API currencies, as Disbursements stores
+# them. Each approach first parses them, then sums them per currency and finds those
+# outside the payments_request range (1 to 1000000):
+#
+#   Decimal         Decimal(str(amount)) per amount, summed and compared as Decimal
+#   columns         MoneyColumns.extend(), the batch parsed at once, totals and range check
+#                   with numpy
+#   columns, array  the same without numpy, integer loops over the arrays (the Lambda zip)
+#
+
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+# money.py lives at the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import money
+from money import CURRENCIES, MoneyColumns, minor_units_str
+
+
+def make_amounts(count, seed=1):
+    rng = random.Random(seed)
+    amounts = []
+    for i in range(count):
+        currency = rng.choice(CURRENCIES)
+        scale = 10 ** money.CURRENCY_EXPONENTS[currency]
+        # one in a thousand outside the range, half below and half above
+        if i % 1000 == 0:
+            minor = rng.choice([0, 1000001 * scale])
+        else:
+            minor = rng.randint(scale, 1000000 * scale)
+        amounts.append((minor_units_str(minor, currency), currency))
+    return amounts
+
+
+def with_decimal(amounts):
+    start = time.perf_counter()
+    values = [(Decimal(str(amount)), currency) for amount, currency in amounts]
+    parsed = time.perf_counter()
+    totals = {}
+    for value, currency in values:
+        totals[currency] = totals.get(currency, Decimal(0)) + value
+    low, high = Decimal(1), Decimal(1000000)
+    bad = [i for i, (value, _) in enumerate(values) if value < low or value > high]
+    done = time.perf_counter()
+    return parsed - start, done - parsed, {currency: str(total) for currency, total in sorted(totals.items())}, bad
+
+
+def with_columns(amounts):
+    start = time.perf_counter()
+    columns = MoneyColumns()
+    columns.extend(amounts)
+    parsed = time.perf_counter()
+    totals = columns.totals()
+    bad = columns.out_of_range(1, 1000000)
+    done = time.perf_counter()
+    return parsed - start, done - parsed, \
+        {currency: minor_units_str(total, currency) for currency, total in sorted(totals.items())}, bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description='money totals and range checks')
+    parser.add_argument('--amounts', type=int, default=1000000)
+    args = parser.parse_args()
+
+    amounts = make_amounts(args.amounts)
+    print(f"{args.amounts} amounts")
+    print(f"{'':<16} {'parse':>9} {'totals + range':>15} {'out of range':>13}")
+
+    runs = [('Decimal', with_decimal, money.load_numpy()), ('columns', with_columns, money.load_numpy()),
+            ('columns, array', with_columns, None)]
+    expected = None
+    for label, run, numpy in runs:
+        if label == 'columns' and numpy is None:
+            continue
+        saved, money.numpy = money.numpy, numpy
+        try:
+            parse, compute, totals, bad = run(amounts)
+        finally:
+            money.numpy = saved
+        # every approach must agree
+        if expected is None:
+            expected = (totals, bad)
+        elif (totals, bad) != expected:
+            raise SystemExit(f'{label} disagrees: {totals} {len(bad)}')
+        print(f"{label:<16} {parse:>8.3f}s {compute:>14.3f}s {len(bad):>13}")
+
+
+if __name__ == '__main__':
+    main()
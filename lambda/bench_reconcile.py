@@ -0,0 +1,53 @@
+#
+# Reconciliation throughput on synthetic data, no AWS or PayPal access needed.
+#
+# run: python3 bench_reconcile.py [--rows 1000000] [--partitions 64]
+#
+# Generates --rows disbursement records and the matching PayPal payments as streams
+# (nothing is materialised up front), with about 1% of them drifting, and times a
+# full Reconciler run.
+#
+
+import argparse
+import os
+import time
+from reconcile_paypal import Reconciler
+
+
+def fake_disbursements(rows):
+    for i in range(rows):
+        yield {
+            'customer_id': f'customer{i % 5000}', 'payment_id': f'2024-01-01T00:00:{i:09d}Z',
+            'paypal_payment_id': f'PAYID-{i:012d}', 'amount': str(10 + i % 1000),
+            'currency': 'USD', 'status': 'Completed',
+        }
+
+
+def fake_paypal(rows):
+    for i in range(rows):
+        amount = 10 + i % 1000
+        if i % 100 == 0:
+            amount += 1  # drift
+        yield {
+            'id': f'PAYID-{i:012d}', 'state': 'created', 'create_time': '2024-01-01T00:00:00Z',
+            'transactions': [{'amount': {'total': f'{amount}.00', 'currency': 'USD'}}],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--partitions', type=int, default=64)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as report:
+        summary = Reconciler(report, args.partitions).run(fake_disbursements(args.rows), fake_paypal(args.rows))
+    elapsed = time.perf_counter() - start
+
+    print(summary)
+    print(f'{args.rows} rows per side in {elapsed:.1f}s, {args.rows / elapsed:,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#
+# Peak memory and response size of a large list response, plain versus compressed.
+#
+# run: python3 bench_responses.py [--rows 10000]
+#
+# Builds --rows payment records shaped like the Disbursements items the payment history
+# and payments window endpoints return, then produces the response body the way
+# lambda_function does:
+#
+#   json.dumps         what the handlers did before: one string for the whole body
+#   gzip / br          json_response(): rows encoded into the compressor a row at a time,
+#                      base64 encoded for API Gateway (br only if brotli is installed)
+#
+# Peak is the tracemalloc peak while building the body, on top of the rows themselves.
+# "lambda payload" counts against the 6 MB response limit, "on the wire" is what the
+# client downloads once API Gateway has decoded the base64.
+#
+
+import argparse
+import base64
+import time
+import tracemalloc
+from decimal import Decimal
+
+import lambda_function
+import response_encoding
+
+
+def payment_rows(rows):
+    return [{
+        'customer_id': f'customer{i % 500:04d}',
+        'payment_id': f'2024-01-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:{i % 60:02d}.{i:06d}Z',
+        'email': f'customer{i % 500:04d}@example.com',
+        'amount': Decimal(f'{10 + i % 9000}.{i % 100:02d}'),
+        'currency': ('USD', 'EUR', 'INR', 'GBP', 'JPY')[i % 5],
+        'payment_method': 'paypal',
+        'status': 'Completed',
+        'paypal_payment_id': f'PAYID-M{i:012d}X',
+        'time_bucket': f'2024-01-{1 + i % 28:02d}T{i % 24:02d}#{i % 4}',
+    } for i in range(rows)]
+
+
+def measure(label, build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    resp = build()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    payload = len(resp['body'])
+    wire = len(base64.b64decode(resp['body'])) if resp.get('isBase64Encoded') else payload
+    print(f"{label:<10} {peak / 2 ** 20:>9.2f} MB {payload / 2 ** 20:>10.2f} MB {wire / 2 ** 20:>10.2f} MB "
+          f"{elapsed * 1000:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='large response memory and size')
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    payments = payment_rows(args.rows)
+    obj = {'customer_id': 'customer0001', 'count': len(payments), 'payments': payments}
+    lambda_function.RESPONSE_COMPRESSION = True
+
+    print(f"{args.rows} rows")
+    print(f"{'body':<10} {'peak':>12} {'lambda payload':>13} {'on the wire':>13} {'time':>11}")
+    measure('json.dumps', lambda: {'statusCode': 200, 'body': lambda_function.json.dumps(obj, default=str)})
+    encodings = ['gzip', 'br'] if response_encoding.brotli is not None else ['gzip']
+    for encoding in encodings:
+        event = {'headers': {'Accept-Encoding': encoding}}
+        measure(encoding, lambda: lambda_function.json_response(event, {'statusCode': 200}, obj))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,5 +4,12 @@
 
 pip install -r requirements.txt -t package/
 cp lambda_function.py package/
+# request body schemas, shared with API Gateway and the Flask app, and their compiler
+cp -r ../schemas package/
+cp ../validation.py package/
+# response compression, shared with the Flask app
+cp ../response_encoding.py package/
+# minor units helpers, shared with the Flask app
+cp ../money.py package/
 cd package && zip -r9 ../paymentApp-lambda.zip . && cd ..
 rm -rf package
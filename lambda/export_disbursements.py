@@ -0,0 +1,244 @@
+#
+# Export the Disbursements table with a parallel segmented Scan.
+#
+# run: python3 export_disbursements.py <out_dir> [--segments 16] [--workers 16]
+#                                      [--format ndjson|parquet] [--rows-per-file 100000]
+#
+# The table is split into --segments Scan segments (Segment/TotalSegments) that a pool
+# of --workers threads scans in parallel. Every segment streams its pages straight into
+# its own rolling part files, seg-<segment>-<file>.ndjson or .parquet, so memory stays at
+# one page per worker whatever the table size.
+#
+# Progress is checkpointed in <out_dir>/_checkpoint.json each time a part file is
+# closed: the segment's LastEvaluatedKey and the index of its next part file. Running
+# the same command again resumes every unfinished segment from its checkpoint and
+# rewrites the part file that was being written when the export stopped.
+#
+# parquet needs pyarrow (pip install pyarrow), ndjson has no extra dependency.
+#
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import boto3
+from botocore.config import Config
+from boto3.dynamodb.types import TypeDeserializer
+from lambda_function import logical_customer_id
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CHECKPOINT_FILE = '_checkpoint.json'
+
+# parquet needs one schema for every file, attributes outside it are only kept in ndjson
+EXPORT_COLUMNS = ['customer_id', 'payment_id', 'email', 'amount', 'currency',
+                  'payment_method', 'status', 'paypal_payment_id', 'time_bucket']
+
+_deserializer = TypeDeserializer()
+
+
+def scan_segment(client, table_name, segment, total_segments, start_key=None, **scan_options):
+    """
+    pages of one Scan segment as (items, last_evaluated_key), starting after start_key.
+    scan_options are passed on to Scan, e.g. ProjectionExpression.
+    """
+    scan_args = {
+        'TableName': table_name,
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        **scan_options,
+    }
+    if start_key:
+        scan_args['ExclusiveStartKey'] = start_key
+    while True:
+        resp = client.scan(**scan_args)
+        last_key = resp.get('LastEvaluatedKey')
+        yield resp.get('Items', []), last_key
+        if not last_key:
+            return
+        scan_args['ExclusiveStartKey'] = last_key
+
+
+def to_rows(items):
+    """
+    plain python rows of raw DynamoDB items, keyed by the customer_id without shard suffix.
+    """
+    for raw in items:
+        row = {k: _deserializer.deserialize(v) for k, v in raw.items()}
+        row['customer_id'] = logical_customer_id(row['customer_id'])
+        yield row
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+class NdjsonPartWriter:
+    """
+    one .ndjson part file, written line by line.
+    """
+    extension = 'ndjson'
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows):
+        count = 0
+        for row in rows:
+            self.file.write(json.dumps(row, default=_json_default, separators=(',', ':')))
+            self.file.write('\n')
+            count += 1
+        return count
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+class ParquetPartWriter:
+    """
+    one .parquet part file, a row group per Scan page.
+    """
+    extension = 'parquet'
+    schema = None
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise RuntimeError('parquet export needs pyarrow: pip install pyarrow')
+        if ParquetPartWriter.schema is None:
+            ParquetPartWriter.schema = pyarrow.schema([(name, pyarrow.string()) for name in EXPORT_COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, ParquetPartWriter.schema)
+
+    def write(self, rows):
+        columns = {name: [] for name in EXPORT_COLUMNS}
+        count = 0
+        for row in rows:
+            for name in EXPORT_COLUMNS:
+                value = row.get(name)
+                columns[name].append(None if value is None else str(value))
+            count += 1
+        if count:
+            self.writer.write_table(pyarrow.table(columns, schema=ParquetPartWriter.schema))
+        return count
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {'ndjson': NdjsonPartWriter, 'parquet': ParquetPartWriter}
+
+
+class Checkpoint:
+    """
+    per segment export progress, saved atomically to <out_dir>/_checkpoint.json.
+    """
+
+    def __init__(self, out_dir, total_segments, fmt):
+        self.path = os.path.join(out_dir, CHECKPOINT_FILE)
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state = json.load(f)
+            if self.state['total_segments'] != total_segments or self.state['format'] != fmt:
+                raise ValueError(f"{self.path} belongs to an export with {self.state['total_segments']} "
+                                 f"segments in {self.state['format']}, use the same settings to resume")
+        else:
+            self.state = {'total_segments': total_segments, 'format': fmt, 'segments': {}}
+
+    def segment(self, segment):
+        with self.lock:
+            return dict(self.state['segments'].get(str(segment),
+                        {'last_key': None, 'next_file': 0, 'rows': 0, 'done': False}))
+
+    def update(self, segment, progress):
+        with self.lock:
+            self.state['segments'][str(segment)] = progress
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+
+def export_segment(client, table_name, out_dir, segment, checkpoint, fmt, rows_per_file):
+    """
+    export one Scan segment into rolling part files, resuming from its checkpoint.
+    """
+    progress = checkpoint.segment(segment)
+    if progress['done']:
+        return progress['rows']
+
+    writer_class = WRITERS[fmt]
+    writer = None
+    rows_in_file = 0
+    pages = scan_segment(client, table_name, segment, checkpoint.state['total_segments'], progress['last_key'])
+    for items, last_key in pages:
+        if writer is None:
+            path = os.path.join(out_dir, f"seg-{segment:05d}-{progress['next_file']:05d}.{writer_class.extension}")
+            writer = writer_class(path)
+        rows_in_file += writer.write(to_rows(items))
+
+        # close and checkpoint only on page boundaries, so a resumed scan starts
+        # exactly after the last row of the last closed file
+        if last_key is None or rows_in_file >= rows_per_file:
+            writer.close()
+            writer = None
+            progress = {
+                'last_key': last_key,
+                'next_file': progress['next_file'] + 1,
+                'rows': progress['rows'] + rows_in_file,
+                'done': last_key is None,
+            }
+            checkpoint.update(segment, progress)
+            rows_in_file = 0
+    return progress['rows']
+
+
+def export_table(client, table_name, out_dir, total_segments, workers, fmt='ndjson', rows_per_file=100000):
+    """
+    export the table with total_segments Scan segments on a pool of workers threads.
+    Returns the number of rows exported by all runs so far.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f'unknown export format {fmt}, expected one of {sorted(WRITERS)}')
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(out_dir, total_segments, fmt)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(export_segment, client, table_name, out_dir, segment,
+                               checkpoint, fmt, rows_per_file)
+                   for segment in range(total_segments)]
+        return sum(f.result() for f in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='parallel export of the Disbursements table')
+    parser.add_argument('out_dir')
+    parser.add_argument('--table', default='Disbursements')
+    parser.add_argument('--segments', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--format', choices=sorted(WRITERS), default='ndjson')
+    parser.add_argument('--rows-per-file', type=int, default=100000)
+    args = parser.parse_args()
+
+    # the low level client is thread safe, give it a connection per worker
+    client = boto3.client('dynamodb', config=Config(max_pool_connections=args.workers))
+    rows = export_table(client, args.table, args.out_dir, args.segments, args.workers,
+                        args.format, args.rows_per_file)
+    print(f'exported {rows} rows of {args.table} to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,119 @@
 import json
+import base64
+import hashlib
 import boto3
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 import os
+import random
+import heapq
+import time
 import requests
-from datetime import datetime, timezone
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 
-def lambda_handler(event, context):
+# validation.py, response_encoding.py, money.py and the schemas are shared with the
+# Flask app and live at the repo root, build_lambda_zip.sh copies them next to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from validation import load_validators
+from response_encoding import accepted_encoding, compressed, json_chunks, read_head
+# integer minor units, process_payment turns the request amount into them once and
+# derives the string PayPal and Disbursements get ('10.50', '1000' for JPY), see money.py
+from money import minor_units_decimal, minor_units_str, to_minor_units
+
+# GSI on Customers.email (see deply/aws/dynamodb.tf)
+CUSTOMER_EMAIL_INDEX = 'email-index'
+
+# Email uniqueness markers live in the Customers table itself, keyed 'email#<email>'.
+# customer_id is alphanumeric only (API Gateway model), so a marker never collides with
+# a real customer, and markers carry no 'email' attribute so they stay out of the GSI.
+EMAIL_MARKER_PREFIX = 'email#'
+
+# Write sharding of Disbursements for hot payees. A customer record with
+# disbursement_shards = N > 1 spreads its payment writes over the partition keys
+# customer_id, customer_id#1, ..., customer_id#N-1. disbursement_shards_max keeps the
+# highest N ever used, so reads still cover shards written before N was lowered.
+# Shard 0 is the bare customer_id: unsharded history never needs rewriting.
+DISBURSEMENT_SHARD_SEPARATOR = '#'
+MAX_SHARD_QUERY_WORKERS = 16
+
+_deserializer = TypeDeserializer()
+
+# Cross-customer time-window queries. Every payment carries
+# time_bucket = '<hour or day of its payment_id>#<shard>', the partition key of the
+# time-bucket-index GSI whose sort key is payment_id. Granularity and shard count are
+# set in deply/aws (disbursement_time_bucket*) and passed in as environment variables.
+# Shards spread the writes of the current bucket over several GSI partitions.
+TIME_BUCKET_INDEX = 'time-bucket-index'
+TIME_BUCKET_FORMATS = {'hour': '%Y-%m-%dT%H', 'day': '%Y-%m-%d'}
+TIME_BUCKET_STEPS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+DEFAULT_TIME_WINDOW_LIMIT = 100
+MAX_TIME_WINDOW_LIMIT = 1000
+MAX_TIME_WINDOW_BUCKETS = 24 * 31
+MAX_TIME_WINDOW_QUERY_WORKERS = 16
+
+# Conditional GET on customer reads. add_customer bumps a version attribute on every
+# write and the ETag is derived from it (a hash of the body for records written before
+# versions existed). A client sending If-None-Match with the current ETag gets a 304
+# without a body. Cache-Control lets clients and shared caches (CDNs, the API Gateway
+# stage cache when it is enabled in deply/aws) reuse a record for CUSTOMER_MAX_AGE
+# seconds, api_cache_ttl in deply/aws, and revalidate it after that.
+CUSTOMER_MAX_AGE = int(os.environ.get('CUSTOMER_MAX_AGE', 60))
+
+# Batch customer reads. BatchGetItem takes at most 100 keys, so a request is split into
+# chunks of 100 read concurrently. Keys DynamoDB leaves unprocessed (throttling) are
+# retried with exponential backoff and full jitter.
+BATCH_GET_CHUNK_SIZE = 100
+MAX_BATCH_GET_WORKERS = 10
+BATCH_GET_MAX_ATTEMPTS = 6
+BATCH_GET_BACKOFF_BASE = 0.05
+BATCH_GET_BACKOFF_CAP = 1.0
+
+# In-process cache of Customers items, kept for the life of the Lambda container.
+# CUSTOMER_CACHE_TTL (seconds, set in deply/aws) bounds how stale an entry may get,
+# 0 turns the cache off. add_customer evicts the entry it writes, but other containers
+# keep serving their copy until it expires.
+CUSTOMER_CACHE_MAX_ITEMS = 10000
+_customer_cache = {}
+
+# Disbursements journal queue. Once PayPal has authorized a payment its record must not
+# be lost to a DynamoDB outage. With DISBURSEMENT_QUEUE_URL set (enable_disbursement_queue
+# in deply/aws) process_payment sends the record to SQS, which keeps it durably, instead
+# of writing Disbursements on the request path. This function also consumes the queue
+# (SQS event source mapping) and writes the records with BatchWriteItem. Messages it
+# could not write are returned as batchItemFailures, SQS redelivers them and finally
+# moves them to the dead letter queue. A failed send falls back to the direct put_item.
+BATCH_WRITE_CHUNK_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = 6
+_serializer = TypeSerializer()
+_sqs_client = None
+
+# Running payout aggregates per customer, one PayoutSummaries item each:
+# payment_count, count_<CUR>, total_<CUR> and last_payment_at. Maintained with an
+# atomic UpdateItem ADD on every successful payment, so reading a summary is a
+# single get_item however long the payment history is. With the journal queue on the
+# queue consumer adds a payment once its record is written, not process_payment. The table is declared in
+# deply/aws/dynamodb.tf and rebuild_payout_summaries.py backfills it.
+
+def route_request(event, context):
     """
     Lambda handler function to route based on resource paths and HTTP methods.
     """
+    # batches of the Disbursements journal queue, not API Gateway requests
+    records = event.get('Records')
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        return write_queued_disbursements(event, context)
+
+    return compress_response(event, dispatch_request(event, context))
+
+
+def dispatch_request(event, context):
+    """
+    call the handler of the resource path and HTTP method of an API Gateway request.
+    """
     # extract resource path and API method from the event object
     resource_path = event.get('resource', '')
     http_method = event.get('httpMethod', '')
@@ -24,12 +128,27 @@ def lambda_handler(event, context):
         case '/v1/api/customer' if http_method == 'POST':
             return add_customer(event, context)
 
+        case '/v1/api/customer' if http_method == 'GET':
+            return get_customer_by_email(event, context)
+
         case '/v1/api/customer/{customer_id}' if http_method == 'GET':
             return get_customer(event, context)
 
+        case '/v1/api/customers:batchGet' if http_method == 'POST':
+            return batch_get_customers(event, context)
+
+        case '/v1/api/customer/{customer_id}/summary' if http_method == 'GET':
+            return get_payout_summary(event, context)
+
         case '/v1/api/payments' if http_method == 'POST':
             return process_payment(event, context)
 
+        case '/v1/api/payments' if http_method == 'GET':
+            return get_payments_in_window(event, context)
+
+        case '/v1/api/payment/{customer_id}' if http_method == 'GET':
+            return get_payment_history(event, context)
+
         case _:
             lambda_resp = {}
             lambda_resp['statusCode'] = 404
@@ -37,23 +156,215 @@ def lambda_handler(event, context):
             return lambda_resp
 
 
+# On-demand profiling. PROFILE_SAMPLE_RATE (0 to 1) profiles that fraction of
+# invocations, PROFILE_HEADER=1 also profiles requests sent with 'X-Profile: 1'.
+# A profiled invocation runs under cProfile and tracemalloc, logs one compact JSON line
+# (duration, top functions, Python peak and process peak RSS against the memory size
+# from deply/aws/lambda.tf) and dumps the raw profile to PROFILE_DIR for pstats/snakeviz.
+# With both switches off lambda_handler is route_request itself, so there is no cost.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', '') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_MAX_FILES = 20
+PROFILE_TOP_FUNCTIONS = 15
+
+
+def profile_requested(event):
+    if PROFILE_HEADER and request_header(event, 'X-Profile') == '1':
+        return True
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def profiled_handler(event, context):
+    """
+    lambda_handler when profiling is switched on: profiles the sampled invocations.
+    """
+    if not profile_requested(event):
+        return route_request(event, context)
+
+    import cProfile
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return route_request(event, context)
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        label = f"{event.get('httpMethod', '')} {event.get('resource', '')}"
+        print(json.dumps(profile_summary(profiler, label, duration, python_peak), separators=(',', ':')))
+        dump_profile(profiler, label)
+
+
+def profile_summary(profiler, label, duration, python_peak):
+    """
+    compact summary of a profiled invocation: the slowest functions by cumulative
+    time and peak memory against the Lambda memory size.
+    """
+    import pstats
+    import resource
+
+    stats = pstats.Stats(profiler)
+    top = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+    # ru_maxrss is in KB on Linux and covers the life of the container, not just this call
+    rss_peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    budget_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 128))
+    return {
+        'profile': label,
+        'duration_ms': round(duration * 1000, 2),
+        'python_peak_kb': round(python_peak / 1024, 1),
+        'rss_peak_mb': round(rss_peak_mb, 1),
+        'memory_budget_mb': budget_mb,
+        'memory_used_pct': round(100 * rss_peak_mb / budget_mb, 1),
+        # [function, calls, own ms, cumulative ms]
+        'top': [[f'{os.path.basename(filename)}:{line}:{name}', calls, round(own * 1000, 3), round(cumulative * 1000, 3)]
+                for (filename, line, name), (_, calls, own, cumulative, _) in top],
+    }
+
+
+def dump_profile(profiler, label):
+    """
+    write the raw profile under PROFILE_DIR, keeping the newest PROFILE_MAX_FILES.
+    """
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = ''.join(c if c.isalnum() else '_' for c in label).strip('_')
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f'{time.time_ns()}-{name}.prof'))
+        files = sorted(os.listdir(PROFILE_DIR))
+        for old in files[:-PROFILE_MAX_FILES]:
+            os.remove(os.path.join(PROFILE_DIR, old))
+    except OSError as e:
+        print(f'dump_profile() error: {e}')
+
+
+lambda_handler = profiled_handler if PROFILE_SAMPLE_RATE > 0 or PROFILE_HEADER else route_request
+
+
+# Request body validation. API Gateway validates bodies against the request models, the
+# JSON schemas in schemas/ at the repo root. The handlers check the same schemas again
+# with the compiler shared with the Flask app (validation.py), so a direct invocation, a
+# test event or a model missing from a method cannot get an unchecked body through, and
+# every field error is reported at once.
+REQUEST_VALIDATORS = load_validators()
+
+
+def request_body(event):
+    """
+    the parsed JSON body of event, None when it is missing or not JSON.
+    """
+    body = event.get('body')
+    try:
+        if body and event.get('isBase64Encoded'):
+            # binary_media_types = ["*/*"] makes API Gateway pass every body base64 encoded
+            body = base64.b64decode(body)
+        return json.loads(body or 'null')
+    except ValueError:
+        return None
+
+
+def invalid_request(api_resp, errors):
+    """
+    400 with the message API Gateway's request validator uses, plus every field error.
+    """
+    api_resp['statusCode'] = 400
+    api_resp['body'] = json.dumps({'message': 'Invalid request body', 'errors': errors})
+    return api_resp
+
+
+# Response compression. With RESPONSE_COMPRESSION=1 (enable_response_compression in
+# deply/aws, which also sets binary_media_types = ["*/*"] on the REST API) a response of
+# at least RESPONSE_COMPRESSION_MIN_BYTES is compressed with br (when the brotli module
+# is packaged) or gzip, as negotiated through Accept-Encoding. The bytes are returned
+# base64 encoded with isBase64Encoded, and API Gateway decodes them into a binary body.
+# Without binary_media_types API Gateway would hand clients the base64 text, so the
+# switch only goes on together with the terraform setting. With */* API Gateway also
+# passes request bodies base64 encoded, request_body() decodes them.
+# The negotiation and the row at a time JSON encoder are shared with the Flask app
+# (response_encoding.py at the repo root). List responses (payment history, payments in
+# a window, batch get) go through json_response(), see there for what that saves.
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '') == '1'
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', 1024))
+# json.dumps(obj, default=str), the body format of every handler
+JSON_ENCODER = json.JSONEncoder(default=str)
+
+
+def response_encoding(event):
+    """
+    'br', 'gzip' or None: the best encoding the request's Accept-Encoding takes, by q-value.
+    """
+    if not RESPONSE_COMPRESSION:
+        return None
+    return accepted_encoding(request_header(event, 'Accept-Encoding'))
+
+
+def set_compressed_body(api_resp, encoding, compressed):
+    api_resp['body'] = base64.b64encode(compressed).decode('ascii')
+    api_resp['isBase64Encoded'] = True
+    headers = api_resp.setdefault('headers', {})
+    headers['Content-Encoding'] = encoding
+    headers['Vary'] = 'Accept-Encoding'
+    return api_resp
+
+
+def json_response(event, api_resp, obj):
+    """
+    set obj as the JSON body of api_resp, compressed when the client takes it and the body
+    reaches RESPONSE_COMPRESSION_MIN_BYTES.
+
+    the JSON text is encoded a row at a time straight into the compressor, so the full
+    uncompressed text never exists as one string. That is all it saves: a proxy
+    integration returns the body in one piece, so obj (the rows already read from
+    DynamoDB) and the whole compressed body, then its base64 text, are still held in
+    memory. Peak memory grows with the size of the result, which the page limits bound.
+    """
+    encoding = response_encoding(event)
+    if encoding is None:
+        api_resp['body'] = json.dumps(obj, default=str)
+        return api_resp
+
+    chunks = (chunk.encode() for chunk in json_chunks(obj, JSON_ENCODER))
+    head, done = read_head(chunks, RESPONSE_COMPRESSION_MIN_BYTES)
+    if done:
+        api_resp['body'] = b''.join(head).decode()
+        return api_resp
+    return set_compressed_body(api_resp, encoding, b''.join(compressed(head, chunks, encoding)))
+
+
+def compress_response(event, api_resp):
+    """
+    compress the body of a handler response that json_response() did not already handle.
+    """
+    body = api_resp.get('body') if isinstance(api_resp, dict) else None
+    if not isinstance(body, str) or api_resp.get('isBase64Encoded') or api_resp.get('statusCode') != 200 or \
+            len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return api_resp
+    encoding = response_encoding(event)
+    if encoding is None:
+        return api_resp
+    return set_compressed_body(api_resp, encoding, b''.join(compressed([body.encode()], (), encoding)))
+
+
 def add_customer(event, context):
     """
     process POST method on /v1/api/customer to add a new customer.
     """
-    body = json.loads(event['body'])
-    customer_id = body.get('customer_id', '').strip()
-    customer_email = body.get('email', '').strip()
+    body = request_body(event)
     api_resp = {}
     api_resp['headers'] = {}
     api_resp['headers']['Content-Type'] = 'application/json'
 
     # sanitise params
-    if not customer_id or not customer_email:
-        api_resp['statusCode'] = 400
-        api_resp['body'] = json.dumps({'message': f'customer_id and email fields are required'})
-        return api_resp
-    
+    errors = REQUEST_VALIDATORS['customer_request'](body)
+    if errors:
+        return invalid_request(api_resp, errors)
+    customer_id = body['customer_id']
+    customer_email = body['email']
+
     # store customer record in DynamoDB
     customer_record = {
         'customer_id': customer_id,
@@ -63,12 +374,38 @@ def add_customer(event, context):
     try:
         dynamodb = boto3.resource('dynamodb')
         customer_table = dynamodb.Table('Customers')
-        put_item_resp = customer_table.put_item(Item=customer_record)
-        api_resp['statusCode'] = put_item_resp['ResponseMetadata']['HTTPStatusCode']
+
+        # claim the email before writing the customer. A single conditional write
+        # on the marker item, no scan and no GSI read (GSIs are eventually consistent).
+        if not claim_customer_email(customer_table, customer_id, customer_email):
+            api_resp['statusCode'] = 409
+            api_resp['body'] = json.dumps({'message': f'{customer_email} is already registered to another customer'})
+            return api_resp
+
+        # update rather than put: keeps attributes such as disbursement_shards and
+        # bumps the version the ETag of customer reads is built from
+        update_item_resp = customer_table.update_item(
+            Key={'customer_id': customer_id},
+            UpdateExpression='SET email = :email ADD version :one',
+            ExpressionAttributeValues={':email': customer_email, ':one': 1},
+            ReturnValues='ALL_OLD'
+        )
+        evict_cached_customer(customer_id)
+
+        # customer changed email, free the old one
+        old_record = update_item_resp.get('Attributes', {})
+        old_email = old_record.get('email')
+        if old_email and old_email != customer_email:
+            release_customer_email(customer_table, customer_id, old_email)
+
+        version = int(old_record.get('version', 0)) + 1
+        api_resp['headers']['ETag'] = version_etag(version)
+        api_resp['statusCode'] = update_item_resp['ResponseMetadata']['HTTPStatusCode']
         api_resp['body'] = json.dumps({
             'message': 'customer added successfully',
             'customer_id' : customer_id,
             'email': customer_email,
+            'version': version,
             })
     except ClientError as e:
         api_resp['statusCode'] = 500
@@ -81,6 +418,81 @@ def add_customer(event, context):
     return api_resp
 
 
+def claim_customer_email(customer_table, customer_id, email):
+    """
+    claim email for customer_id. Returns False if another customer holds it.
+    """
+    # Re-claiming our own email passes the condition, so retrying a failed
+    # add_customer is safe even if the marker was written the first time.
+    try:
+        customer_table.put_item(
+            Item={'customer_id': EMAIL_MARKER_PREFIX + email, 'owner_id': customer_id},
+            ConditionExpression=Attr('customer_id').not_exists() | Attr('owner_id').eq(customer_id)
+        )
+    except ClientError as e:
+        if e.response['Error'].get('Code') == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def release_customer_email(customer_table, customer_id, email):
+    """
+    drop the uniqueness marker of an email customer_id no longer uses.
+    """
+    try:
+        customer_table.delete_item(
+            Key={'customer_id': EMAIL_MARKER_PREFIX + email},
+            ConditionExpression=Attr('owner_id').eq(customer_id)
+        )
+    except ClientError as e:
+        # a stale marker only blocks the old email, don't fail the request for it
+        print(f"release_customer_email() error: {e.response['Error']['Message']}")
+
+
+def get_customer_by_email(event, context):
+    """
+    process GET method on /v1/api/customer?email= to look up customers by email.
+    """
+    api_resp = {}
+    email = (event.get('queryStringParameters') or {}).get('email', '').strip()
+
+    if not email:
+        api_resp['statusCode'] = 400
+        api_resp['body'] = json.dumps({'message': 'email query parameter is required'})
+        return api_resp
+
+    try:
+        dynamodb = boto3.resource('dynamodb')
+        customer_table = dynamodb.Table('Customers')
+        # Query on the email GSI reads only the matching index entries, never the table
+        query_resp = customer_table.query(
+            IndexName=CUSTOMER_EMAIL_INDEX,
+            KeyConditionExpression=Key('email').eq(email)
+        )
+        items = query_resp.get('Items', [])
+        if items:
+            # more than one match is only possible for customers added before
+            # email uniqueness was enforced
+            api_resp['statusCode'] = 200
+            api_resp['body'] = json.dumps({
+                'email': email,
+                'customers': [{'customer_id': item['customer_id'], 'email': item['email']} for item in items]
+            })
+        else:
+            api_resp['statusCode'] = 404
+            api_resp['body'] = json.dumps({'message' : f'{email} not in records'})
+    except ClientError as e:
+        api_resp['statusCode'] = 500
+        # Never send e.response['Error']['Message'] to clients, because it may contain
+        # sensitive information such as AWS Account number. Instead, log to CloudWatch
+        # for debugging purposes and send generic error to clients.
+        print(f"get_customer_by_email() error: {e.response['Error']['Message']}")
+        api_resp['body'] = json.dumps({'message' : 'Internal server error'})
+
+    return api_resp
+
+
 def get_customer(event, context):
     """
     process GET method on /v1/api/customer/{customer_id} to retrieve a customer record.
@@ -95,16 +507,37 @@ def get_customer(event, context):
         api_resp['body'] = json.dumps({'message': 'customer_id is required'})
         return api_resp
 
+    # email uniqueness markers are not customers
+    if customer_id.startswith(EMAIL_MARKER_PREFIX):
+        api_resp['statusCode'] = 404
+        api_resp['body'] = json.dumps({'message' : f'{customer_id} not in records'})
+        return api_resp
+
     try:
-        dynamodb = boto3.resource('dynamodb')
-        customer_table = dynamodb.Table('Customers')
-        get_item_resp = customer_table.get_item(Key={'customer_id': customer_id})
-        if 'Item' in get_item_resp:
-            api_resp['statusCode'] = 200
-            api_resp['body'] = json.dumps({
-                'customer_id': get_item_resp['Item']['customer_id'],
-                'email': get_item_resp['Item']['email']
+        item = cached_customer(customer_id)
+        if item is None:
+            dynamodb = boto3.resource('dynamodb')
+            customer_table = dynamodb.Table('Customers')
+            item = customer_table.get_item(Key={'customer_id': customer_id}).get('Item')
+            if item is not None:
+                cache_customer(item)
+        if item is not None:
+            body = json.dumps({
+                'customer_id': item['customer_id'],
+                'email': item['email']
             })
+            etag = customer_etag(item, body)
+            api_resp['headers'] = {
+                'Content-Type': 'application/json',
+                'ETag': etag,
+                'Cache-Control': f'max-age={CUSTOMER_MAX_AGE}, must-revalidate',
+            }
+            if etag_matches(request_header(event, 'If-None-Match'), etag):
+                api_resp['statusCode'] = 304
+                api_resp['body'] = ''
+            else:
+                api_resp['statusCode'] = 200
+                api_resp['body'] = body
         else:
             api_resp['statusCode'] = 404
             api_resp['body'] = json.dumps({'message' : f'{customer_id} not in records'})
@@ -119,25 +552,198 @@ def get_customer(event, context):
     print(f'api_resp: {api_resp}')
     return api_resp
 
+
+def version_etag(version):
+    return f'"v{int(version)}"'
+
+
+def customer_etag(item, body):
+    """
+    ETag of a customer response: its version, or a hash of the body for unversioned records.
+    """
+    if 'version' in item:
+        return version_etag(item['version'])
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    weak comparison of an If-None-Match header against etag, as RFC 9110 asks for.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+def request_header(event, name):
+    """
+    request header value, looked up case-insensitively (clients and API Gateway vary).
+    """
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def batch_get_customers(event, context):
+    """
+    process POST method on /v1/api/customers:batchGet to retrieve many customer records
+    in one call. Body: {"customer_ids": [...]}.
+    """
+    api_resp = {}
+
+    # 1 to 1000 ids (maxItems of schemas/customers_batch_get.json), each a valid customer_id
+    body = request_body(event)
+    errors = REQUEST_VALIDATORS['customers_batch_get'](body)
+    if errors:
+        return invalid_request(api_resp, errors)
+
+    # dedupe, keeping the order of first appearance
+    customer_ids = list(dict.fromkeys(body['customer_ids']))
+
+    found = {}
+    to_fetch = []
+    for customer_id in customer_ids:
+        # email uniqueness markers are not customers
+        if not customer_id or customer_id.startswith(EMAIL_MARKER_PREFIX):
+            continue
+        item = cached_customer(customer_id)
+        if item is not None:
+            found[customer_id] = item
+        else:
+            to_fetch.append(customer_id)
+
+    try:
+        fetched, unprocessed = batch_get_customer_items(boto3.resource('dynamodb').meta.client, to_fetch)
+    except ClientError as e:
+        api_resp['statusCode'] = 500
+        # Never send e.response['Error']['Message'] to clients, because it may contain
+        # sensitive information such as AWS Account number. Instead, log to CloudWatch
+        # for debugging purposes and send generic error to clients.
+        print(f"batch_get_customers() error: {e.response['Error']['Message']}")
+        api_resp['body'] = json.dumps({'message' : 'Internal server error'})
+        return api_resp
+
+    for item in fetched.values():
+        cache_customer(item)
+    found.update(fetched)
+
+    print(f'batch get: {len(customer_ids)} ids, {len(customer_ids) - len(to_fetch)} from cache, '
+          f'{len(fetched)} fetched, {len(unprocessed)} unprocessed')
+
+    unprocessed = set(unprocessed)
+    resp_body = {
+        'customers': [{'customer_id': found[customer_id]['customer_id'], 'email': found[customer_id]['email']}
+                      for customer_id in customer_ids if customer_id in found],
+        'missing': [customer_id for customer_id in customer_ids
+                    if customer_id not in found and customer_id not in unprocessed],
+    }
+    # still throttled after every retry: neither found nor missing, the caller retries them
+    if unprocessed:
+        resp_body['unprocessed'] = [customer_id for customer_id in customer_ids if customer_id in unprocessed]
+    api_resp['statusCode'] = 200
+    return json_response(event, api_resp, resp_body)
+
+
+def batch_get_customer_items(client, customer_ids):
+    """
+    Customers items of customer_ids, read with BatchGetItem chunks in parallel.
+    Returns ({customer_id: item} of those found, [ids still unprocessed after all retries]).
+    """
+    chunks = [customer_ids[i:i + BATCH_GET_CHUNK_SIZE] for i in range(0, len(customer_ids), BATCH_GET_CHUNK_SIZE)]
+    if not chunks:
+        return {}, []
+    if len(chunks) == 1:
+        results = [batch_get_chunk(client, chunks[0])]
+    else:
+        # the low level client is thread safe, the resource is not
+        with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_BATCH_GET_WORKERS)) as pool:
+            results = list(pool.map(lambda chunk: batch_get_chunk(client, chunk), chunks))
+
+    found = {}
+    unprocessed = []
+    for chunk_found, chunk_unprocessed in results:
+        found.update(chunk_found)
+        unprocessed.extend(chunk_unprocessed)
+    return found, unprocessed
+
+
+def batch_get_chunk(client, customer_ids):
+    """
+    one BatchGetItem of up to 100 customers, retrying UnprocessedKeys.
+    """
+    request_items = {'Customers': {'Keys': [{'customer_id': {'S': customer_id}} for customer_id in customer_ids]}}
+    found = {}
+    for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+        resp = client.batch_get_item(RequestItems=request_items)
+        for raw in resp.get('Responses', {}).get('Customers', []):
+            item = {k: _deserializer.deserialize(v) for k, v in raw.items()}
+            found[item['customer_id']] = item
+        request_items = resp.get('UnprocessedKeys') or {}
+        if not request_items.get('Customers', {}).get('Keys'):
+            return found, []
+        if attempt + 1 < BATCH_GET_MAX_ATTEMPTS:
+            time.sleep(random.uniform(0, min(BATCH_GET_BACKOFF_CAP, BATCH_GET_BACKOFF_BASE * 2 ** attempt)))
+    return found, [key['customer_id']['S'] for key in request_items['Customers']['Keys']]
+
+
+def customer_cache_ttl():
+    return float(os.environ.get('CUSTOMER_CACHE_TTL', 0))
+
+
+def cached_customer(customer_id):
+    """
+    Customers item from the in-process cache, None when absent, expired or the cache is off.
+    """
+    entry = _customer_cache.get(customer_id)
+    if entry is None:
+        return None
+    if entry[0] < time.monotonic():
+        _customer_cache.pop(customer_id, None)
+        return None
+    return entry[1]
+
+
+def cache_customer(item):
+    ttl = customer_cache_ttl()
+    if ttl <= 0:
+        return
+    if len(_customer_cache) >= CUSTOMER_CACHE_MAX_ITEMS:
+        # dicts keep insertion order, drop the oldest entry
+        _customer_cache.pop(next(iter(_customer_cache)), None)
+    _customer_cache[item['customer_id']] = (time.monotonic() + ttl, item)
+
+
+def evict_cached_customer(customer_id):
+    _customer_cache.pop(customer_id, None)
+
  
 def process_payment(event, context):
     """
     process POST method on /v1/api/payments to process payment to a customer.
     """
-    body = json.loads(event['body'])
-    customer_id = body.get('customer_id', '')
-    email = body.get('email', '')
-    amount = body.get('amount', 0)
-    currency = body.get('currency', 'USD')
+    body = request_body(event)
 
     api_resp = {}
     api_resp['headers'] = {}
     api_resp['headers']['Content-Type'] = 'application/json'
 
-    if not customer_id or not email:
-        api_resp['statusCode'] = 400
-        api_resp['body'] = json.dumps({'message': 'customer_id and email required'})
-        return api_resp
+    errors = REQUEST_VALIDATORS['payments_request'](body)
+    if errors:
+        return invalid_request(api_resp, errors)
+    customer_id = body['customer_id']
+    email = body['email']
+    amount = body['amount']
+    currency = body['currency']
+    # integer minor units from here on, JPY takes no decimals
+    try:
+        amount_minor = to_minor_units(amount, currency)
+    except ValueError as e:
+        return invalid_request(api_resp, [f'amount: {e}'])
 
     dynamodb = boto3.resource('dynamodb')
 
@@ -195,7 +801,7 @@ def process_payment(event, context):
         },
         "transactions": [{
             "amount": {
-                "total": Decimal(str(amount)),
+                "total": minor_units_str(amount_minor, currency),
                 "currency": currency,
             },
             "description": "Test payment"
@@ -226,21 +832,33 @@ def process_payment(event, context):
     # TBD - make this uniqueue
     payment_id = datetime.now(timezone.utc).isoformat() + "Z"
 
-    # Store payment record in DynamoDB
+    # Store payment record in DynamoDB. Hot payees write to one of their shards.
     payment_record = {
-        'customer_id': customer_id,
+        'customer_id': disbursement_partition_key(customer_id, pick_disbursement_shard(item)),
         'email': email,
         'payment_id': payment_id,
-        'amount': str(amount),
+        'amount': minor_units_str(amount_minor, currency),
         'payment_method': 'paypal',
         'status': 'Completed',
         'currency': currency,
+        'time_bucket': payment_time_bucket(payment_id),
         #'timestamp': str(context.aws_request_id)
     }
+    # PayPal's id of the authorization, the join key for reconcile_paypal.py
+    paypal_payment_id = paypal_response_id(paypal_resp)
+    if paypal_payment_id:
+        payment_record['paypal_payment_id'] = paypal_payment_id
     try:
-        disbursement_table = dynamodb.Table('Disbursements')
-        resp = disbursement_table.put_item(Item=payment_record)
-        api_resp['statusCode'] = resp['ResponseMetadata']['HTTPStatusCode']
+        # with the journal queue on, the queue consumer writes Disbursements and the payout
+        # summary, so the request makes no DynamoDB write at all
+        if queue_disbursement(payment_record):
+            api_resp['statusCode'] = 200
+        else:
+            disbursement_table = dynamodb.Table('Disbursements')
+            resp = disbursement_table.put_item(Item=payment_record)
+            api_resp['statusCode'] = resp['ResponseMetadata']['HTTPStatusCode']
+            record_payout_summary(dynamodb, customer_id, payment_id, minor_units_decimal(amount_minor, currency),
+                                  currency)
         api_resp['body'] = json.dumps({
             'message' : f'{customer_id} payment authorization successful',
             'customer_id' : customer_id,
@@ -261,6 +879,473 @@ def process_payment(event, context):
 
     return api_resp
 
+def queue_disbursement(payment_record):
+    """
+    send a payment record to the Disbursements journal queue. False when the queue is off
+    or the send failed, the caller then writes the record itself.
+    """
+    global _sqs_client
+    queue_url = os.environ.get('DISBURSEMENT_QUEUE_URL', '')
+    if not queue_url:
+        return False
+    try:
+        # kept for the life of the container, creating a client costs more than the send
+        if _sqs_client is None:
+            _sqs_client = boto3.client('sqs')
+        _sqs_client.send_message(QueueUrl=queue_url, MessageBody=json.dumps(payment_record, default=str))
+        return True
+    except ClientError as e:
+        print(f"queue_disbursement() error for {payment_record['payment_id']}: {e.response['Error']['Message']}")
+        return False
+
+
+def write_queued_disbursements(event, context):
+    """
+    write the payment records of an SQS batch of the journal queue to Disbursements, then
+    add the written ones to their payout summaries.
+    """
+    records = {}
+    message_ids = {}
+    failures = []
+    for message in event['Records']:
+        try:
+            record = json.loads(message['body'])
+            key = (record['customer_id'], record['payment_id'])
+        except (ValueError, KeyError, TypeError):
+            # left to SQS, it ends up in the dead letter queue
+            print(f"write_queued_disbursements() malformed message {message.get('messageId')}")
+            failures.append(message['messageId'])
+            continue
+        # SQS delivers at least once, BatchWriteItem refuses duplicate keys in one request
+        records[key] = record
+        message_ids.setdefault(key, []).append(message['messageId'])
+
+    dynamodb = boto3.resource('dynamodb')
+    unprocessed = batch_write_disbursements(dynamodb.meta.client, list(records.values()))
+    for key in unprocessed:
+        failures.extend(message_ids[key])
+    # only records that were written: the others are redelivered and counted then. A
+    # summary update that fails is logged, rebuild_payout_summaries.py fixes it
+    unprocessed = set(unprocessed)
+    for key, record in records.items():
+        if key not in unprocessed:
+            record_payout_summary(dynamodb, logical_customer_id(record['customer_id']), record['payment_id'],
+                                  record['amount'], record['currency'])
+
+    print(f'journal queue: {len(event["Records"])} messages, {len(records) - len(unprocessed)} written, '
+          f'{len(failures)} failed')
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
+
+def batch_write_disbursements(client, records):
+    """
+    put records into Disbursements with BatchWriteItem, 25 per request, retrying
+    UnprocessedItems. Returns the (customer_id, payment_id) keys not written.
+    """
+    unprocessed = []
+    for i in range(0, len(records), BATCH_WRITE_CHUNK_SIZE):
+        chunk = records[i:i + BATCH_WRITE_CHUNK_SIZE]
+        request_items = {'Disbursements': [
+            {'PutRequest': {'Item': {k: _serializer.serialize(v) for k, v in record.items()}}} for record in chunk
+        ]}
+        try:
+            for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+                resp = client.batch_write_item(RequestItems=request_items)
+                request_items = resp.get('UnprocessedItems') or {}
+                if not request_items.get('Disbursements'):
+                    break
+                if attempt + 1 < BATCH_WRITE_MAX_ATTEMPTS:
+                    time.sleep(random.uniform(0, min(BATCH_GET_BACKOFF_CAP, BATCH_GET_BACKOFF_BASE * 2 ** attempt)))
+            unprocessed.extend((put['PutRequest']['Item']['customer_id']['S'], put['PutRequest']['Item']['payment_id']['S'])
+                               for put in request_items.get('Disbursements', []))
+        except ClientError as e:
+            print(f"batch_write_disbursements() error: {e.response['Error']['Message']}")
+            unprocessed.extend((record['customer_id'], record['payment_id']) for record in chunk)
+    return unprocessed
+
+
+def get_payment_history(event, context):
+    """
+    process GET method on /v1/api/payment/{customer_id} to list the payments of a customer.
+    """
+    api_resp = {}
+    customer_id = (event.get('pathParameters') or {}).get('customer_id', '').strip()
+
+    if not customer_id:
+        api_resp['statusCode'] = 400
+        api_resp['body'] = json.dumps({'message': 'customer_id is required'})
+        return api_resp
+
+    try:
+        dynamodb = boto3.resource('dynamodb')
+        customer_table = dynamodb.Table('Customers')
+        get_item_resp = customer_table.get_item(Key={'customer_id': customer_id})
+        item = get_item_resp.get('Item')
+        if item is None or customer_id.startswith(EMAIL_MARKER_PREFIX):
+            api_resp['statusCode'] = 404
+            api_resp['body'] = json.dumps({'message' : f'{customer_id} not in records'})
+            return api_resp
+
+        payments = query_payment_history(dynamodb, customer_id, item)
+        api_resp['statusCode'] = 200
+        json_response(event, api_resp, {
+            'customer_id': customer_id,
+            'count': len(payments),
+            'payments': payments
+        })
+    except ClientError as e:
+        api_resp['statusCode'] = 500
+        # Never send e.response['Error']['Message'] to clients, because it may contain
+        # sensitive information such as AWS Account number. Instead, log to CloudWatch
+        # for debugging purposes and send generic error to clients.
+        print(f"get_payment_history() error: {e.response['Error']['Message']}")
+        api_resp['body'] = json.dumps({'message' : 'Internal server error'})
+
+    return api_resp
+
+
+def record_payout_summary(dynamodb, customer_id, payment_id, amount, currency):
+    """
+    add a successful payment to the running PayoutSummaries aggregates of a customer.
+    """
+    # The payment is already stored, so a failure here must not fail the request.
+    # The summary is off until rebuild_payout_summaries.py is run for the customer.
+    # last_payment_at is last writer wins: two concurrent payments of one customer
+    # may leave the older payment_id, which is good enough for a summary.
+    try:
+        summary_table = dynamodb.Table('PayoutSummaries')
+        summary_table.update_item(
+            Key={'customer_id': customer_id},
+            UpdateExpression='ADD payment_count :one, #count :one, #total :amount SET last_payment_at = :pid',
+            ExpressionAttributeNames={'#count': f'count_{currency}', '#total': f'total_{currency}'},
+            ExpressionAttributeValues={':one': 1, ':amount': Decimal(str(amount)), ':pid': payment_id}
+        )
+    except ClientError as e:
+        print(f"record_payout_summary() error for {customer_id} {payment_id}: {e.response['Error']['Message']}")
+
+
+def payout_summary_body(customer_id, item):
+    """
+    API representation of a PayoutSummaries item.
+    """
+    item = item or {}
+    totals = {}
+    counts = {}
+    for name, value in item.items():
+        if name.startswith('total_'):
+            totals[name[len('total_'):]] = str(value)
+        elif name.startswith('count_'):
+            counts[name[len('count_'):]] = int(value)
+    return {
+        'customer_id': customer_id,
+        'payment_count': int(item.get('payment_count', 0)),
+        'totals': totals,
+        'counts': counts,
+        'last_payment_at': item.get('last_payment_at')
+    }
+
+
+def get_payout_summary(event, context):
+    """
+    process GET method on /v1/api/customer/{customer_id}/summary to get payout totals of a customer.
+    """
+    api_resp = {}
+    customer_id = (event.get('pathParameters') or {}).get('customer_id', '').strip()
+
+    if not customer_id:
+        api_resp['statusCode'] = 400
+        api_resp['body'] = json.dumps({'message': 'customer_id is required'})
+        return api_resp
+
+    try:
+        dynamodb = boto3.resource('dynamodb')
+        summary_table = dynamodb.Table('PayoutSummaries')
+        get_item_resp = summary_table.get_item(Key={'customer_id': customer_id})
+        # no summary yet means no payments yet, not an unknown customer
+        api_resp['statusCode'] = 200
+        api_resp['body'] = json.dumps(payout_summary_body(customer_id, get_item_resp.get('Item')))
+    except ClientError as e:
+        api_resp['statusCode'] = 500
+        # Never send e.response['Error']['Message'] to clients, because it may contain
+        # sensitive information such as AWS Account number. Instead, log to CloudWatch
+        # for debugging purposes and send generic error to clients.
+        print(f"get_payout_summary() error: {e.response['Error']['Message']}")
+        api_resp['body'] = json.dumps({'message' : 'Internal server error'})
+
+    return api_resp
+
+
+def disbursement_partition_key(customer_id, shard):
+    """
+    Disbursements partition key of a customer's shard. Shard 0 is the bare customer_id.
+    """
+    if shard == 0:
+        return customer_id
+    return f'{customer_id}{DISBURSEMENT_SHARD_SEPARATOR}{shard}'
+
+
+def logical_customer_id(partition_key):
+    """
+    customer_id of a Disbursements partition key, with any shard suffix removed.
+    """
+    return partition_key.split(DISBURSEMENT_SHARD_SEPARATOR, 1)[0]
+
+
+def pick_disbursement_shard(customer_item):
+    """
+    shard for the next payment write of a customer. 0 unless the customer is flagged hot.
+    """
+    shards = int((customer_item or {}).get('disbursement_shards', 1))
+    if shards <= 1:
+        return 0
+    return random.randrange(shards)
+
+
+def disbursement_read_keys(customer_id, customer_item):
+    """
+    every partition key that may hold payments of a customer.
+    """
+    customer_item = customer_item or {}
+    shards = max(int(customer_item.get('disbursement_shards', 1)),
+                 int(customer_item.get('disbursement_shards_max', 1)))
+    return [disbursement_partition_key(customer_id, shard) for shard in range(max(shards, 1))]
+
+
+def query_disbursement_partition(client, partition_key):
+    """
+    all payments stored under one partition key, in payment_id order.
+    """
+    items = []
+    query_args = {
+        'TableName': 'Disbursements',
+        'KeyConditionExpression': 'customer_id = :pk',
+        'ExpressionAttributeValues': {':pk': {'S': partition_key}},
+    }
+    while True:
+        resp = client.query(**query_args)
+        for raw in resp.get('Items', []):
+            items.append({k: _deserializer.deserialize(v) for k, v in raw.items()})
+        if 'LastEvaluatedKey' not in resp:
+            return items
+        query_args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def query_payment_history(dynamodb, customer_id, customer_item):
+    """
+    payment history of a customer. Shards are queried in parallel (scatter) and
+    merged by payment_id (gather).
+    """
+    # the low level client is thread safe, the resource is not
+    client = dynamodb.meta.client
+    keys = disbursement_read_keys(customer_id, customer_item)
+
+    if len(keys) == 1:
+        shard_results = [query_disbursement_partition(client, keys[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(keys), MAX_SHARD_QUERY_WORKERS)) as pool:
+            shard_results = list(pool.map(lambda pk: query_disbursement_partition(client, pk), keys))
+
+    # each shard comes back sorted on the payment_id sort key, so a k-way merge keeps the order
+    payments = []
+    for payment in heapq.merge(*shard_results, key=lambda p: p['payment_id']):
+        payment['customer_id'] = customer_id
+        payments.append(payment)
+    return payments
+
+
+def time_bucket_granularity():
+    granularity = os.environ.get('DISBURSEMENT_TIME_BUCKET', 'hour')
+    if granularity not in TIME_BUCKET_FORMATS:
+        raise ValueError(f'DISBURSEMENT_TIME_BUCKET must be one of {sorted(TIME_BUCKET_FORMATS)}')
+    return granularity
+
+
+def time_bucket_shards():
+    return max(int(os.environ.get('DISBURSEMENT_TIME_BUCKET_SHARDS', 1)), 1)
+
+
+def payment_id_time(payment_id):
+    """
+    UTC datetime of a payment_id or of a client supplied ISO 8601 timestamp.
+    """
+    # payment_ids are datetime.isoformat() + 'Z', so they may end in '+00:00Z'
+    value = payment_id[:-1] if payment_id.endswith('+00:00Z') else payment_id
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def payment_time_bucket(payment_id):
+    """
+    time-bucket-index partition key of a new payment.
+    """
+    bucket = payment_id_time(payment_id).strftime(TIME_BUCKET_FORMATS[time_bucket_granularity()])
+    return f'{bucket}#{random.randrange(time_bucket_shards())}'
+
+
+def time_buckets_in_window(start, end, granularity):
+    """
+    time buckets (without shard suffix) covering start..end, oldest first.
+    """
+    fmt = TIME_BUCKET_FORMATS[granularity]
+    # truncate start to its bucket, then step a bucket at a time
+    current = datetime.strptime(start.strftime(fmt), fmt).replace(tzinfo=timezone.utc)
+    buckets = []
+    while current <= end:
+        buckets.append(current.strftime(fmt))
+        if len(buckets) > MAX_TIME_WINDOW_BUCKETS:
+            raise ValueError(f'time window spans more than {MAX_TIME_WINDOW_BUCKETS} {granularity} buckets')
+        current += TIME_BUCKET_STEPS[granularity]
+    return buckets
+
+
+def payment_key(payment):
+    """
+    (payment_id, customer_id) of a stored payment, unique where payment_id alone is not:
+    payments of different customers can share a second-resolution payment_id.
+    """
+    return payment['payment_id'], payment['customer_id']
+
+
+def query_time_bucket(client, bucket_key, low, high, limit, after=None):
+    """
+    at least limit payments (fewer when the shard has no more) of one time bucket shard
+    with low <= payment_id <= high and a payment_key() above after, in payment_key() order.
+    """
+    items = []
+    query_args = {
+        'TableName': 'Disbursements',
+        'IndexName': TIME_BUCKET_INDEX,
+        'KeyConditionExpression': 'time_bucket = :bucket AND payment_id BETWEEN :low AND :high',
+        'ExpressionAttributeValues': {':bucket': {'S': bucket_key}, ':low': {'S': low}, ':high': {'S': high}},
+        'Limit': limit,
+    }
+    while True:
+        resp = client.query(**query_args)
+        for raw in resp.get('Items', []):
+            item = {k: _deserializer.deserialize(v) for k, v in raw.items()}
+            if after and payment_key(item) <= after:
+                continue
+            # the index orders equal payment_ids arbitrarily: read the last one's
+            # payments to the end, so they can be put in customer_id order
+            if len(items) >= limit and item['payment_id'] != items[-1]['payment_id']:
+                return sorted(items, key=payment_key)
+            items.append(item)
+        if 'LastEvaluatedKey' not in resp:
+            return sorted(items, key=payment_key)
+        query_args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def query_payments_in_window(dynamodb, start, end, limit, after=None):
+    """
+    payments of all customers with start <= payment time <= end, ordered by payment_key(),
+    at most limit of them and only those after the payment_key() 'after' when paging.
+    Returns (payments, payment_key() of the last one if there may be more, else None).
+    """
+    client = dynamodb.meta.client
+    granularity = time_bucket_granularity()
+    shards = time_bucket_shards()
+
+    # compare as payment_id strings, which is how the sort key orders them
+    low = after[0] if after else start.isoformat() + 'Z'
+    high = end.isoformat() + 'Z'
+    buckets = time_buckets_in_window(payment_id_time(low), end, granularity)
+
+    # Buckets are disjoint and ordered in time, so results only need merging across the
+    # shards of a bucket. Buckets are queried in parallel a wave at a time, and the scan
+    # stops at the first wave that fills the page.
+    wave_size = max(MAX_TIME_WINDOW_QUERY_WORKERS // shards, 1)
+    # one extra row per partition tells whether another page exists
+    fetch = limit + 1
+    payments = []
+    last_key = None
+    with ThreadPoolExecutor(max_workers=min(MAX_TIME_WINDOW_QUERY_WORKERS, wave_size * shards)) as pool:
+        for i in range(0, len(buckets), wave_size):
+            wave = buckets[i:i + wave_size]
+            keys = [f'{bucket}#{shard}' for bucket in wave for shard in range(shards)]
+            results = list(pool.map(lambda key: query_time_bucket(client, key, low, high, fetch, after), keys))
+            for b in range(len(wave)):
+                for payment in heapq.merge(*results[b * shards:(b + 1) * shards], key=payment_key):
+                    if len(payments) == limit:
+                        return payments, last_key
+                    # the cursor keeps the stored key, shard suffix included
+                    last_key = payment_key(payment)
+                    payment['customer_id'] = logical_customer_id(payment['customer_id'])
+                    payments.append(payment)
+    return payments, None
+
+
+def encode_cursor(key):
+    payment_id, customer_id = key
+    return base64.urlsafe_b64encode(json.dumps({'after': payment_id, 'customer_id': customer_id}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    key = position['after'], position['customer_id']
+    if not all(isinstance(part, str) for part in key):
+        raise ValueError('malformed cursor')
+    return key
+
+
+def get_payments_in_window(event, context):
+    """
+    process GET method on /v1/api/payments?from=&to=[&limit=][&cursor=] to list the
+    payments of all customers in a time window.
+    """
+    api_resp = {}
+    params = event.get('queryStringParameters') or {}
+
+    try:
+        start = payment_id_time(params.get('from', '').strip())
+        end = payment_id_time(params.get('to', '').strip())
+        limit = int(params.get('limit', DEFAULT_TIME_WINDOW_LIMIT))
+        after = decode_cursor(params['cursor']) if params.get('cursor') else None
+    except (ValueError, KeyError, TypeError):
+        api_resp['statusCode'] = 400
+        api_resp['body'] = json.dumps({'message': 'from and to must be ISO 8601 timestamps, limit a number and cursor from a previous page'})
+        return api_resp
+
+    if end < start or not 1 <= limit <= MAX_TIME_WINDOW_LIMIT:
+        api_resp['statusCode'] = 400
+        api_resp['body'] = json.dumps({'message': f'from must not be after to and limit must be 1 to {MAX_TIME_WINDOW_LIMIT}'})
+        return api_resp
+
+    try:
+        dynamodb = boto3.resource('dynamodb')
+        payments, last_key = query_payments_in_window(dynamodb, start, end, limit, after)
+        api_resp['statusCode'] = 200
+        json_response(event, api_resp, {
+            'count': len(payments),
+            'payments': payments,
+            'next_cursor': encode_cursor(last_key) if last_key else None
+        })
+    except ValueError as e:
+        api_resp['statusCode'] = 400
+        api_resp['body'] = json.dumps({'message': str(e)})
+    except ClientError as e:
+        api_resp['statusCode'] = 500
+        # Never send e.response['Error']['Message'] to clients, because it may contain
+        # sensitive information such as AWS Account number. Instead, log to CloudWatch
+        # for debugging purposes and send generic error to clients.
+        print(f"get_payments_in_window() error: {e.response['Error']['Message']}")
+        api_resp['body'] = json.dumps({'message' : 'Internal server error'})
+
+    return api_resp
+
+
+def paypal_response_id(paypal_resp):
+    """
+    id of the payment PayPal created, None if the response has none.
+    """
+    try:
+        paypal_id = json.loads(paypal_resp.text).get('id')
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return paypal_id if isinstance(paypal_id, str) else None
+
+
 # Get OAuth token from PayPal
 def get_access_token():
 
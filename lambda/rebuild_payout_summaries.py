@@ -0,0 +1,116 @@
+#
+# Rebuild (backfill) the PayoutSummaries aggregates from Disbursements.
+#
+# run: python3 rebuild_payout_summaries.py                  # every customer, one table scan
+#      python3 rebuild_payout_summaries.py user1 user2      # given customers, history queries only
+#
+# The summaries are overwritten with totals computed from the payment records.
+# A payment processed while its customer is being rebuilt can be lost from or
+# counted twice in the summary, so rebuild during a quiet period or rerun the
+# affected customers afterwards.
+#
+
+import argparse
+import os
+import sys
+import boto3
+from lambda_function import logical_customer_id, query_payment_history
+
+# money.py is shared with the lambda and the Flask app at the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from money import minor_units_decimal, to_minor_units
+
+
+def summarize_payments(payments):
+    """
+    PayoutSummaries items from payment records, keyed by customer_id.
+    """
+    summaries = {}
+    # totals are summed as integer minor units and turned into Decimal once at the end
+    totals = {}
+    for payment in payments:
+        # only payments that went through count, same as record_payout_summary()
+        if payment.get('status') != 'Completed':
+            continue
+        customer_id = logical_customer_id(payment['customer_id'])
+        currency = payment['currency']
+        summary = summaries.setdefault(customer_id, {'customer_id': customer_id, 'payment_count': 0})
+        try:
+            minor = to_minor_units(payment['amount'], currency)
+        except ValueError as e:
+            # unknown currency or more decimals than it has: reported and left out, as
+            # reconcile_paypal.py does with its unreadable_amount finding
+            print(f"{payment['customer_id']} {payment['payment_id']}: {e}, left out")
+            continue
+        summary['payment_count'] += 1
+        summary[f'count_{currency}'] = summary.get(f'count_{currency}', 0) + 1
+        totals[(customer_id, currency)] = totals.get((customer_id, currency), 0) + minor
+        if payment['payment_id'] > summary.get('last_payment_at', ''):
+            summary['last_payment_at'] = payment['payment_id']
+    for (customer_id, currency), total in totals.items():
+        summaries[customer_id][f'total_{currency}'] = minor_units_decimal(total, currency)
+    return summaries
+
+
+def scan_disbursements(disbursement_table):
+    """
+    every payment record in Disbursements, one page at a time.
+    """
+    scan_args = {
+        'ProjectionExpression': 'customer_id, payment_id, amount, currency, #status',
+        'ExpressionAttributeNames': {'#status': 'status'},
+    }
+    while True:
+        resp = disbursement_table.scan(**scan_args)
+        yield from resp.get('Items', [])
+        if 'LastEvaluatedKey' not in resp:
+            return
+        scan_args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def rebuild_customers(dynamodb, customer_ids):
+    """
+    rebuild the summaries of the given customers from their (possibly sharded) history.
+    """
+    customer_table = dynamodb.Table('Customers')
+    summaries = {}
+    for customer_id in customer_ids:
+        item = customer_table.get_item(Key={'customer_id': customer_id}).get('Item')
+        if item is None:
+            print(f'{customer_id} not in records, skipped')
+            continue
+        summary = summarize_payments(query_payment_history(dynamodb, customer_id, item))
+        # a customer without payments gets an empty summary, dropping stale totals
+        summaries[customer_id] = summary.get(customer_id, {'customer_id': customer_id, 'payment_count': 0})
+    return summaries
+
+
+def rebuild_all(dynamodb):
+    """
+    rebuild the summaries of every customer with payments from a single table scan.
+    """
+    return summarize_payments(scan_disbursements(dynamodb.Table('Disbursements')))
+
+
+def write_summaries(dynamodb, summaries):
+    with dynamodb.Table('PayoutSummaries').batch_writer() as batch:
+        for summary in summaries.values():
+            batch.put_item(Item=summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rebuild PayoutSummaries from Disbursements')
+    parser.add_argument('customer_ids', nargs='*', help='customers to rebuild, all if none given')
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb')
+    if args.customer_ids:
+        summaries = rebuild_customers(dynamodb, args.customer_ids)
+    else:
+        summaries = rebuild_all(dynamodb)
+    write_summaries(dynamodb, summaries)
+    print(f'rebuilt {len(summaries)} payout summaries')
+
+
+if __name__ == '__main__':
+    main()
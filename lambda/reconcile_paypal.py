@@ -0,0 +1,378 @@
+#
+# Reconcile Disbursements against the payments PayPal actually created.
+#
+# run: python3 reconcile_paypal.py --disbursements-export <export_dir> --paypal-file <payments.ndjson>
+#      python3 reconcile_paypal.py --disbursements-scan --paypal-live --start-time 2024-01-01T00:00:00Z
+#                                  --end-time 2024-02-01T00:00:00Z [--report mismatches.ndjson]
+#
+# Disbursement rows come from an export_disbursements.py NDJSON export or from a live
+# parallel Scan. PayPal payments come from the paged v1 payments listing or from an NDJSON
+# dump of it (one PayPal payment object per line), which is how the job runs offline.
+# --start-time/--end-time limit both sides to the window: the PayPal listing by creation
+# time, disbursement rows by the time in their payment_id (start inclusive, end
+# exclusive), so rows outside it are not reported as missing_in_paypal.
+#
+# Both streams are joined on the PayPal payment id with a partitioned hash join: each side
+# is spilled to disk into --partitions files by hash of the id, then every partition of
+# PayPal payments is loaded into a dict and the matching partition of disbursements is
+# streamed against it. Memory is bounded by the size of one partition, not the table.
+#
+# Findings, one JSON object per line in --report:
+#   amount_drift            amounts differ
+#   currency_drift          currencies differ
+#   status_drift            row is Completed but PayPal failed, cancelled or expired the payment
+#   missing_in_paypal       disbursement row whose PayPal payment does not exist
+#   missing_in_disbursements PayPal payment without a disbursement row
+#   missing_paypal_id       row written before PayPal ids were recorded, cannot be joined
+#   duplicate_disbursement  two rows for the same PayPal payment
+#   unreadable_amount       amount its currency cannot hold (or unknown currency), left out
+#                           of the control totals
+#
+
+import argparse
+import glob
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import zlib
+from decimal import Decimal, InvalidOperation
+from lambda_function import payment_id_time
+
+# money.py is shared with the lambda and the Flask app at the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from money import MoneyColumns, minor_units_str, to_minor_units
+
+# PayPal states of a payment that never moved money. process_payment writes
+# 'Completed' as soon as the authorization is created, so 'created' and 'approved'
+# are what a healthy row looks like.
+PAYPAL_FAILED_STATES = {'failed', 'canceled', 'cancelled', 'expired'}
+
+# v1 payments listing returns at most 20 payments per page
+PAYPAL_PAGE_SIZE = 20
+
+_DONE = object()
+
+
+def disbursement_row(record):
+    """
+    join fields of a Disbursements record.
+    """
+    return {
+        'id': record.get('paypal_payment_id'),
+        'customer_id': record.get('customer_id'),
+        'payment_id': record.get('payment_id'),
+        'amount': str(record.get('amount')),
+        'currency': record.get('currency'),
+        'status': record.get('status'),
+    }
+
+
+def paypal_row(payment):
+    """
+    join fields of a PayPal v1 payment object.
+    """
+    transaction = (payment.get('transactions') or [{}])[0]
+    amount = transaction.get('amount', {})
+    return {
+        'id': payment.get('id'),
+        'amount': amount.get('total'),
+        'currency': amount.get('currency'),
+        'state': payment.get('state'),
+        'create_time': payment.get('create_time'),
+    }
+
+
+def iter_ndjson(paths):
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_disbursements_export(export_dir):
+    """
+    disbursement records of an export_disbursements.py NDJSON export.
+    """
+    yield from iter_ndjson(sorted(glob.glob(os.path.join(export_dir, '*.ndjson'))))
+
+
+def iter_disbursements_scan(client, table_name='Disbursements', total_segments=16, buffer_pages=64):
+    """
+    disbursement records of a live parallel Scan, one thread per segment feeding a
+    bounded queue so a slow consumer holds back the scan instead of filling memory.
+    """
+    from export_disbursements import scan_segment, to_rows
+
+    pages = queue.Queue(maxsize=buffer_pages)
+    errors = []
+
+    def scan(segment):
+        try:
+            for items, _ in scan_segment(client, table_name, segment, total_segments):
+                pages.put(items)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pages.put(_DONE)
+
+    threads = [threading.Thread(target=scan, args=(segment,), daemon=True) for segment in range(total_segments)]
+    for t in threads:
+        t.start()
+    running = total_segments
+    while running:
+        items = pages.get()
+        if items is _DONE:
+            running -= 1
+            continue
+        yield from to_rows(items)
+    if errors:
+        raise errors[0]
+
+
+def in_window(records, start=None, end=None):
+    """
+    the disbursement records paid at or after start and before end (UTC datetimes of
+    payment_id_time(), either may be None), by the time in their payment_id. Records whose
+    payment_id is not a timestamp are kept, they are findings worth seeing.
+    """
+    for record in records:
+        try:
+            paid = payment_id_time(record.get('payment_id') or '')
+        except ValueError:
+            yield record
+            continue
+        if (start is None or paid >= start) and (end is None or paid < end):
+            yield record
+
+
+def iter_paypal_payments(http, base_url, access_token, start_time, end_time):
+    """
+    PayPal v1 payments created between start_time and end_time, following next_id pages.
+    """
+    url = f'{base_url}/v1/payments/payment'
+    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
+    params = {'count': PAYPAL_PAGE_SIZE, 'start_time': start_time, 'end_time': end_time,
+              'sort_by': 'create_time', 'sort_order': 'asc'}
+    while True:
+        resp = http.get(url, headers=headers, params=params)
+        if resp.status_code != 200:
+            raise RuntimeError(f'PayPal payments listing failed: {resp.status_code} {resp.text}')
+        page = resp.json()
+        yield from page.get('payments', [])
+        next_id = page.get('next_id')
+        if not next_id:
+            return
+        params['start_id'] = next_id
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        return None
+
+
+def amounts_differ(disbursement, payment):
+    # both read in the disbursement's currency, so '10' and '10.00' are the same amount
+    try:
+        return to_minor_units(disbursement['amount'], disbursement['currency']) != \
+            to_minor_units(payment['amount'], disbursement['currency'])
+    except ValueError:
+        # unknown currency, or an amount the currency cannot hold
+        return _decimal(disbursement['amount']) != _decimal(payment['amount'])
+
+
+def add_amounts(columns, rows):
+    """
+    add the amounts of rows to columns. Returns the rows whose amount could not be read,
+    which are left out.
+    """
+    rows = list(rows)
+    unreadable = []
+    start = 0
+    while start < len(rows):
+        added = len(columns)
+        try:
+            columns.extend((row['amount'], row['currency']) for row in rows[start:])
+            break
+        except ValueError:
+            # extend() stopped at it, carry on with the rows after it
+            start += len(columns) - added
+            unreadable.append(rows[start])
+            start += 1
+    return unreadable
+
+
+def compare(disbursement, payment):
+    """
+    findings for a disbursement row and the PayPal payment it references.
+    """
+    findings = []
+    if amounts_differ(disbursement, payment):
+        findings.append('amount_drift')
+    if disbursement['currency'] != payment['currency']:
+        findings.append('currency_drift')
+    if disbursement['status'] == 'Completed' and (payment['state'] or '').lower() in PAYPAL_FAILED_STATES:
+        findings.append('status_drift')
+    return findings
+
+
+class Reconciler:
+    """
+    partitioned hash join of disbursement rows and PayPal payments.
+    """
+
+    def __init__(self, report, partitions=64, spill_dir=None):
+        self.report = report
+        self.partitions = partitions
+        self.spill_dir = tempfile.mkdtemp(prefix='reconcile-', dir=spill_dir)
+        self.counts = {}
+        # per currency totals in minor units of each side, rows with a PayPal id
+        self.totals = {'disbursements': {}, 'paypal': {}}
+
+    def finding(self, kind, disbursement=None, payment=None):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.report.write(json.dumps({'finding': kind, 'disbursement': disbursement, 'paypal': payment},
+                                     separators=(',', ':')) + '\n')
+
+    def _spill(self, side, rows):
+        files = [open(os.path.join(self.spill_dir, f'{side}-{p:04d}.ndjson'), 'w', encoding='utf-8')
+                 for p in range(self.partitions)]
+        count = 0
+        try:
+            for row in rows:
+                p = zlib.crc32(row['id'].encode()) % self.partitions
+                files[p].write(json.dumps(row, separators=(',', ':')))
+                files[p].write('\n')
+                count += 1
+        finally:
+            for f in files:
+                f.close()
+        return count
+
+    def _partition(self, side, p):
+        return iter_ndjson([os.path.join(self.spill_dir, f'{side}-{p:04d}.ndjson')])
+
+    def run(self, disbursements, paypal_payments):
+        """
+        join both streams and write the findings. Returns a summary dict.
+        """
+        try:
+            def joinable_disbursements():
+                for record in disbursements:
+                    row = disbursement_row(record)
+                    if row['id']:
+                        yield row
+                    else:
+                        self.finding('missing_paypal_id', disbursement=row)
+
+            disbursement_count = self._spill('disbursements', joinable_disbursements())
+            paypal_count = self._spill('paypal', (paypal_row(p) for p in paypal_payments if p.get('id')))
+
+            matched = 0
+            for p in range(self.partitions):
+                payments = {row['id']: row for row in self._partition('paypal', p)}
+                # control totals, summed a partition at a time over its amount columns
+                paypal_amounts = MoneyColumns()
+                for payment in add_amounts(paypal_amounts, payments.values()):
+                    self.finding('unreadable_amount', payment=payment)
+                disbursement_rows = []
+                seen = set()
+                for row in self._partition('disbursements', p):
+                    disbursement_rows.append(row)
+                    payment = payments.get(row['id'])
+                    if payment is None:
+                        self.finding('missing_in_paypal', disbursement=row)
+                        continue
+                    if row['id'] in seen:
+                        self.finding('duplicate_disbursement', disbursement=row, payment=payment)
+                        continue
+                    seen.add(row['id'])
+                    matched += 1
+                    for kind in compare(row, payment):
+                        self.finding(kind, disbursement=row, payment=payment)
+                for payment_id, payment in payments.items():
+                    if payment_id not in seen:
+                        self.finding('missing_in_disbursements', payment=payment)
+                disbursement_amounts = MoneyColumns()
+                for row in add_amounts(disbursement_amounts, disbursement_rows):
+                    self.finding('unreadable_amount', disbursement=row)
+                self._add_totals('paypal', paypal_amounts)
+                self._add_totals('disbursements', disbursement_amounts)
+        finally:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+        return {
+            'disbursements': disbursement_count + self.counts.get('missing_paypal_id', 0),
+            'paypal_payments': paypal_count,
+            'matched': matched,
+            'findings': dict(sorted(self.counts.items())),
+            'totals': {side: {currency: minor_units_str(total, currency) for currency, total in sorted(totals.items())}
+                       for side, totals in self.totals.items()},
+        }
+
+    def _add_totals(self, side, columns):
+        totals = self.totals[side]
+        for currency, total in columns.totals().items():
+            totals[currency] = totals.get(currency, 0) + total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='reconcile Disbursements with PayPal payments')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--disbursements-export', help='export_disbursements.py NDJSON output dir')
+    source.add_argument('--disbursements-scan', action='store_true', help='parallel Scan of the live table')
+    paypal = parser.add_mutually_exclusive_group(required=True)
+    paypal.add_argument('--paypal-file', help='NDJSON file of PayPal v1 payment objects')
+    paypal.add_argument('--paypal-live', action='store_true', help='page through the PayPal payments listing')
+    parser.add_argument('--start-time', help='window start, e.g. 2024-01-01T00:00:00Z, for the PayPal listing '
+                                             'and the disbursement rows')
+    parser.add_argument('--end-time', help='window end, exclusive')
+    parser.add_argument('--segments', type=int, default=16)
+    parser.add_argument('--partitions', type=int, default=64)
+    parser.add_argument('--report', default='reconcile_report.ndjson')
+    args = parser.parse_args()
+    # parsed before anything runs: in_window() is a generator, it would only fail mid-run
+    window = {}
+    for name in ('start_time', 'end_time'):
+        if getattr(args, name):
+            try:
+                window[name] = payment_id_time(getattr(args, name))
+            except ValueError as e:
+                parser.error(f"--{name.replace('_', '-')}: {e}")
+
+    if args.disbursements_export:
+        disbursements = iter_disbursements_export(args.disbursements_export)
+    else:
+        import boto3
+        from botocore.config import Config
+        client = boto3.client('dynamodb', config=Config(max_pool_connections=args.segments))
+        disbursements = iter_disbursements_scan(client, total_segments=args.segments)
+    if window:
+        disbursements = in_window(disbursements, window.get('start_time'), window.get('end_time'))
+
+    if args.paypal_file:
+        paypal_payments = iter_ndjson([args.paypal_file])
+    else:
+        if not args.start_time or not args.end_time:
+            parser.error('--paypal-live needs --start-time and --end-time')
+        import requests
+        from lambda_function import get_access_token
+        access_token, resp_code, resp_text = get_access_token()
+        if access_token is None:
+            raise SystemExit(f'failed to get PayPal API OAuth token: {resp_code} {resp_text}')
+        paypal_payments = iter_paypal_payments(requests.Session(), os.environ['PAYPAL_SANDBOX_URL'],
+                                               access_token, args.start_time, args.end_time)
+
+    with open(args.report, 'w', encoding='utf-8') as report:
+        summary = Reconciler(report, args.partitions).run(disbursements, paypal_payments)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
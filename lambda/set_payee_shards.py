@@ -0,0 +1,66 @@
+#
+# Flag a hot payee for Disbursements write sharding, or change its shard count.
+#
+# run: python3 set_payee_shards.py <customer_id> <shards>
+#
+# shards = 1 turns sharding off again. Lowering the count never strands history:
+# disbursement_shards_max keeps the highest count ever set and the payment history
+# query reads every shard up to it (see query_payment_history in lambda_function.py).
+# Like add_customer it bumps the record's version, so cached customer reads revalidate.
+#
+
+import argparse
+import boto3
+from botocore.exceptions import ClientError
+
+
+def set_payee_shards(customer_table, customer_id, shards):
+    """
+    set disbursement_shards of a customer and raise disbursement_shards_max to match.
+    """
+    if shards < 1:
+        raise ValueError('shards must be at least 1')
+
+    key = {'customer_id': customer_id}
+    try:
+        # raise the high-water mark together with the count when it grows
+        customer_table.update_item(
+            Key=key,
+            UpdateExpression='SET disbursement_shards = :n, disbursement_shards_max = :n ADD version :one',
+            ConditionExpression='attribute_exists(customer_id) AND '
+                                '(attribute_not_exists(disbursement_shards_max) OR disbursement_shards_max <= :n)',
+            ExpressionAttributeValues={':n': shards, ':one': 1}
+        )
+        return
+    except ClientError as e:
+        if e.response['Error'].get('Code') != 'ConditionalCheckFailedException':
+            raise
+
+    # count went down (or customer is missing): leave the high-water mark alone
+    customer_table.update_item(
+        Key=key,
+        UpdateExpression='SET disbursement_shards = :n ADD version :one',
+        ConditionExpression='attribute_exists(customer_id)',
+        ExpressionAttributeValues={':n': shards, ':one': 1}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='set Disbursements write shards of a hot payee')
+    parser.add_argument('customer_id')
+    parser.add_argument('shards', type=int)
+    args = parser.parse_args()
+
+    customer_table = boto3.resource('dynamodb').Table('Customers')
+    try:
+        set_payee_shards(customer_table, args.customer_id, args.shards)
+    except ClientError as e:
+        if e.response['Error'].get('Code') == 'ConditionalCheckFailedException':
+            print(f'{args.customer_id} not in records')
+            return
+        raise
+    print(f'{args.customer_id}: disbursement_shards = {args.shards}')
+
+
+if __name__ == '__main__':
+    main()
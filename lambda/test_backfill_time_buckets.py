@@ -0,0 +1,44 @@
+#
+# run: pytest -v
+#
+
+import unittest
+from unittest.mock import patch, MagicMock
+from backfill_time_buckets import needs_backfill, backfill
+
+def raw(payment_id, time_bucket=None):
+    item = {'customer_id': {'S': 'cust1'}, 'payment_id': {'S': payment_id}}
+    if time_bucket:
+        item['time_bucket'] = {'S': time_bucket}
+    return item
+
+class TestBackfillTimeBuckets(unittest.TestCase):
+
+    @patch.dict('os.environ', {'DISBURSEMENT_TIME_BUCKET': 'hour', 'DISBURSEMENT_TIME_BUCKET_SHARDS': '2'})
+    def test_needs_backfill(self):
+        payment_id = '2024-03-01T14:05:06+00:00Z'
+        self.assertTrue(needs_backfill(raw(payment_id), 2))
+        self.assertFalse(needs_backfill(raw(payment_id, '2024-03-01T14#1'), 2))
+        # bucketed by day before, or on a shard that no longer exists
+        self.assertTrue(needs_backfill(raw(payment_id, '2024-03-01#0'), 2))
+        self.assertTrue(needs_backfill(raw(payment_id, '2024-03-01T14#3'), 2))
+
+    @patch.dict('os.environ', {'DISBURSEMENT_TIME_BUCKET': 'hour', 'DISBURSEMENT_TIME_BUCKET_SHARDS': '1'})
+    def test_backfill(self):
+        client = MagicMock()
+        client.scan.return_value = {'Items': [
+            raw('2024-03-01T14:05:06+00:00Z'),
+            raw('2024-03-01T15:05:06+00:00Z', '2024-03-01T15#0'),
+        ]}
+
+        updated = backfill(client, 'Disbursements', 2)
+
+        # one stale row per segment
+        self.assertEqual(updated, 2)
+        update = client.update_item.call_args.kwargs
+        self.assertEqual(update['ExpressionAttributeValues'], {':bucket': {'S': '2024-03-01T14#0'}})
+        self.assertEqual(client.scan.call_args.kwargs['ProjectionExpression'], 'customer_id, payment_id, time_bucket')
+
+
+if __name__ == '__main__':
+    unittest.main()
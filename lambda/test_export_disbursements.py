@@ -0,0 +1,93 @@
+#
+# run: pytest -v
+#
+
+import unittest
+import glob
+import json
+import os
+import tempfile
+from export_disbursements import export_table, pyarrow
+
+def raw_payment(customer_id, payment_id):
+    return {
+        'customer_id': {'S': customer_id}, 'payment_id': {'S': payment_id},
+        'amount': {'S': '10'}, 'currency': {'S': 'USD'}, 'status': {'S': 'Completed'}
+    }
+
+class FakeScanClient:
+    """
+    2 segments with 3 pages of 2 items each.
+    """
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = []
+
+    def scan(self, **kwargs):
+        segment = kwargs['Segment']
+        page = kwargs.get('ExclusiveStartKey', {}).get('page', 0)
+        self.calls.append((segment, page))
+        if (segment, page) == self.fail_on:
+            raise ConnectionError('scan interrupted')
+        items = [raw_payment(f'cust{segment}#1', f'{segment}-{page}-{i}') for i in range(2)]
+        resp = {'Items': items}
+        if page < 2:
+            resp['LastEvaluatedKey'] = {'page': page + 1}
+        return resp
+
+def read_ndjson(out_dir):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(out_dir, '*.ndjson'))):
+        with open(path) as f:
+            rows.extend(json.loads(line) for line in f)
+    return rows
+
+class TestExportDisbursements(unittest.TestCase):
+
+    def test_export_ndjson(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            rows = export_table(FakeScanClient(), 'Disbursements', out_dir, 2, 2, rows_per_file=4)
+
+            self.assertEqual(rows, 12)
+            exported = read_ndjson(out_dir)
+            self.assertEqual(len(exported), 12)
+            # shard suffix removed
+            self.assertEqual({r['customer_id'] for r in exported}, {'cust0', 'cust1'})
+            # files roll every 2 pages
+            self.assertEqual(len(glob.glob(os.path.join(out_dir, 'seg-00000-*.ndjson'))), 2)
+
+    def test_export_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            # segment 1 dies on its last page, after its first file was checkpointed
+            with self.assertRaises(ConnectionError):
+                export_table(FakeScanClient(fail_on=(1, 2)), 'Disbursements', out_dir, 2, 2, rows_per_file=4)
+
+            client = FakeScanClient()
+            rows = export_table(client, 'Disbursements', out_dir, 2, 2, rows_per_file=4)
+
+            # segment 0 was finished and is not scanned again, segment 1 resumes at page 2
+            self.assertEqual(client.calls, [(1, 2)])
+            self.assertEqual(rows, 12)
+            exported = read_ndjson(out_dir)
+            self.assertEqual(sorted(r['payment_id'] for r in exported),
+                             sorted(f'{s}-{p}-{i}' for s in range(2) for p in range(3) for i in range(2)))
+
+    def test_resume_with_other_settings_rejected(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            export_table(FakeScanClient(), 'Disbursements', out_dir, 2, 2)
+            with self.assertRaises(ValueError):
+                export_table(FakeScanClient(), 'Disbursements', out_dir, 4, 2)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow not installed')
+    def test_export_parquet(self):
+        import pyarrow.parquet
+        with tempfile.TemporaryDirectory() as out_dir:
+            export_table(FakeScanClient(), 'Disbursements', out_dir, 2, 2, fmt='parquet')
+
+            table = pyarrow.parquet.read_table(out_dir)
+            self.assertEqual(table.num_rows, 12)
+            self.assertEqual(set(table.column('customer_id').to_pylist()), {'cust0', 'cust1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
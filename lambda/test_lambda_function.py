@@ -4,8 +4,45 @@
 
 import unittest
 from unittest.mock import patch, MagicMock
+import base64
 import json
+import os
+import subprocess
+import sys
+from decimal import Decimal
+from botocore.exceptions import ClientError
 from lambda_function import lambda_handler, add_customer, get_customer, process_payment, get_access_token
+from lambda_function import record_payout_summary, paypal_response_id
+from lambda_function import payment_time_bucket, time_buckets_in_window, payment_id_time
+import lambda_function
+import money
+import response_encoding
+from lambda_function import disbursement_partition_key, disbursement_read_keys, logical_customer_id, pick_disbursement_shard
+
+class FakeTimeBucketIndex:
+    """
+    low level client query() over time-bucket-index, honouring BETWEEN, Limit and paging.
+    """
+    def __init__(self, payments):
+        self.partitions = {}
+        for payment in payments:
+            self.partitions.setdefault(payment['time_bucket'], []).append(payment)
+        for items in self.partitions.values():
+            items.sort(key=lambda p: p['payment_id'])
+        self.calls = 0
+
+    def query(self, **kwargs):
+        self.calls += 1
+        values = kwargs['ExpressionAttributeValues']
+        low, high = values[':low']['S'], values[':high']['S']
+        items = [p for p in self.partitions.get(values[':bucket']['S'], []) if low <= p['payment_id'] <= high]
+        start = kwargs.get('ExclusiveStartKey', {}).get('offset', 0)
+        page = items[start:start + kwargs['Limit']]
+        resp = {'Items': [{k: {'S': v} for k, v in p.items()} for p in page]}
+        if start + kwargs['Limit'] < len(items):
+            resp['LastEvaluatedKey'] = {'offset': start + kwargs['Limit']}
+        return resp
+
 
 class TestLambdaFunctions(unittest.TestCase):
 
@@ -14,10 +51,10 @@ class TestLambdaFunctions(unittest.TestCase):
         # Mock the response from DynamoDB
         mock_dynamo_table = MagicMock()
         mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
-        mock_dynamo_table.put_item.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        mock_dynamo_table.update_item.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
 
         event = {
-            'body': json.dumps({'customer_id': '123', 'email': 'test@example.com'}),
+            'body': json.dumps({'customer_id': 'customer123', 'email': 'test@example.com'}),
             'resource': '/v1/api/customer',
             'httpMethod': 'POST'
         }
@@ -28,12 +65,12 @@ class TestLambdaFunctions(unittest.TestCase):
 
         # Assert the response
         self.assertEqual(result['statusCode'], 200)
-        self.assertIn('123 added successfully', result['body'])
+        self.assertIn('customer123 added successfully', result['body'])
 
     @patch('lambda_function.boto3.resource')
     def test_add_customer_missing_fields(self, mock_boto_resource):
         event = {
-            'body': json.dumps({'customer_id': '123'}),
+            'body': json.dumps({'customer_id': 'customer123'}),
             'resource': '/v1/api/customer',
             'httpMethod': 'POST'
         }
@@ -44,7 +81,8 @@ class TestLambdaFunctions(unittest.TestCase):
 
         # Assert bad request due to missing email
         self.assertEqual(result['statusCode'], 400)
-        self.assertIn('customer_id and email fields are required', result['body'])
+        self.assertEqual(json.loads(result['body']),
+                         {'message': 'Invalid request body', 'errors': ['email: is required']})
 
     @patch('lambda_function.boto3.resource')
     def test_get_customer_success(self, mock_boto_resource):
@@ -91,6 +129,541 @@ class TestLambdaFunctions(unittest.TestCase):
         self.assertEqual(result['statusCode'], 404)
         self.assertIn('not in records', result['body'])
 
+    @patch('lambda_function.boto3.resource')
+    def test_add_customer_email_taken(self, mock_boto_resource):
+        # the email marker belongs to another customer
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.put_item.side_effect = ClientError(
+            {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'PutItem')
+
+        event = {
+            'body': json.dumps({'customer_id': 'customer123', 'email': 'test@example.com'}),
+            'resource': '/v1/api/customer',
+            'httpMethod': 'POST'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 409)
+        self.assertIn('already registered', result['body'])
+        # only the marker write was attempted, the customer record was not touched
+        self.assertEqual(mock_dynamo_table.put_item.call_count, 1)
+        self.assertEqual(mock_dynamo_table.put_item.call_args.kwargs['Item'],
+                         {'customer_id': 'email#test@example.com', 'owner_id': 'customer123'})
+
+    @patch('lambda_function.boto3.resource')
+    def test_add_customer_email_changed(self, mock_boto_resource):
+        # the previous record had another email, its marker gets released
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.update_item.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200},
+            'Attributes': {'customer_id': 'customer123', 'email': 'old@example.com', 'version': 4}
+        }
+
+        event = {
+            'body': json.dumps({'customer_id': 'customer123', 'email': 'test@example.com'}),
+            'resource': '/v1/api/customer',
+            'httpMethod': 'POST'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 200)
+        mock_dynamo_table.delete_item.assert_called_once()
+        self.assertEqual(mock_dynamo_table.delete_item.call_args.kwargs['Key'],
+                         {'customer_id': 'email#old@example.com'})
+        # the version goes up with every write
+        self.assertIn('ADD version :one', mock_dynamo_table.update_item.call_args.kwargs['UpdateExpression'])
+        self.assertEqual(json.loads(result['body'])['version'], 5)
+        self.assertEqual(result['headers']['ETag'], '"v5"')
+
+    @patch('lambda_function.boto3.resource')
+    def test_get_customer_etag(self, mock_boto_resource):
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.get_item.return_value = {
+            'Item': {'customer_id': '123', 'email': 'test@example.com', 'version': 5}
+        }
+        event = {
+            'pathParameters': {'customer_id': '123'},
+            'resource': '/v1/api/customer/{customer_id}',
+            'httpMethod': 'GET'
+        }
+
+        result = lambda_handler(event, {})
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(result['headers']['ETag'], '"v5"')
+        self.assertEqual(result['headers']['Cache-Control'], 'max-age=60, must-revalidate')
+
+        # client already holds the current version
+        event['headers'] = {'if-none-match': 'W/"v5"'}
+        result = lambda_handler(event, {})
+        self.assertEqual(result['statusCode'], 304)
+        self.assertEqual(result['body'], '')
+        self.assertEqual(result['headers']['ETag'], '"v5"')
+
+        # stale version
+        event['headers'] = {'If-None-Match': '"v4"'}
+        self.assertEqual(lambda_handler(event, {})['statusCode'], 200)
+
+        # records written before versions existed get a content hash
+        mock_dynamo_table.get_item.return_value = {'Item': {'customer_id': '123', 'email': 'test@example.com'}}
+        event.pop('headers')
+        etag = lambda_handler(event, {})['headers']['ETag']
+        self.assertNotEqual(etag, '"v5"')
+        event['headers'] = {'If-None-Match': etag}
+        self.assertEqual(lambda_handler(event, {})['statusCode'], 304)
+
+    @patch('lambda_function.boto3.resource')
+    def test_get_customer_by_email(self, mock_boto_resource):
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.query.return_value = {
+            'Items': [{'customer_id': '123', 'email': 'test@example.com'}]
+        }
+
+        event = {
+            'queryStringParameters': {'email': 'test@example.com'},
+            'resource': '/v1/api/customer',
+            'httpMethod': 'GET'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(json.loads(result['body'])['customers'][0]['customer_id'], '123')
+        # served by the GSI, never a scan
+        self.assertEqual(mock_dynamo_table.query.call_args.kwargs['IndexName'], 'email-index')
+        mock_dynamo_table.scan.assert_not_called()
+
+    @patch('lambda_function.boto3.resource')
+    def test_get_customer_by_email_not_found(self, mock_boto_resource):
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.query.return_value = {'Items': []}
+
+        event = {
+            'queryStringParameters': {'email': 'nobody@example.com'},
+            'resource': '/v1/api/customer',
+            'httpMethod': 'GET'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 404)
+
+    @patch('lambda_function.boto3.resource')
+    def test_get_customer_by_email_missing_param(self, mock_boto_resource):
+        event = {
+            'queryStringParameters': None,
+            'resource': '/v1/api/customer',
+            'httpMethod': 'GET'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 400)
+
+    def test_disbursement_shard_keys(self):
+        # unflagged customers keep the bare customer_id
+        self.assertEqual(pick_disbursement_shard({'customer_id': '123'}), 0)
+        self.assertEqual(disbursement_read_keys('123', {'customer_id': '123'}), ['123'])
+        self.assertEqual(disbursement_partition_key('123', 0), '123')
+        self.assertEqual(disbursement_partition_key('123', 2), '123#2')
+        self.assertEqual(logical_customer_id('123#2'), '123')
+
+        # shard count lowered from 4 to 2: reads still cover all 4 shards
+        item = {'customer_id': '123', 'disbursement_shards': 2, 'disbursement_shards_max': 4}
+        self.assertEqual(disbursement_read_keys('123', item), ['123', '123#1', '123#2', '123#3'])
+        for _ in range(20):
+            self.assertIn(pick_disbursement_shard(item), (0, 1))
+
+    @patch('lambda_function.boto3.resource')
+    def test_get_payment_history_sharded(self, mock_boto_resource):
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.get_item.return_value = {
+            'Item': {'customer_id': '123', 'email': 'test@example.com', 'disbursement_shards': 3}
+        }
+
+        def raw(pk, payment_id):
+            return {'customer_id': {'S': pk}, 'payment_id': {'S': payment_id}, 'amount': {'S': '10'}}
+
+        shards = {
+            '123': [raw('123', '2024-01-01T00:00:01Z'), raw('123', '2024-01-01T00:00:05Z')],
+            '123#1': [raw('123#1', '2024-01-01T00:00:02Z')],
+            '123#2': [raw('123#2', '2024-01-01T00:00:03Z'), raw('123#2', '2024-01-01T00:00:04Z')],
+        }
+        def query(**kwargs):
+            pk = kwargs['ExpressionAttributeValues'][':pk']['S']
+            return {'Items': shards[pk]}
+        mock_boto_resource.return_value.meta.client.query.side_effect = query
+
+        event = {
+            'pathParameters': {'customer_id': '123'},
+            'resource': '/v1/api/payment/{customer_id}',
+            'httpMethod': 'GET'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 200)
+        body = json.loads(result['body'])
+        self.assertEqual(body['count'], 5)
+        # merged across shards in payment_id order, shard suffix removed
+        self.assertEqual([p['payment_id'][-2:] for p in body['payments']], ['1Z', '2Z', '3Z', '4Z', '5Z'])
+        self.assertTrue(all(p['customer_id'] == '123' for p in body['payments']))
+
+    @patch('lambda_function.boto3.resource')
+    def test_get_payment_history_paginated(self, mock_boto_resource):
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.get_item.return_value = {'Item': {'customer_id': '123', 'email': 'test@example.com'}}
+        mock_boto_resource.return_value.meta.client.query.side_effect = [
+            {'Items': [{'customer_id': {'S': '123'}, 'payment_id': {'S': 'a'}}], 'LastEvaluatedKey': {'x': 1}},
+            {'Items': [{'customer_id': {'S': '123'}, 'payment_id': {'S': 'b'}}]},
+        ]
+
+        event = {
+            'pathParameters': {'customer_id': '123'},
+            'resource': '/v1/api/payment/{customer_id}',
+            'httpMethod': 'GET'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(json.loads(result['body'])['count'], 2)
+        second_call = mock_boto_resource.return_value.meta.client.query.call_args_list[1]
+        self.assertEqual(second_call.kwargs['ExclusiveStartKey'], {'x': 1})
+
+    def test_paypal_response_id(self):
+        self.assertEqual(paypal_response_id(MagicMock(text='{"id": "PAY-123", "state": "created"}')), 'PAY-123')
+        self.assertIsNone(paypal_response_id(MagicMock(text='not json')))
+        self.assertIsNone(paypal_response_id(MagicMock(text='{"state": "created"}')))
+
+    def test_record_payout_summary(self):
+        mock_dynamodb = MagicMock()
+
+        record_payout_summary(mock_dynamodb, '123', '2024-01-01T00:00:00Z', 10.5, 'EUR')
+
+        update = mock_dynamodb.Table.return_value.update_item.call_args.kwargs
+        self.assertEqual(update['Key'], {'customer_id': '123'})
+        self.assertIn('ADD payment_count :one', update['UpdateExpression'])
+        self.assertEqual(update['ExpressionAttributeNames'], {'#count': 'count_EUR', '#total': 'total_EUR'})
+        self.assertEqual(str(update['ExpressionAttributeValues'][':amount']), '10.5')
+
+    def test_record_payout_summary_error_swallowed(self):
+        mock_dynamodb = MagicMock()
+        mock_dynamodb.Table.return_value.update_item.side_effect = ClientError(
+            {'Error': {'Message': 'throttled'}}, 'UpdateItem')
+
+        # must not raise, the payment itself has been stored
+        record_payout_summary(mock_dynamodb, '123', '2024-01-01T00:00:00Z', 10, 'USD')
+
+    @patch('lambda_function.boto3.resource')
+    def test_get_payout_summary(self, mock_boto_resource):
+        from decimal import Decimal
+        mock_dynamo_table = MagicMock()
+        mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
+        mock_dynamo_table.get_item.return_value = {'Item': {
+            'customer_id': '123', 'payment_count': Decimal(3),
+            'count_USD': Decimal(2), 'total_USD': Decimal('150.25'),
+            'count_EUR': Decimal(1), 'total_EUR': Decimal('10'),
+            'last_payment_at': '2024-01-03T00:00:00Z'
+        }}
+
+        event = {
+            'pathParameters': {'customer_id': '123'},
+            'resource': '/v1/api/customer/{customer_id}/summary',
+            'httpMethod': 'GET'
+        }
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 200)
+        body = json.loads(result['body'])
+        self.assertEqual(body['payment_count'], 3)
+        self.assertEqual(body['totals'], {'USD': '150.25', 'EUR': '10'})
+        self.assertEqual(body['counts'], {'USD': 2, 'EUR': 1})
+        # one round trip, no history reads
+        mock_dynamo_table.get_item.assert_called_once()
+        mock_dynamo_table.query.assert_not_called()
+
+    @patch.dict('os.environ', {'DISBURSEMENT_TIME_BUCKET': 'hour', 'DISBURSEMENT_TIME_BUCKET_SHARDS': '4'})
+    def test_payment_time_bucket(self):
+        bucket, shard = payment_time_bucket('2024-03-01T14:05:06.123456+00:00Z').split('#')
+        self.assertEqual(bucket, '2024-03-01T14')
+        self.assertIn(int(shard), range(4))
+
+        with patch.dict('os.environ', {'DISBURSEMENT_TIME_BUCKET': 'day'}):
+            self.assertTrue(payment_time_bucket('2024-03-01T14:05:06+00:00Z').startswith('2024-03-01#'))
+
+    def test_time_buckets_in_window(self):
+        start = payment_id_time('2024-03-01T22:30:00Z')
+        end = payment_id_time('2024-03-02T01:00:00Z')
+        self.assertEqual(time_buckets_in_window(start, end, 'hour'),
+                         ['2024-03-01T22', '2024-03-01T23', '2024-03-02T00', '2024-03-02T01'])
+        self.assertEqual(time_buckets_in_window(start, end, 'day'), ['2024-03-01', '2024-03-02'])
+
+    @patch.dict('os.environ', {'DISBURSEMENT_TIME_BUCKET': 'hour', 'DISBURSEMENT_TIME_BUCKET_SHARDS': '3'})
+    @patch('lambda_function.boto3.resource')
+    def test_get_payments_in_window_pages(self, mock_boto_resource):
+        # 5 hours of payments, every 7 minutes, spread over the bucket shards
+        payments = []
+        for i in range(0, 5 * 60, 7):
+            payment_id = f'2024-03-01T{10 + i // 60:02d}:{i % 60:02d}:00+00:00Z'
+            payments.append({'customer_id': f'cust{i % 4}#{i % 2}', 'payment_id': payment_id,
+                             'time_bucket': f'{payment_id[:13]}#{i % 3}', 'amount': '10'})
+        index = FakeTimeBucketIndex(payments)
+        mock_boto_resource.return_value.meta.client = index
+
+        expected = [p['payment_id'] for p in payments
+                    if '2024-03-01T10:30:00' <= p['payment_id'] <= '2024-03-01T13:30:00+00:00Z']
+        seen = []
+        cursor = None
+        for _ in range(20):
+            params = {'from': '2024-03-01T10:30:00Z', 'to': '2024-03-01T13:30:00Z', 'limit': '7'}
+            if cursor:
+                params['cursor'] = cursor
+            event = {'queryStringParameters': params, 'resource': '/v1/api/payments', 'httpMethod': 'GET'}
+            result = lambda_handler(event, {})
+            self.assertEqual(result['statusCode'], 200)
+            body = json.loads(result['body'])
+            self.assertLessEqual(body['count'], 7)
+            seen.extend(p['payment_id'] for p in body['payments'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+
+        # every payment of the window exactly once, in order, shard suffixes removed
+        self.assertEqual(seen, expected)
+        self.assertTrue(all(p['customer_id'].startswith('cust') and '#' not in p['customer_id']
+                            for p in body['payments']))
+
+    @patch.dict('os.environ', {'DISBURSEMENT_TIME_BUCKET': 'hour', 'DISBURSEMENT_TIME_BUCKET_SHARDS': '2'})
+    @patch('lambda_function.boto3.resource')
+    def test_get_payments_in_window_same_payment_id(self, mock_boto_resource):
+        # payment_ids have second resolution in older rows: 11 customers paid in the same
+        # second, stored in an order the index does not define, across page boundaries
+        payments = [{'customer_id': 'cust0', 'payment_id': '2024-03-01T10:00:00+00:00Z',
+                     'time_bucket': '2024-03-01T10#0', 'amount': '10'}]
+        for i in [7, 3, 10, 1, 9, 5, 2, 8, 4, 6, 11]:
+            payments.append({'customer_id': f'cust{i:02d}', 'payment_id': '2024-03-01T10:00:01+00:00Z',
+                             'time_bucket': f'2024-03-01T10#{i % 2}', 'amount': '10'})
+        payments.append({'customer_id': 'cust0', 'payment_id': '2024-03-01T10:00:02+00:00Z',
+                         'time_bucket': '2024-03-01T10#1', 'amount': '10'})
+        mock_boto_resource.return_value.meta.client = FakeTimeBucketIndex(payments)
+
+        seen = []
+        cursor = None
+        for _ in range(20):
+            params = {'from': '2024-03-01T10:00:00Z', 'to': '2024-03-01T11:00:00Z', 'limit': '3'}
+            if cursor:
+                params['cursor'] = cursor
+            result = lambda_handler({'queryStringParameters': params, 'resource': '/v1/api/payments',
+                                     'httpMethod': 'GET'}, {})
+            self.assertEqual(result['statusCode'], 200)
+            body = json.loads(result['body'])
+            seen.extend((p['payment_id'][17:19], p['customer_id']) for p in body['payments'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(seen, [('00', 'cust0')] + [('01', f'cust{i:02d}') for i in range(1, 12)] +
+                         [('02', 'cust0')])
+
+    def batch_get_response(self, keys, unprocessed=0, known=None):
+        # every key found unless known says otherwise, the last `unprocessed` keys throttled
+        served = keys[:len(keys) - unprocessed]
+        resp = {'Responses': {'Customers': [
+            {'customer_id': {'S': k['customer_id']['S']}, 'email': {'S': k['customer_id']['S'] + '@example.com'}}
+            for k in served if known is None or k['customer_id']['S'] in known]}}
+        if unprocessed:
+            resp['UnprocessedKeys'] = {'Customers': {'Keys': keys[-unprocessed:]}}
+        return resp
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.boto3.resource')
+    def test_batch_get_customers(self, mock_boto_resource, mock_sleep):
+        client = mock_boto_resource.return_value.meta.client
+        known = {f'customer{i:04d}' for i in range(240)}
+        throttled = []
+
+        def batch_get_item(RequestItems):
+            keys = RequestItems['Customers']['Keys']
+            self.assertLessEqual(len(keys), 100)
+            # first attempt of every chunk leaves 3 keys unprocessed
+            if not any(k['customer_id']['S'] in throttled for k in keys):
+                throttled.extend(k['customer_id']['S'] for k in keys[-3:])
+                return self.batch_get_response(keys, unprocessed=3, known=known)
+            return self.batch_get_response(keys, known=known)
+        client.batch_get_item.side_effect = batch_get_item
+
+        ids = [f'customer{i:04d}' for i in range(250)]
+        event = {'resource': '/v1/api/customers:batchGet', 'httpMethod': 'POST',
+                 'body': json.dumps({'customer_ids': ids + ids[:50]})}
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 200)
+        body = json.loads(result['body'])
+        self.assertEqual([c['customer_id'] for c in body['customers']], ids[:240])
+        self.assertEqual(body['missing'], ids[240:])
+        self.assertNotIn('unprocessed', body)
+        # 3 chunks, each retried once
+        self.assertEqual(client.batch_get_item.call_count, 6)
+        self.assertEqual(mock_sleep.call_count, 3)
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.boto3.resource')
+    def test_batch_get_customers_still_unprocessed(self, mock_boto_resource, mock_sleep):
+        client = mock_boto_resource.return_value.meta.client
+        client.batch_get_item.side_effect = lambda RequestItems: self.batch_get_response(
+            RequestItems['Customers']['Keys'], unprocessed=1)
+
+        event = {'resource': '/v1/api/customers:batchGet', 'httpMethod': 'POST',
+                 'body': json.dumps({'customer_ids': ['customer1', 'customer2']})}
+        body = json.loads(lambda_handler(event, {})['body'])
+
+        self.assertEqual([c['customer_id'] for c in body['customers']], ['customer1'])
+        self.assertEqual(body['missing'], [])
+        self.assertEqual(body['unprocessed'], ['customer2'])
+        self.assertEqual(client.batch_get_item.call_count, lambda_function.BATCH_GET_MAX_ATTEMPTS)
+
+    @patch.dict('os.environ', {'CUSTOMER_CACHE_TTL': '60'})
+    @patch('lambda_function.boto3.resource')
+    def test_batch_get_customers_cache(self, mock_boto_resource):
+        client = mock_boto_resource.return_value.meta.client
+        client.batch_get_item.side_effect = lambda RequestItems: self.batch_get_response(
+            RequestItems['Customers']['Keys'])
+        self.addCleanup(lambda_function._customer_cache.clear)
+
+        event = {'resource': '/v1/api/customers:batchGet', 'httpMethod': 'POST',
+                 'body': json.dumps({'customer_ids': ['customer1', 'customer2']})}
+        lambda_handler(event, {})
+        event['body'] = json.dumps({'customer_ids': ['customer2', 'customer3']})
+        body = json.loads(lambda_handler(event, {})['body'])
+
+        self.assertEqual([c['customer_id'] for c in body['customers']], ['customer2', 'customer3'])
+        # second call only reads the customer it has not seen
+        keys = client.batch_get_item.call_args.kwargs['RequestItems']['Customers']['Keys']
+        self.assertEqual(keys, [{'customer_id': {'S': 'customer3'}}])
+
+        # get_customer is served from the same cache
+        get_event = {'resource': '/v1/api/customer/{customer_id}', 'httpMethod': 'GET',
+                     'pathParameters': {'customer_id': 'customer1'}}
+        self.assertEqual(lambda_handler(get_event, {})['statusCode'], 200)
+        mock_boto_resource.return_value.Table.return_value.get_item.assert_not_called()
+
+    def test_batch_get_customers_bad_body(self):
+        # email uniqueness markers do not match the customer_id pattern
+        for body in [None, '{}', 'not json', '{"customer_ids": []}', '{"customer_ids": "customer1"}',
+                     '{"customer_ids": ["customer1", "email#a@b.com"]}',
+                     json.dumps({'customer_ids': [f'customer{i}' for i in range(1001)]})]:
+            event = {'resource': '/v1/api/customers:batchGet', 'httpMethod': 'POST', 'body': body}
+            self.assertEqual(lambda_handler(event, {})['statusCode'], 400)
+
+    @patch('lambda_function.boto3.resource')
+    def test_process_payment_invalid_body(self, mock_boto_resource):
+        # every field error at once, nothing read from DynamoDB
+        event = {'resource': '/v1/api/payments', 'httpMethod': 'POST',
+                 'body': json.dumps({'customer_id': 'cust_1', 'email': 'test@example.com',
+                                     'amount': 0, 'currency': 'XYZ'})}
+        result = lambda_handler(event, {})
+
+        self.assertEqual(result['statusCode'], 400)
+        self.assertEqual(json.loads(result['body'])['errors'], [
+            'customer_id: must be at least 8 characters',
+            'customer_id: does not match ^[A-Za-z0-9]{8,20}$',
+            'amount: must be at least 1',
+            'currency: must be one of USD, INR, EUR, JPY, GBP',
+        ])
+        mock_boto_resource.assert_not_called()
+
+    def test_request_schemas_are_shared(self):
+        # both entry points compile the same schema files with the same module
+        import validation
+        self.assertEqual(sorted(lambda_function.REQUEST_VALIDATORS),
+                         ['customer_request', 'customers_batch_get', 'payments_request'])
+        self.assertTrue(os.path.samefile(validation.SCHEMA_DIR, os.path.join(os.path.dirname(__file__), '..', 'schemas')))
+        self.assertTrue(os.path.samefile(validation.__file__, os.path.join(os.path.dirname(__file__), '..', 'validation.py')))
+
+    @patch('lambda_function.boto3.resource')
+    def test_profiled_handler(self, mock_boto_resource):
+        import tempfile
+        mock_boto_resource.return_value.Table.return_value.get_item.return_value = {
+            'Item': {'customer_id': '123', 'email': 'test@example.com'}}
+        event = {'pathParameters': {'customer_id': '123'}, 'resource': '/v1/api/customer/{customer_id}',
+                 'httpMethod': 'GET', 'headers': {'X-Profile': '1'}}
+
+        with tempfile.TemporaryDirectory() as profile_dir, \
+                patch.object(lambda_function, 'PROFILE_HEADER', True), \
+                patch.object(lambda_function, 'PROFILE_DIR', profile_dir), \
+                patch('builtins.print') as mock_print:
+            result = lambda_function.profiled_handler(event, {})
+            self.assertEqual(result['statusCode'], 200)
+            self.assertEqual(len(os.listdir(profile_dir)), 1)
+
+            summary = json.loads(mock_print.call_args_list[-1].args[0])
+            self.assertEqual(summary['profile'], 'GET /v1/api/customer/{customer_id}')
+            self.assertEqual(summary['memory_budget_mb'], 128)
+            self.assertTrue(any('get_customer' in row[0] for row in summary['top']))
+
+            # not sampled: nothing profiled
+            mock_print.reset_mock()
+            event['headers'] = {}
+            lambda_function.profiled_handler(event, {})
+            self.assertFalse(any('"profile"' in str(c.args[0]) for c in mock_print.call_args_list if c.args))
+            self.assertEqual(len(os.listdir(profile_dir)), 1)
+
+    def test_profiling_off_by_default(self):
+        self.assertIs(lambda_function.lambda_handler, lambda_function.route_request)
+
+    def test_get_payments_in_window_bad_params(self):
+        for params in [None, {'from': 'yesterday', 'to': '2024-03-01T00:00:00Z'},
+                       {'from': '2024-03-02T00:00:00Z', 'to': '2024-03-01T00:00:00Z'},
+                       {'from': '2024-03-01T00:00:00Z', 'to': '2024-03-01T01:00:00Z', 'limit': '0'}]:
+            event = {'queryStringParameters': params, 'resource': '/v1/api/payments', 'httpMethod': 'GET'}
+            self.assertEqual(lambda_handler(event, {})['statusCode'], 400)
+
+    @patch.object(lambda_function, 'RESPONSE_COMPRESSION', True)
+    @patch('lambda_function.boto3.resource')
+    def test_payment_history_compressed(self, mock_boto_resource):
+        import gzip
+        mock_boto_resource.return_value.Table.return_value.get_item.return_value = {
+            'Item': {'customer_id': '123', 'email': 'test@example.com'}}
+        items = [{'customer_id': {'S': '123'}, 'payment_id': {'S': f'2024-01-01T00:00:{i:02d}Z'},
+                  'amount': {'N': '10.5'}, 'currency': {'S': 'USD'}} for i in range(60)]
+        mock_boto_resource.return_value.meta.client.query.return_value = {'Items': items}
+        event = {'pathParameters': {'customer_id': '123'}, 'resource': '/v1/api/payment/{customer_id}',
+                 'httpMethod': 'GET', 'headers': {'accept-encoding': 'gzip, deflate'}}
+
+        result = lambda_handler(event, {})
+        plain = lambda_handler(dict(event, headers={}), {})
+
+        self.assertTrue(result['isBase64Encoded'])
+        self.assertEqual(result['headers']['Content-Encoding'], 'gzip')
+        body = gzip.decompress(base64.b64decode(result['body'])).decode()
+        # byte for byte what json.dumps gives without compression
+        self.assertEqual(body, plain['body'])
+        self.assertEqual(json.loads(body)['count'], 60)
+        self.assertNotIn('isBase64Encoded', plain)
+
+    @patch.object(lambda_function, 'RESPONSE_COMPRESSION', True)
+    @patch('lambda_function.boto3.resource')
+    def test_small_and_refused_responses_not_compressed(self, mock_boto_resource):
+        mock_boto_resource.return_value.Table.return_value.get_item.return_value = {
+            'Item': {'customer_id': '123', 'email': 'test@example.com'}}
+        event = {'pathParameters': {'customer_id': '123'}, 'resource': '/v1/api/customer/{customer_id}',
+                 'httpMethod': 'GET', 'headers': {'Accept-Encoding': 'gzip'}}
+        self.assertNotIn('isBase64Encoded', lambda_handler(event, {}))
+
+        self.assertEqual(lambda_function.response_encoding({'headers': {'Accept-Encoding': 'gzip;q=0, identity'}}), None)
+        self.assertEqual(lambda_function.response_encoding({'headers': {'Accept-Encoding': '*'}}),
+                         'br' if response_encoding.brotli else 'gzip')
+        with patch.object(lambda_function, 'RESPONSE_COMPRESSION', False):
+            self.assertIsNone(lambda_function.response_encoding({'headers': {'Accept-Encoding': 'gzip'}}))
+
+    def test_base64_request_body(self):
+        # binary_media_types = ["*/*"] has API Gateway pass request bodies base64 encoded
+        body = json.dumps({'customer_id': 'customer1'})
+        self.assertEqual(lambda_function.request_body(
+            {'body': base64.b64encode(body.encode()).decode(), 'isBase64Encoded': True}), {'customer_id': 'customer1'})
+        self.assertIsNone(lambda_function.request_body({'body': '{not json'}))
+
     '''
     @patch('lambda_function.boto3.resource')
     @patch('lambda_function.requests.post')
@@ -103,14 +676,14 @@ class TestLambdaFunctions(unittest.TestCase):
         # Mock the response from DynamoDB for customer lookup
         mock_dynamo_table = MagicMock()
         mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
-        mock_dynamo_table.get_item.return_value = {'Item': {'customer_id': '123', 'email': 'test@example.com'}}
+        mock_dynamo_table.get_item.return_value = {'Item': {'customer_id': 'customer123', 'email': 'test@example.com'}}
 
         # Mock the PayPal API response
         mock_requests_post.return_value = MagicMock(status_code=201, text='{"id":"PAY-123"}')
 
         event = {
             'body': json.dumps({
-                'customer_id': '123',
+                'customer_id': 'customer123',
                 'email': 'test@example.com',
                 'amount': 100,
                 'currency': 'USD'
@@ -125,7 +698,7 @@ class TestLambdaFunctions(unittest.TestCase):
 
         # Assert the response
         self.assertEqual(result['statusCode'], 200)
-        self.assertIn('message : 123 payment successful', result['body'])
+        self.assertIn('message : customer123 payment successful', result['body'])
     '''
 
     @patch('lambda_function.boto3.resource')
@@ -139,14 +712,14 @@ class TestLambdaFunctions(unittest.TestCase):
         # Mock the response from DynamoDB for customer lookup
         mock_dynamo_table = MagicMock()
         mock_boto_resource.return_value.Table.return_value = mock_dynamo_table
-        mock_dynamo_table.get_item.return_value = {'Item': {'customer_id': '123', 'email': 'test@example.com'}}
+        mock_dynamo_table.get_item.return_value = {'Item': {'customer_id': 'customer123', 'email': 'test@example.com'}}
 
         # Mock a failed PayPal API response
         mock_requests_post.return_value = MagicMock(status_code=400, text='Error')
 
         event = {
             'body': json.dumps({
-                'customer_id': '123',
+                'customer_id': 'customer123',
                 'email': 'test@example.com',
                 'amount': 100,
                 'currency': 'USD'
@@ -186,6 +759,177 @@ class TestLambdaFunctions(unittest.TestCase):
         self.assertIsNone(token)
 
 
+def sqs_event(*bodies):
+    return {'Records': [{'messageId': f'm{i}', 'eventSource': 'aws:sqs', 'body': body} for i, body in enumerate(bodies)]}
+
+
+class TestDisbursementQueue(unittest.TestCase):
+
+    def setUp(self):
+        lambda_function._sqs_client = None
+
+    def tearDown(self):
+        lambda_function._sqs_client = None
+
+    @patch('lambda_function.boto3.client')
+    def test_queue_disbursement(self, mock_boto_client):
+        record = {'customer_id': '123', 'payment_id': '2024-01-01T00:00:00Z', 'amount': '10'}
+
+        # off without a queue url
+        self.assertFalse(lambda_function.queue_disbursement(record))
+        mock_boto_client.assert_not_called()
+
+        with patch.dict('os.environ', {'DISBURSEMENT_QUEUE_URL': 'https://sqs/journal'}):
+            self.assertTrue(lambda_function.queue_disbursement(record))
+            mock_boto_client.return_value.send_message.assert_called_once_with(
+                QueueUrl='https://sqs/journal', MessageBody=json.dumps(record))
+
+            # a failed send tells the caller to write the record itself
+            mock_boto_client.return_value.send_message.side_effect = ClientError(
+                {'Error': {'Code': 'ServiceUnavailable', 'Message': 'down'}}, 'SendMessage')
+            self.assertFalse(lambda_function.queue_disbursement(record))
+        # the client is built once per container
+        mock_boto_client.assert_called_once_with('sqs')
+
+    @patch('lambda_function.time.sleep')
+    @patch('lambda_function.boto3.resource')
+    def test_write_queued_disbursements(self, mock_boto_resource, mock_sleep):
+        client = mock_boto_resource.return_value.meta.client
+        first = json.dumps({'customer_id': '123#1', 'payment_id': 'p1', 'amount': '10.50', 'currency': 'USD'})
+        second = json.dumps({'customer_id': '456', 'payment_id': 'p2', 'amount': '20', 'currency': 'USD'})
+        # p2 stays throttled on every attempt
+        unprocessed = {'Disbursements': [{'PutRequest': {'Item': {
+            'customer_id': {'S': '456'}, 'payment_id': {'S': 'p2'}, 'amount': {'S': '20'}, 'currency': {'S': 'USD'}}}}]}
+        client.batch_write_item.return_value = {'UnprocessedItems': unprocessed}
+
+        # redelivered duplicate of p1 and a malformed message
+        result = lambda_handler(sqs_event(first, second, first, 'not json'), {})
+
+        request_items = client.batch_write_item.call_args_list[0].kwargs['RequestItems']
+        self.assertEqual(len(request_items['Disbursements']), 2)
+        self.assertEqual(client.batch_write_item.call_count, lambda_function.BATCH_WRITE_MAX_ATTEMPTS)
+        self.assertEqual(result, {'batchItemFailures': [{'itemIdentifier': 'm3'}, {'itemIdentifier': 'm1'}]})
+        # the payout summary follows the write: once for p1, under the customer, nothing for p2
+        update = mock_boto_resource.return_value.Table.return_value.update_item
+        update.assert_called_once()
+        self.assertEqual(update.call_args.kwargs['Key'], {'customer_id': '123'})
+        self.assertEqual(update.call_args.kwargs['ExpressionAttributeValues'][':amount'], Decimal('10.50'))
+
+    @patch('lambda_function.boto3.resource')
+    def test_batch_write_disbursements_chunks(self, mock_boto_resource):
+        client = MagicMock()
+        client.batch_write_item.return_value = {}
+        records = [{'customer_id': 'c', 'payment_id': str(i)} for i in range(60)]
+
+        self.assertEqual(lambda_function.batch_write_disbursements(client, records), [])
+        self.assertEqual([len(c.kwargs['RequestItems']['Disbursements']) for c in client.batch_write_item.call_args_list],
+                         [25, 25, 10])
+
+        client.batch_write_item.side_effect = ClientError(
+            {'Error': {'Code': 'InternalServerError', 'Message': 'down'}}, 'BatchWriteItem')
+        self.assertEqual(len(lambda_function.batch_write_disbursements(client, records)), 60)
+
+
+class TestMoney(unittest.TestCase):
+
+    def test_minor_units(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'schemas', 'payments_request.json')) as f:
+            currencies = json.load(f)['properties']['currency']['enum']
+        self.assertEqual(set(money.CURRENCY_EXPONENTS), set(currencies))
+
+        to_minor_units = lambda_function.to_minor_units
+        self.assertEqual(to_minor_units(100, 'USD'), 10000)
+        self.assertEqual(to_minor_units(10.15, 'EUR'), 1015)
+        self.assertEqual(to_minor_units('10.5', 'GBP'), 1050)
+        self.assertEqual(to_minor_units('10', 'USD'), 1000)
+        self.assertEqual(to_minor_units('-0.05', 'INR'), -5)
+        self.assertEqual(to_minor_units(Decimal('1E+3'), 'JPY'), 1000)
+        self.assertEqual(lambda_function.minor_units_str(1050, 'USD'), '10.50')
+        self.assertEqual(lambda_function.minor_units_str(1000, 'JPY'), '1000')
+        self.assertEqual(lambda_function.minor_units_decimal(1015, 'EUR'), Decimal('10.15'))
+        for amount, currency in [(10.155, 'USD'), ('100.5', 'JPY'), (float('inf'), 'USD'), ('ten', 'USD'),
+                                 (True, 'USD'), (10, 'XXX')]:
+            with self.assertRaises(ValueError):
+                to_minor_units(amount, currency)
+
+    def test_numpy_not_loaded_by_handler(self):
+        # a fresh interpreter: only the first MoneyColumns imports numpy, not a cold start
+        code = 'import sys, lambda_function; print("numpy" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_money_columns(self):
+        amounts = [('10.50', 'USD'), (1000, 'JPY'), ('0.50', 'USD'), ('2000000', 'EUR'), (0.99, 'GBP'), ('1', 'JPY')]
+        for numpy in [money.load_numpy(), None]:
+            with patch.object(money, 'numpy', numpy):
+                columns = money.MoneyColumns()
+                for amount, currency in amounts:
+                    columns.append(amount, currency)
+                with self.assertRaises(ValueError):
+                    columns.append('1.001', 'USD')
+
+                self.assertEqual(len(columns), 6)
+                self.assertEqual(columns.totals(), {'USD': 1100, 'EUR': 200000000, 'JPY': 1001, 'GBP': 99})
+                # the payments_request range, 1 to 1000000 of each currency
+                self.assertEqual(columns.out_of_range(1, 1000000), [2, 3, 4])
+
+    def test_money_columns_extend(self):
+        strings = [('10.50', 'USD'), ('1000', 'JPY'), ('-0.05', 'INR'), ('10.5', 'EUR'), ('1e3', 'GBP')]
+        batches = [strings, strings + [(0.99, 'GBP')], strings + [('12345678901234.56', 'USD')]]
+        for numpy in [money.load_numpy(), None]:
+            with patch.object(money, 'numpy', numpy):
+                for rows in batches:
+                    columns = money.MoneyColumns()
+                    columns.extend(iter(rows))
+                    self.assertEqual(list(columns.minor), [lambda_function.to_minor_units(*row) for row in rows])
+                    self.assertEqual(list(columns.codes), [money.CURRENCY_CODES[c] for _, c in rows])
+                # a refused amount stops the batch where the loop gets to it
+                for bad in [('10.505', 'USD'), ('1.5', 'JPY'), ('nan', 'USD'), ('10', 'XXX')]:
+                    columns = money.MoneyColumns()
+                    with self.assertRaises(ValueError):
+                        columns.extend(strings + [bad] + strings)
+                    self.assertEqual(len(columns), len(strings))
+
+    @patch('lambda_function.get_access_token', return_value=('token', 200, None))
+    @patch('lambda_function.boto3.resource')
+    @patch('lambda_function.requests.post')
+    @patch.dict('os.environ', {'PAYPAL_SANDBOX_URL': 'https://sandbox.paypal.com'})
+    def test_process_payment_amounts(self, mock_requests_post, mock_boto_resource, mock_token):
+        tables = {'Customers': MagicMock(), 'Disbursements': MagicMock(), 'PayoutSummaries': MagicMock()}
+        mock_boto_resource.return_value.Table.side_effect = tables.get
+        tables['Customers'].get_item.return_value = {'Item': {'customer_id': 'customer123', 'email': 'test@example.com'}}
+        tables['Disbursements'].put_item.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        mock_requests_post.return_value = MagicMock(status_code=201, text='{"id": "PAYID-1"}')
+        payment = {'customer_id': 'customer123', 'email': 'test@example.com', 'amount': 100.5, 'currency': 'USD'}
+
+        result = lambda_handler({'resource': '/v1/api/payments', 'httpMethod': 'POST',
+                                 'body': json.dumps(payment)}, {})
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(mock_requests_post.call_args.kwargs['json']['transactions'][0]['amount'],
+                         {'total': '100.50', 'currency': 'USD'})
+        self.assertEqual(tables['Disbursements'].put_item.call_args.kwargs['Item']['amount'], '100.50')
+        self.assertEqual(tables['PayoutSummaries'].update_item.call_args.kwargs['ExpressionAttributeValues'][':amount'],
+                         Decimal('100.50'))
+
+        # yen have no minor unit, refused before PayPal is called
+        result = lambda_handler({'resource': '/v1/api/payments', 'httpMethod': 'POST',
+                                 'body': json.dumps(dict(payment, currency='JPY'))}, {})
+        self.assertEqual(result['statusCode'], 400)
+        self.assertEqual(json.loads(result['body'])['errors'], ['amount: must be a whole number of JPY'])
+        self.assertEqual(mock_requests_post.call_count, 1)
+
+        # queued: the queue consumer writes the record and the summary, not the request
+        tables['Disbursements'].reset_mock()
+        tables['PayoutSummaries'].reset_mock()
+        with patch('lambda_function.queue_disbursement', return_value=True):
+            result = lambda_handler({'resource': '/v1/api/payments', 'httpMethod': 'POST',
+                                     'body': json.dumps(payment)}, {})
+        self.assertEqual(result['statusCode'], 200)
+        tables['Disbursements'].put_item.assert_not_called()
+        tables['PayoutSummaries'].update_item.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,78 @@
+#
+# run: pytest -v
+#
+
+import unittest
+from unittest.mock import MagicMock, patch
+from decimal import Decimal
+from rebuild_payout_summaries import summarize_payments, rebuild_all, rebuild_customers
+
+class TestRebuildPayoutSummaries(unittest.TestCase):
+
+    def test_summarize_payments(self):
+        payments = [
+            {'customer_id': '123', 'payment_id': 'p1', 'amount': '10.10', 'currency': 'USD', 'status': 'Completed'},
+            {'customer_id': '123#2', 'payment_id': 'p3', 'amount': '5', 'currency': 'USD', 'status': 'Completed'},
+            {'customer_id': '123#1', 'payment_id': 'p2', 'amount': '7', 'currency': 'EUR', 'status': 'Completed'},
+            {'customer_id': '123', 'payment_id': 'p4', 'amount': '99', 'currency': 'USD', 'status': 'Failed'},
+            {'customer_id': '456', 'payment_id': 'p5', 'amount': '1', 'currency': 'GBP', 'status': 'Completed'},
+        ]
+
+        summaries = summarize_payments(payments)
+
+        # shards fold into the customer, failed payments are left out
+        self.assertEqual(summaries['123'], {
+            'customer_id': '123', 'payment_count': 3,
+            'count_USD': 2, 'total_USD': Decimal('15.10'),
+            'count_EUR': 1, 'total_EUR': Decimal('7'),
+            'last_payment_at': 'p3'
+        })
+        self.assertEqual(summaries['456']['total_GBP'], Decimal('1'))
+
+    def test_summarize_unreadable_amounts(self):
+        # older rows: more decimals than the currency has, a currency minor units do not know
+        payments = [
+            {'customer_id': '123', 'payment_id': 'p1', 'amount': '10.10', 'currency': 'USD', 'status': 'Completed'},
+            {'customer_id': '123', 'payment_id': 'p2', 'amount': Decimal('10.505'), 'currency': 'USD', 'status': 'Completed'},
+            {'customer_id': '123', 'payment_id': 'p3', 'amount': Decimal('3.25'), 'currency': 'CAD', 'status': 'Completed'},
+            {'customer_id': '456', 'payment_id': 'p4', 'amount': '1', 'currency': 'GBP', 'status': 'Completed'},
+        ]
+
+        with patch('builtins.print') as mock_print:
+            summaries = summarize_payments(payments)
+
+        # the backfill carries on, the unreadable rows are reported and left out
+        self.assertEqual(summaries['123']['payment_count'], 1)
+        self.assertEqual(summaries['123']['total_USD'], Decimal('10.10'))
+        self.assertNotIn('total_CAD', summaries['123'])
+        self.assertNotIn('count_CAD', summaries['123'])
+        self.assertEqual(summaries['123']['last_payment_at'], 'p1')
+        self.assertEqual(summaries['456']['total_GBP'], Decimal('1'))
+        self.assertEqual(mock_print.call_count, 2)
+
+    def test_rebuild_all_paginates_scan(self):
+        dynamodb = MagicMock()
+        dynamodb.Table.return_value.scan.side_effect = [
+            {'Items': [{'customer_id': '123', 'payment_id': 'p1', 'amount': '1', 'currency': 'USD', 'status': 'Completed'}],
+             'LastEvaluatedKey': {'customer_id': '123', 'payment_id': 'p1'}},
+            {'Items': [{'customer_id': '123', 'payment_id': 'p2', 'amount': '2', 'currency': 'USD', 'status': 'Completed'}]},
+        ]
+
+        summaries = rebuild_all(dynamodb)
+
+        self.assertEqual(summaries['123']['total_USD'], Decimal('3'))
+        self.assertEqual(dynamodb.Table.return_value.scan.call_count, 2)
+
+    def test_rebuild_customer_without_payments(self):
+        dynamodb = MagicMock()
+        dynamodb.Table.return_value.get_item.return_value = {'Item': {'customer_id': '123'}}
+        dynamodb.meta.client.query.return_value = {'Items': []}
+
+        summaries = rebuild_customers(dynamodb, ['123'])
+
+        # stale totals get reset
+        self.assertEqual(summaries, {'123': {'customer_id': '123', 'payment_count': 0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
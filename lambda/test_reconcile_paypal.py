@@ -0,0 +1,153 @@
+#
+# run: pytest -v
+#
+
+import unittest
+from unittest.mock import MagicMock, patch
+import io
+import json
+import os
+import tempfile
+from reconcile_paypal import Reconciler, in_window, iter_paypal_payments, iter_disbursements_scan
+import reconcile_paypal
+from lambda_function import payment_id_time
+
+def disbursement(paypal_id, amount='10', currency='USD', status='Completed', payment_id='p'):
+    record = {'customer_id': 'cust1', 'payment_id': payment_id, 'amount': amount,
+              'currency': currency, 'status': status}
+    if paypal_id:
+        record['paypal_payment_id'] = paypal_id
+    return record
+
+def paypal(paypal_id, total='10.00', currency='USD', state='created'):
+    return {'id': paypal_id, 'state': state,
+            'transactions': [{'amount': {'total': total, 'currency': currency}}]}
+
+class TestReconcilePaypal(unittest.TestCase):
+
+    def run_reconcile(self, disbursements, payments, partitions=4):
+        report = io.StringIO()
+        summary = Reconciler(report, partitions).run(iter(disbursements), iter(payments))
+        findings = [json.loads(line) for line in report.getvalue().splitlines()]
+        return summary, findings
+
+    def test_all_findings(self):
+        disbursements = [
+            disbursement('PAY-OK'),
+            disbursement('PAY-AMOUNT', amount='10'),
+            disbursement('PAY-CURRENCY', currency='EUR'),
+            disbursement('PAY-FAILED'),
+            disbursement('PAY-GONE'),
+            disbursement(None, payment_id='legacy'),
+            disbursement('PAY-DUP', payment_id='d1'),
+            disbursement('PAY-DUP', payment_id='d2'),
+        ]
+        payments = [
+            paypal('PAY-OK', total='10.00'),
+            paypal('PAY-AMOUNT', total='12.00'),
+            paypal('PAY-CURRENCY'),
+            paypal('PAY-FAILED', state='failed'),
+            paypal('PAY-ORPHAN'),
+            paypal('PAY-DUP'),
+        ]
+
+        summary, findings = self.run_reconcile(disbursements, payments)
+
+        self.assertEqual(summary['disbursements'], 8)
+        self.assertEqual(summary['paypal_payments'], 6)
+        self.assertEqual(summary['findings'], {
+            'amount_drift': 1, 'currency_drift': 1, 'status_drift': 1,
+            'missing_in_paypal': 1, 'missing_in_disbursements': 1,
+            'missing_paypal_id': 1, 'duplicate_disbursement': 1,
+        })
+        by_kind = {f['finding']: f for f in findings}
+        self.assertEqual(by_kind['missing_in_disbursements']['paypal']['id'], 'PAY-ORPHAN')
+        self.assertEqual(by_kind['missing_in_paypal']['disbursement']['id'], 'PAY-GONE')
+        # 10 and 10.00 are the same amount
+        self.assertNotIn('PAY-OK', [f['disbursement']['id'] for f in findings if f['disbursement']])
+        # control totals of the rows with a PayPal id, the 2.00 apart is the amount drift
+        self.assertEqual(summary['totals'], {'disbursements': {'EUR': '10.00', 'USD': '60.00'},
+                                             'paypal': {'USD': '62.00'}})
+
+    def test_partition_count_does_not_change_result(self):
+        disbursements = [disbursement(f'PAY-{i}', amount=str(i)) for i in range(200)]
+        payments = [paypal(f'PAY-{i}', total=str(i + (i % 7 == 0))) for i in range(200)]
+
+        one, _ = self.run_reconcile(disbursements, payments, partitions=1)
+        many, _ = self.run_reconcile(disbursements, payments, partitions=16)
+
+        self.assertEqual(one, many)
+        self.assertEqual(one['findings'], {'amount_drift': 29})
+
+    def test_unreadable_amounts_left_out_of_totals(self):
+        amounts = ['10', 'x', '1.001', '5', '2.50']
+        disbursements = [disbursement(f'PAY-{i}', amount=a) for i, a in enumerate(amounts)]
+        payments = [paypal(f'PAY-{i}', total='10.00') for i in range(len(amounts))]
+
+        summary, findings = self.run_reconcile(disbursements, payments, partitions=1)
+
+        self.assertEqual(summary['totals']['disbursements'], {'USD': '17.50'})
+        self.assertEqual(summary['findings'], {'amount_drift': 4, 'unreadable_amount': 2})
+        self.assertEqual(sorted(f['disbursement']['amount'] for f in findings
+                                if f['finding'] == 'unreadable_amount'), ['1.001', 'x'])
+
+    def test_paypal_listing_pages(self):
+        pages = [
+            {'payments': [paypal('PAY-1'), paypal('PAY-2')], 'next_id': 'PAY-3'},
+            {'payments': [paypal('PAY-3')]},
+        ]
+        http = MagicMock()
+        http.get.side_effect = [MagicMock(status_code=200, json=MagicMock(return_value=p)) for p in pages]
+
+        ids = [p['id'] for p in iter_paypal_payments(http, 'https://sandbox', 'token', 'start', 'end')]
+
+        self.assertEqual(ids, ['PAY-1', 'PAY-2', 'PAY-3'])
+        self.assertEqual(http.get.call_args_list[1].kwargs['params']['start_id'], 'PAY-3')
+
+    def test_window_applies_to_disbursements(self):
+        payment_ids = ['2023-12-31T23:59:59.999999+00:00Z', '2024-01-01T00:00:00+00:00Z',
+                       '2024-01-15T12:00:00.5Z', '2024-02-01T00:00:00+00:00Z', 'legacy']
+        disbursements = [disbursement(f'PAY-{i}', payment_id=p) for i, p in enumerate(payment_ids)]
+        start, end = payment_id_time('2024-01-01T00:00:00Z'), payment_id_time('2024-02-01T00:00:00Z')
+        self.assertEqual([r['payment_id'] for r in in_window(disbursements, start, end)],
+                         payment_ids[1:3] + ['legacy'])
+        self.assertEqual(len(list(in_window(disbursements, end=start))), 2)
+
+        # the listing only has the payments of the window, the rows around it are not missing
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, 'export'))
+            with open(os.path.join(d, 'export', 'part-0000.ndjson'), 'w') as f:
+                f.writelines(json.dumps(r) + '\n' for r in disbursements[:4])
+            with open(os.path.join(d, 'paypal.ndjson'), 'w') as f:
+                f.writelines(json.dumps(paypal(f'PAY-{i}', total='10')) + '\n' for i in (1, 2))
+            argv = ['reconcile_paypal.py', '--disbursements-export', os.path.join(d, 'export'),
+                    '--paypal-file', os.path.join(d, 'paypal.ndjson'), '--report', os.path.join(d, 'report.ndjson'),
+                    '--start-time', '2024-01-01T00:00:00Z', '--end-time', '2024-02-01T00:00:00Z']
+            with patch('sys.argv', argv), patch('builtins.print'):
+                reconcile_paypal.main()
+            with open(os.path.join(d, 'report.ndjson')) as f:
+                self.assertEqual(f.read(), '')
+
+            # a bad time is a usage error before the run, not a traceback from inside it
+            argv[-1] = 'February'
+            with patch('sys.argv', argv), patch('sys.stderr', io.StringIO()) as stderr, \
+                    patch.object(reconcile_paypal, 'Reconciler') as mock_reconciler:
+                with self.assertRaises(SystemExit) as raised:
+                    reconcile_paypal.main()
+            self.assertEqual(raised.exception.code, 2)
+            self.assertIn('--end-time', stderr.getvalue())
+            mock_reconciler.assert_not_called()
+
+    def test_disbursements_scan(self):
+        client = MagicMock()
+        client.scan.side_effect = lambda **kwargs: {'Items': [
+            {'customer_id': {'S': f"cust{kwargs['Segment']}#1"}, 'payment_id': {'S': 'p'}}
+        ]}
+
+        rows = list(iter_disbursements_scan(client, total_segments=3))
+
+        self.assertEqual(sorted(r['customer_id'] for r in rows), ['cust0', 'cust1', 'cust2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
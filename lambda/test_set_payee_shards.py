@@ -0,0 +1,40 @@
+#
+# run: pytest -v
+#
+
+import unittest
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from set_payee_shards import set_payee_shards
+
+class TestSetPayeeShards(unittest.TestCase):
+
+    def test_raise_shards(self):
+        customer_table = MagicMock()
+
+        set_payee_shards(customer_table, '123', 8)
+
+        # a single update sets the count and the high-water mark
+        customer_table.update_item.assert_called_once()
+        self.assertIn('disbursement_shards_max = :n', customer_table.update_item.call_args.kwargs['UpdateExpression'])
+
+    def test_lower_shards_keeps_high_water_mark(self):
+        customer_table = MagicMock()
+        customer_table.update_item.side_effect = [
+            ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'}}, 'UpdateItem'),
+            {}
+        ]
+
+        set_payee_shards(customer_table, '123', 2)
+
+        self.assertEqual(customer_table.update_item.call_count, 2)
+        fallback = customer_table.update_item.call_args.kwargs
+        self.assertEqual(fallback['UpdateExpression'], 'SET disbursement_shards = :n ADD version :one')
+
+    def test_invalid_shards(self):
+        with self.assertRaises(ValueError):
+            set_payee_shards(MagicMock(), '123', 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#
+# Money as integer minor units (cents, paise, pence; yen have none), shared by the Flask
+# app, the lambda and the lambda's batch jobs. build_lambda_zip.sh copies it into the zip.
+#
+# CURRENCY_EXPONENTS covers the currencies of schemas/payments_request.json: digits after
+# the decimal point of each. A request amount is turned into minor units once, which also
+# refuses amounts the currency cannot hold (10.505 USD, 100.5 JPY) instead of letting
+# PayPal reject them. The provider gets the amount as the decimal string PayPal takes as
+# a transaction total ('10.50', '1000' for JPY), and Disbursements stores that same string.
+#
+# Batch jobs that keep many amounts at once (reconcile_paypal.py, per partition) hold
+# them in a MoneyColumns: an int64 array of minor units and a parallel array of currency
+# codes. rebuild_payout_summaries.py needs no column, it adds each payment's minor units
+# to a running total per customer and currency as it reads them.
+# Totals and range checks over a column are numpy expressions when numpy is installed,
+# and plain integer loops otherwise. numpy is opt-in: it is not in lambda/requirements.txt,
+# so the Lambda zip does not ship it, and lambda/requirements-batch.txt adds it for the
+# batch jobs. Either way no amount goes through Decimal after it is parsed. numpy is only
+# imported by the first MoneyColumns, never on import of this module, so the payment
+# handlers, which only use the scalar helpers, do not pay for it on a cold start.
+#
+
+from array import array
+from decimal import Decimal, InvalidOperation
+
+CURRENCY_EXPONENTS = {'USD': 2, 'INR': 2, 'EUR': 2, 'JPY': 0, 'GBP': 2}
+# currency code of MoneyColumns: index into CURRENCIES
+CURRENCIES = list(CURRENCY_EXPONENTS)
+CURRENCY_CODES = {currency: code for code, currency in enumerate(CURRENCIES)}
+
+# the numpy module once load_numpy() has found it, None without numpy
+numpy = None
+_numpy_loaded = False
+
+
+# the numpy module, or None when it is not installed. Imported on first use only.
+def load_numpy():
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+        _numpy_loaded = True
+    return numpy
+
+
+def _exponent(currency):
+    try:
+        return CURRENCY_EXPONENTS[currency]
+    except (KeyError, TypeError):
+        raise ValueError(f'unknown currency {currency}') from None
+
+
+def _too_precise(currency, exponent):
+    if exponent == 0:
+        return ValueError(f'must be a whole number of {currency}')
+    return ValueError(f'must have at most {exponent} decimals in {currency}')
+
+
+# minor units of amount (int, float, Decimal or decimal string) in currency, ValueError
+# for an amount with more decimals than the currency has or that is not a finite number
+def to_minor_units(amount, currency):
+    exponent = _exponent(currency)
+    scale = 10 ** exponent
+    kind = type(amount)
+    if kind is int:
+        return amount * scale
+    if kind is float:
+        try:
+            minor = round(amount * scale)
+        except (ValueError, OverflowError):
+            raise ValueError(f'{amount} is not a number') from None
+        # the division is correctly rounded, so it gives back the very same float only
+        # when amount has no more than exponent decimals
+        if minor / scale != amount:
+            raise _too_precise(currency, exponent)
+        return minor
+    if kind is str:
+        # '10.50' as minor_units_str() writes it: a single int()
+        if exponent and amount.find('.') == len(amount) - exponent - 1 >= 0 and amount[-1:].isdigit():
+            try:
+                return int(amount.replace('.', '', 1))
+            except ValueError:
+                pass
+        # '10.5' or '10' without going through Decimal, anything else ('1e3', '10.500') below
+        digits = amount[1:] if amount[:1] == '-' else amount
+        whole, _, frac = digits.partition('.')
+        if whole.isdigit() and whole.isascii() and len(frac) <= exponent and (
+                not frac or frac.isdigit() and frac.isascii()):
+            minor = int(whole) * scale + (int(frac) * 10 ** (exponent - len(frac)) if frac else 0)
+            return -minor if digits is not amount else minor
+    if kind is bool:
+        raise ValueError(f'{amount} is not a number')
+    try:
+        value = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+        minor = value.scaleb(exponent)
+        if not minor.is_finite():
+            raise ValueError(f'{amount} is not a number')
+        if minor != minor.to_integral_value():
+            raise _too_precise(currency, exponent)
+    except InvalidOperation:
+        raise ValueError(f'{amount} is not a number') from None
+    return int(minor)
+
+
+# '10.50', '-0.05', '1000' for JPY
+def minor_units_str(minor, currency):
+    exponent = _exponent(currency)
+    if exponent == 0:
+        return str(minor)
+    whole, frac = divmod(abs(minor), 10 ** exponent)
+    return f"{'-' if minor < 0 else ''}{whole}.{frac:0{exponent}d}"
+
+
+# Decimal('10.50'), for DynamoDB numbers and summed totals
+def minor_units_decimal(minor, currency):
+    return Decimal(minor).scaleb(-_exponent(currency))
+
+
+class MoneyColumns:
+    """
+    many amounts as two parallel columns, minor units (int64) and currency codes.
+    """
+
+    def __init__(self):
+        load_numpy()
+        self.minor = array('q')
+        self.codes = array('B')
+
+    def __len__(self):
+        return len(self.minor)
+
+    def append(self, amount, currency):
+        # the currency is checked before anything is appended, so both columns stay aligned
+        minor = to_minor_units(amount, currency)
+        self.minor.append(minor)
+        self.codes.append(CURRENCY_CODES[currency])
+
+    def extend(self, rows):
+        """
+        append the (amount, currency) pairs of rows, stopping at the first ValueError.
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        if numpy is not None and rows and self._extend_strings(rows):
+            return
+        minor, codes = self.minor, self.codes
+        for amount, currency in rows:
+            value = to_minor_units(amount, currency)
+            minor.append(value)
+            codes.append(CURRENCY_CODES[currency])
+
+    def _extend_strings(self, rows):
+        # a whole batch of decimal strings parsed at once: float() per amount, then the
+        # same check as to_minor_units() for floats, over the whole column. 15 characters
+        # hold at most 15 significant digits, which a float keeps apart, and under 2**53
+        # the minor units are exact. Anything else is left to the loop in extend().
+        amounts, currencies = zip(*rows)
+        if set(map(type, amounts)) != {str} or max(map(len, amounts)) > 15:
+            return False
+        try:
+            codes = numpy.fromiter(map(CURRENCY_CODES.__getitem__, currencies), numpy.uint8, len(rows))
+            values = numpy.fromiter(map(float, amounts), numpy.float64, len(rows))
+        except (KeyError, TypeError, ValueError):
+            return False
+        scales = numpy.array([10.0 ** CURRENCY_EXPONENTS[currency] for currency in CURRENCIES])[codes]
+        with numpy.errstate(invalid='ignore'):
+            minor = numpy.rint(values * scales)
+            if not ((minor / scales == values) & (numpy.abs(minor) < 2.0 ** 53)).all():
+                return False
+        self.minor.frombytes(minor.astype(numpy.int64).tobytes())
+        self.codes.frombytes(codes.tobytes())
+        return True
+
+    def totals(self):
+        """
+        {currency: total in minor units} of the currencies present.
+        """
+        if numpy is not None:
+            minor = numpy.frombuffer(self.minor, dtype=numpy.int64)
+            codes = numpy.frombuffer(self.codes, dtype=numpy.uint8)
+            return {CURRENCIES[code]: int(minor[codes == code].sum()) for code in numpy.unique(codes).tolist()}
+        totals = {}
+        for minor, code in zip(self.minor, self.codes):
+            totals[code] = totals.get(code, 0) + minor
+        return {CURRENCIES[code]: total for code, total in sorted(totals.items())}
+
+    def out_of_range(self, low, high):
+        """
+        indexes of the amounts below low or above high, both in units of each amount's currency.
+        """
+        lows = [to_minor_units(low, currency) for currency in CURRENCIES]
+        highs = [to_minor_units(high, currency) for currency in CURRENCIES]
+        if numpy is not None:
+            minor = numpy.frombuffer(self.minor, dtype=numpy.int64)
+            codes = numpy.frombuffer(self.codes, dtype=numpy.uint8)
+            bad = (minor < numpy.array(lows, dtype=numpy.int64)[codes]) | \
+                  (minor > numpy.array(highs, dtype=numpy.int64)[codes])
+            return numpy.flatnonzero(bad).tolist()
+        return [i for i, (minor, code) in enumerate(zip(self.minor, self.codes))
+                if minor < lows[code] or minor > highs[code]]
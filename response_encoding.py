@@ -0,0 +1,117 @@
+#
+# Response compression shared by the lambda and the Flask app.
+#
+# accepted_encoding() negotiates the encoding from Accept-Encoding: br when the client
+# takes it and the brotli module is installed, else gzip, honouring q-values (q=0
+# refuses an encoding). json_chunks() encodes a JSON body a row at a time, and
+# compressed() passes those rows through a streaming compressor in STREAM_CHUNK_BYTES
+# pieces, so the uncompressed text never exists as one string.
+#
+# The entry points wire it up: Flask/compression.py sends the pieces to the client as
+# they come (chunked transfer encoding), lambda_function.py joins them into its base64
+# response body. build_lambda_zip.sh copies this file into the zip.
+#
+
+import json
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+# quality 5 compresses JSON better than gzip -6 at about the same speed, 11 is far slower
+BROTLI_QUALITY = 5
+# the compressor is fed, and streamed responses are written, in pieces of about this size
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def accepted_encoding(accept_encoding):
+    # 'br', 'gzip' or None for an Accept-Encoding header value
+    offers = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        offers[name.strip().lower()] = q
+    wildcard = offers.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        q = offers.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def new_compressor(encoding):
+    # (compress, finish) functions of a streaming br or gzip compressor
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    # wbits 31: gzip container
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def json_chunks(obj, encoder):
+    # the text of encoder.encode(obj) for a dict obj, with its top level lists encoded one
+    # row at a time. The separators and key order follow the encoder, so the result is
+    # byte for byte what jsonify or json.dumps would give with the same settings.
+    dumps = encoder.encode
+    items = sorted(obj.items()) if encoder.sort_keys else obj.items()
+    yield '{'
+    for i, (key, value) in enumerate(items):
+        yield f'{encoder.item_separator if i else ""}{dumps(key)}{encoder.key_separator}'
+        if isinstance(value, list):
+            yield '['
+            for j, row in enumerate(value):
+                yield f'{encoder.item_separator}{dumps(row)}' if j else dumps(row)
+            yield ']'
+        else:
+            yield dumps(value)
+    yield '}'
+
+
+def read_head(chunks, min_bytes):
+    # (head, done): the first byte chunks, at least min_bytes of them unless the
+    # iterator ends first, in which case done is True and head is the whole body
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_bytes:
+            return head, False
+    return head, True
+
+
+def batched(head, chunks):
+    # head and the rest of chunks, joined into STREAM_CHUNK_BYTES pieces
+    buffer = list(head)
+    size = sum(len(chunk) for chunk in buffer)
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_BYTES:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def compressed(head, chunks, encoding):
+    # the compressed body of head and chunks, a piece at a time. The compressor buffers
+    # internally and only returns output in blocks.
+    compress, finish = new_compressor(encoding)
+    for piece in batched(head, chunks):
+        out = compress(piece)
+        if out:
+            yield out
+    yield finish()